@@ -1,30 +1,36 @@
 # -*- coding: utf-8 -*-
 import os
 import json
-import re
-import requests
 import logging
-import traceback
 import datetime
-import threading
 import base64
-import random
 import uuid
-import unidecode # Necessita 'pip install unidecode'
+import time
 from email.mime.text import MIMEText
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, Response, stream_with_context, g, send_file, abort
 from dotenv import load_dotenv
 from google_auth_oauthlib.flow import Flow
-import google.oauth2.credentials
 import googleapiclient.discovery
-import google.auth.transport.requests # Necessário para refresh de tokens
+import googleapiclient.errors
 # NEW IMPORTS FOR AUTOMATION
-import sqlite3
-from automation.database import get_pending_draft, update_draft_status, save_user_credentials, get_user_credentials, is_thread_processed, mark_thread_as_processed, get_dashboard_stats, get_draft_by_id, update_draft_body
+from automation.database import get_pending_draft, get_pending_drafts, update_draft_status, update_drafts_status, save_user_credentials, get_dashboard_stats, parse_dashboard_cursor, get_draft_by_id, update_draft_body, save_last_history_id, record_pubsub_delivery, forget_pubsub_delivery, record_persona_choice, DASHBOARD_PAGE_SIZE
+from automation.gmail_client import get_gmail_client, invalidate_gmail_client, credentials_to_dict
+from automation.events import stream_draft_events
+from core.ontology import ontology_file_lock, load_ontology_file, save_ontology_file, get_ontology, get_snapshot
+from core.gemini import GEMINI_API_KEY, call_gemini
+from core.mime import extract_body
+from core.reply_parser import strip_quoted_reply
+from core.retrieval import find_relevant_knowledge
+from core.text import JSON_OBJECT_RE
+from core.metrics import render_metrics, stage_timer
+from core.tracing import begin_span, set_service_name, TRACEPARENT_HEADER
+from core.profiling import profiled, list_profiles, profile_file_path, profile_summary, PROFILE_SAMPLE_RATE, PROFILER
+from core.prompts import (
+    parse_sender_info, is_scheduling_request, without_scheduling_rules, build_context_block,
+    build_draft_prompt, clean_draft_text, DEFAULT_TASK_INSTRUCTION, SCHEDULING_TASK_INSTRUCTION, DEFAULT_GUIDANCE_SUMMARY
+)
 from werkzeug.middleware.proxy_fix import ProxyFix
 
-from sentence_transformers import SentenceTransformer, util
-import torch
 
 # --- CONFIGURAÇÃO INICIAL E CONSTANTES ---
 os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
@@ -34,17 +40,24 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [%
 
 APP_HOST = os.environ.get('APP_HOST', '127.0.0.1')
 APP_PORT = int(os.environ.get('APP_PORT', 5001))
-GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
-GEMINI_MODEL = os.environ.get('GEMINI_MODEL', 'gemini-2.5-flash-lite')
 DEBUG_MODE = os.environ.get('FLASK_DEBUG', 'False').lower() == 'true'
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-ONTOLOGY_FILE = os.path.join(BASE_DIR, 'personas2.0.json')
 CLIENT_SECRETS_FILE = os.path.join(BASE_DIR, 'client_secret.json')
-DATABASE_FILE = os.path.join(BASE_DIR, 'automation.db')
 
-# Carrega o modelo de embedding uma vez para toda a aplicação
-embedding_model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
+# Paginação da caixa de entrada. A Google recomenda lotes de no máximo 50 pedidos.
+INBOX_PAGE_SIZE = int(os.environ.get('INBOX_PAGE_SIZE', 15))
+GMAIL_BATCH_LIMIT = 50
+# Itens de um batch que falham com 429/5xx são repetidos num batch menor, com backoff exponencial.
+INBOX_BATCH_RETRIES = int(os.environ.get('INBOX_BATCH_RETRIES', 2))
+INBOX_BATCH_RETRY_DELAY = float(os.environ.get('INBOX_BATCH_RETRY_DELAY', 0.5))
+GMAIL_TRANSIENT_STATUSES = {429, 500, 502, 503, 504}
+# Operações em massa do dashboard: máximo de rascunhos por pedido e de envios por pedido batch
+# ao Gmail (os envios contam muito para a quota por utilizador, por isso o lote é menor).
+BULK_DRAFTS_LIMIT = 500
+GMAIL_SEND_BATCH_SIZE = int(os.environ.get('GMAIL_SEND_BATCH_SIZE', 10))
+# Contas com acesso às rotas /admin (lista separada por vírgulas; vazia desativa-as).
+ADMIN_EMAILS = {email.strip().lower() for email in os.environ.get('ADMIN_EMAILS', '').split(',') if email.strip()}
 
 app = Flask(__name__)
 app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1) 
@@ -53,6 +66,31 @@ app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'uma-chave-secreta-para-sess
 if DEBUG_MODE:
     app.logger.setLevel(logging.DEBUG)
 
+# --- RASTREAMENTO ---
+# Um span por pedido, que continua o trace de um 'traceparent' recebido. O contexto segue
+# depois para as tarefas Celery enfileiradas pelo pedido (ex: o webhook do Gmail).
+set_service_name('web')
+UNTRACED_ENDPOINTS = {'static', 'metrics_route', 'dashboard_events_route'}
+
+@app.before_request
+def start_request_span():
+    if request.endpoint not in UNTRACED_ENDPOINTS:
+        g.trace_span = begin_span(
+            f"web.{request.endpoint}", request.headers.get(TRACEPARENT_HEADER),
+            {'http.method': request.method, 'http.route': str(request.url_rule)}
+        )
+
+@app.after_request
+def record_response_status(response):
+    if span := g.get('trace_span'):
+        span.set_attribute('http.status_code', response.status_code)
+    return response
+
+@app.teardown_request
+def finish_request_span(error=None):
+    if span := g.pop('trace_span', None):
+        span.finish(error)
+
 SCOPES = [
     'https://www.googleapis.com/auth/userinfo.email',
     'https://www.googleapis.com/auth/userinfo.profile',
@@ -61,159 +99,6 @@ SCOPES = [
     'openid'
 ]
 
-ontology_file_lock = threading.Lock()
-
-# --- CARREGAMENTO E GESTÃO DA ONTOLOGIA ---
-
-def load_ontology_file():
-    """Carrega de forma segura o conteúdo do ficheiro da ontologia."""
-    try:
-        with open(ONTOLOGY_FILE, 'r', encoding='utf-8') as f:
-            ontology_data = json.load(f)
-        logging.info(f"Ontologia carregada com sucesso do ficheiro: {ONTOLOGY_FILE}")
-        return ontology_data
-    except Exception as e:
-        logging.error(f"ERRO CRÍTICO ao carregar a ontologia: {e}\n{traceback.format_exc()}")
-        return {}
-    
-def save_ontology_file(data):
-    """Salva os dados da ontologia de forma segura."""
-    try:
-        with open(ONTOLOGY_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        logging.info(f"Ontologia salva com sucesso em {ONTOLOGY_FILE}")
-        return True
-    except Exception as e:
-        logging.error(f"ERRO AO SALVAR O FICHEIRO DE ONTOLOGIA: {e}\n{traceback.format_exc()}")
-        return False
-
-ONTOLOGY_DATA = load_ontology_file()
-
-# --- FUNÇÕES HELPER PARA A ARQUITETURA ---
-
-def get_component(component_type, component_id):
-    if not component_id: return None
-    return ONTOLOGY_DATA.get("communication_components", {}).get(component_type, {}).get(component_id)
-
-def get_current_time_of_day():
-    current_hour = datetime.datetime.now().hour
-    if 5 <= current_hour < 13: return "morning"
-    if 13 <= current_hour < 20: return "afternoon"
-    return "evening"
-
-def resolve_component(component, recipient_name=""):
-    if not component or not component.get('content'): return ""
-    time_of_day = get_current_time_of_day()
-    valid_options = [item for item in component['content'] if not item.get('condition') or ("time_of_day" in item.get('condition') and item.get('condition').endswith(time_of_day))]
-    if not valid_options: return ""
-    chosen_item = random.choice(valid_options)
-    return chosen_item.get('text', "").replace("{{recipient_name}}", recipient_name).strip()
-
-def parse_sender_info(original_email_text):
-    match = re.search(r"(?:From|De):\s*['\"]?(.*?)['\"]?\s*<(.*?)>", original_email_text, re.IGNORECASE)
-    if match:
-        name, email = match.group(1).strip().replace('"', ''), match.group(2).strip()
-        
-        # Lista de palavras-chave que indicam um remetente genérico
-        generic_keywords = ['secretaria', 'organização', 'equipa', 'serviços', 'departamento', 'noreply', 'info@', 'gabinete']
-        
-        # Se o nome contiver uma keyword genérica ou se o nome for parte do email (ex: "info"), considera-se genérico
-        if any(keyword in name.lower() for keyword in generic_keywords) or '@' in name:
-            return None, email # Retorna None para o nome para que seja omitido
-            
-        return name, email
-        
-    return None, "" # Fallback principal também retorna None
-
-# --- COMUNICAÇÃO COM A API GEMINI ---
-def call_gemini(prompt, model=GEMINI_MODEL, temperature=0.6):
-    if not GEMINI_API_KEY: return {"error": "ERROR_CONFIG: Chave da API do Gemini não configurada."}
-    api_url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={GEMINI_API_KEY}"
-    payload = {
-        "contents": [{"parts": [{"text": prompt}]}],
-        "generationConfig": {"temperature": temperature, "responseMimeType": "text/plain"},
-        "safetySettings": [{"category": c, "threshold": "BLOCK_MEDIUM_AND_ABOVE"} for c in ["HARM_CATEGORY_HARASSMENT", "HARM_CATEGORY_HATE_SPEECH", "HARM_CATEGORY_SEXUALLY_EXPLICIT", "HARM_CATEGORY_DANGEROUS_CONTENT"]]
-    }
-    try:
-        response = requests.post(api_url, json=payload, headers={'Content-Type': 'application/json'}, timeout=180)
-        response.raise_for_status()
-        data = response.json()
-        if data.get('promptFeedback', {}).get('blockReason'): return {"error": f"ERROR_GEMINI_BLOCKED_PROMPT: {data['promptFeedback']['blockReason']}"}
-        if candidates := data.get('candidates'):
-            if text_parts := candidates[0].get('content', {}).get('parts', []):
-                return {"text": text_parts[0]['text'].strip()}
-        return {"error": "ERROR_GEMINI_PARSE: Resposta válida, mas nenhum texto gerado encontrado."}
-    except requests.exceptions.RequestException as e:
-        return {"error": f"ERROR_GEMINI_REQUEST: O pedido à API falhou com o estado {e.response.status_code if e.response else 'N/A'}."}
-    except Exception as e:
-        return {"error": f"ERROR_UNEXPECTED: {e.__class__.__name__} - {e}"}
-
-# --- NOVAS FUNÇÕES DE BUSCA POR RELEVÂNCIA ---
-
-def calculate_relevance_for_corrections(new_email_words, learned_corrections, top_n=2):
-    """Função auxiliar para calcular a relevância apenas para as correções aprendidas."""
-    scored_rules = []
-    for item in learned_corrections:
-        context_snapshot = item.get("interaction_context_snapshot", {})
-        original_email_context = context_snapshot.get("original_email_text", "")
-        if original_email_context:
-            context_words = set(re.sub(r'[^\w\s]', '', unidecode.unidecode(original_email_context.lower())).split())
-            intersection = len(new_email_words.intersection(context_words))
-            union = len(new_email_words.union(context_words))
-            score = intersection / union if union > 0 else 0
-            if score > 0.05: # Limiar mínimo de relevância
-                scored_rules.append((score, item.get("inferred_rule_pt")))
-    
-    scored_rules.sort(key=lambda x: x[0], reverse=True)
-    return [rule_text for score, rule_text in scored_rules[:top_n] if rule_text]
-
-
-
-def find_relevant_knowledge(new_email_text, all_knowledge, learned_corrections):
-    """
-    Função híbrida que executa busca por palavras-chave e semântica em paralelo,
-    combinando os resultados para máxima precisão e descoberta contextual.
-    """
-    logging.info("A executar busca HÍBRIDA (Keywords + Semântica).")
-    stopwords = set(['a', 'o', 'e', 'de', 'do', 'da', 'em', 'um', 'uma', 'com', 'por', 'para'])
-    new_email_words = set(re.sub(r'[^\w\s]', '', unidecode.unidecode(new_email_text.lower())).split()) - stopwords
-    
-    # --- BUSCA 1: PALAVRAS-CHAVE (PARA PRECISÃO MÁXIMA) ---
-    keyword_matches = [
-        mem for mem in all_knowledge
-        if mem.get("value") and not set(mem.get("keywords", [])).isdisjoint(new_email_words)
-    ]
-
-    # --- BUSCA 2: SEMÂNTICA (PARA DESCOBERTA DE CONTEXTO) ---
-    semantic_matches = []
-    try:
-        email_embedding = embedding_model.encode(new_email_text, convert_to_tensor=True)
-        memories_with_embedding = [mem for mem in all_knowledge if 'embedding' in mem]
-        if memories_with_embedding:
-            memory_embeddings = torch.tensor([mem['embedding'] for mem in memories_with_embedding])
-            cosine_scores = util.cos_sim(email_embedding, memory_embeddings)[0]
-            top_results = torch.topk(cosine_scores, k=min(3, len(memories_with_embedding))) # Top 3 contextuais
-
-            for score, idx in zip(top_results[0], top_results[1]):
-                if score > 0.45: # Limiar de relevância ajustado
-                    semantic_matches.append(memories_with_embedding[int(idx)])
-    except Exception as e:
-        logging.error(f"Erro durante a busca semântica: {e}")
-
-    # --- FASE 3: UNIR RESULTADOS E REMOVER DUPLICADOS ---
-    combined_matches = keyword_matches + semantic_matches
-    final_memories = []
-    seen_ids = set()
-    for mem in combined_matches:
-        if (mem_id := mem.get("id")) and mem_id not in seen_ids:
-            final_memories.append(mem)
-            seen_ids.add(mem_id)
-
-    relevant_corrections = calculate_relevance_for_corrections(new_email_words, learned_corrections)
-    
-    logging.info(f"Busca Híbrida encontrou: {len(final_memories)} memórias ({len(keyword_matches)} por keyword, {len(semantic_matches)} por semântica) e {len(relevant_corrections)} correções.")
-    return final_memories, relevant_corrections
-
 # --- ROTAS DE AUTENTICAÇÃO E GMAIL API ---
 # (As rotas /login, /authorize, /logout, get_gmail_service, /api/emails, /api/thread, /api/send_email permanecem as mesmas)
 @app.route('/login')
@@ -236,18 +121,16 @@ def authorize():
         user_info = service.userinfo().get().execute()
         user_email = user_info['email']
         
-        creds_data = {
-            'token': credentials.token, 'refresh_token': credentials.refresh_token,
-            'token_uri': credentials.token_uri, 'client_id': credentials.client_id,
-            'client_secret': credentials.client_secret, 'scopes': credentials.scopes
-        }
+        creds_data = credentials_to_dict(credentials)
         
         # Save the credentials to the database, linked to the email
         save_user_credentials(user_email, creds_data)
+        invalidate_gmail_client(user_email)
         logging.info(f"Credentials saved to database for {user_email}")
 
         # Keep the credentials in the session for the web UI to work
         session['credentials'] = creds_data 
+        session['user_email'] = user_email
         return redirect(url_for('index_route'))
         
     except Exception as e:
@@ -260,17 +143,14 @@ def logout():
     return redirect(url_for('index_route'))
 
 def get_gmail_service():
+    """Devolve o cliente Gmail em cache do utilizador da sessão."""
     if 'credentials' not in session: return None
     try:
-        creds = google.oauth2.credentials.Credentials(**session['credentials'])
-        if creds.expired and creds.refresh_token:
-            creds.refresh(google.auth.transport.requests.Request())
-            session['credentials'] = {
-                'token': creds.token, 'refresh_token': creds.refresh_token,
-                'token_uri': creds.token_uri, 'client_id': creds.client_id,
-                'client_secret': creds.client_secret, 'scopes': creds.scopes
-            }
-        return googleapiclient.discovery.build('gmail', 'v1', credentials=creds)
+        service = get_gmail_client(session.get('user_email'))
+        if not service:
+            # Sessões antigas não guardam o email; obriga a nova autenticação.
+            session.clear()
+        return service
     except Exception as e:
         logging.error(f"Falha ao criar o serviço do Gmail: {e}")
         session.clear()
@@ -278,14 +158,56 @@ def get_gmail_service():
 
 @app.route('/api/emails')
 def fetch_emails_route():
+    """
+    Lista uma página da caixa de entrada. Os metadados de todas as mensagens da página
+    são obtidos num único pedido batch à API do Gmail, em vez de um pedido por mensagem;
+    as mensagens que ainda assim falharem seguem em 'failed'.
+    """
     service = get_gmail_service()
     if not service: return jsonify({"error": "Não autenticado."}), 401
+    page_size = min(max(request.args.get('page_size', INBOX_PAGE_SIZE, type=int), 1), GMAIL_BATCH_LIMIT)
+    page_token = request.args.get('page_token')
     try:
-        results = service.users().messages().list(userId='me', maxResults=15, q="category:primary in:inbox").execute()
+        list_options = {'userId': 'me', 'maxResults': page_size, 'q': "category:primary in:inbox"}
+        if page_token:
+            list_options['pageToken'] = page_token
+        results = service.users().messages().list(**list_options).execute()
         messages = results.get('messages', [])
+
+        metadata_by_id = {}
+        failures = {}
+        def collect_metadata(request_id, response, exception):
+            if exception:
+                failures[request_id] = exception
+                return
+            failures.pop(request_id, None)
+            metadata_by_id[request_id] = response
+
+        pending_ids = [msg['id'] for msg in messages]
+        for attempt in range(INBOX_BATCH_RETRIES + 1):
+            if not pending_ids:
+                break
+            if attempt:
+                time.sleep(INBOX_BATCH_RETRY_DELAY * 2 ** (attempt - 1))
+            batch = service.new_batch_http_request(callback=collect_metadata)
+            for message_id in pending_ids:
+                batch.add(
+                    service.users().messages().get(userId='me', id=message_id, format='metadata', metadataHeaders=['Subject', 'From', 'Date']),
+                    request_id=message_id
+                )
+            batch.execute()
+            # Só as falhas transitórias (limite de pedidos, erros do servidor) voltam a ser pedidas.
+            pending_ids = [
+                message_id for message_id in pending_ids
+                if isinstance(failures.get(message_id), googleapiclient.errors.HttpError) and failures[message_id].resp.status in GMAIL_TRANSIENT_STATUSES
+            ]
+        for message_id, exception in failures.items():
+            logging.warning(f"Falha ao obter metadados da mensagem {message_id}: {exception}")
+
         email_list = []
         for msg in messages:
-            msg_meta = service.users().messages().get(userId='me', id=msg['id'], format='metadata', metadataHeaders=['Subject', 'From', 'Date']).execute()
+            msg_meta = metadata_by_id.get(msg['id'])
+            if not msg_meta: continue
             headers = msg_meta.get('payload', {}).get('headers', [])
             email_list.append({
                 'id': msg_meta['id'], 'threadId': msg_meta['threadId'],
@@ -293,7 +215,8 @@ def fetch_emails_route():
                 'sender': next((h['value'] for h in headers if h['name'] == 'From'), 'Desconhecido'),
                 'snippet': msg_meta.get('snippet', '')
             })
-        return jsonify(email_list)
+        # 'failed' lista as mensagens da página que não foi possível carregar, para a interface avisar.
+        return jsonify({"emails": email_list, "next_page_token": results.get('nextPageToken'), "failed": list(failures)})
     except Exception as e:
         return jsonify({"error": f"Falha ao obter emails: {e}"}), 500
 
@@ -309,15 +232,8 @@ def get_thread_route(thread_id):
             headers = payload.get('headers', [])
             sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), 'Desconhecido')
             date = next((h['value'] for h in headers if h['name'].lower() == 'date'), '')
-            body = ''
-            if 'parts' in payload:
-                for part in payload['parts']:
-                    if part['mimeType'] == 'text/plain':
-                        data = part['body'].get('data')
-                        if data: body = base64.urlsafe_b64decode(data).decode('utf-8'); break
-            elif 'data' in payload.get('body', {}):
-                body = base64.urlsafe_b64decode(payload['body']['data']).decode('utf-8')
-            full_conversation.append(f"--- De: {sender} ({date}) ---\n{body.strip()}\n")
+            body = strip_quoted_reply(extract_body(payload))
+            full_conversation.append(f"--- De: {sender} ({date}) ---\n{body}\n")
         
         first_msg_headers = thread['messages'][0].get('payload', {}).get('headers', [])
         original_sender = next((h['value'] for h in first_msg_headers if h['name'].lower() == 'from'), '')
@@ -358,12 +274,10 @@ def send_email_route():
 
 @app.route('/')
 def index_route():
-    if DEBUG_MODE:
-        global ONTOLOGY_DATA
-        ONTOLOGY_DATA = load_ontology_file()
     return render_template('index.html', is_logged_in='credentials' in session)
 
 @app.route('/analyze', methods=['POST'])
+@stage_timer('web.analyze')
 def analyze_email_route():
     email_text = request.json.get('email_text', '')
     if not email_text.strip(): return jsonify({"error": "O texto do email não pode estar vazio."}), 400
@@ -391,7 +305,7 @@ JSON Result:
     llm_response = call_gemini(prompt, temperature=0.1)
     if "error" in llm_response: return jsonify({"error": llm_response['error']}), 500
     try:
-        json_str_match = re.search(r'\{.*\}', llm_response.get("text", ""), re.DOTALL)
+        json_str_match = JSON_OBJECT_RE.search(llm_response.get("text", ""))
         if not json_str_match: raise json.JSONDecodeError("Nenhum JSON encontrado.", "", 0)
         analysis_data = json.loads(json_str_match.group(0))
         return jsonify(analysis_data)
@@ -400,114 +314,53 @@ JSON Result:
         
 # --- ROTA /DRAFT ATUALIZADA ---
 @app.route('/draft', methods=['POST'])
+@stage_timer('web.draft')
+@profiled('draft')
 def draft_response_route():
     data = request.json
     original_email = data.get('original_email', '')
     persona_id = data.get('persona_name')
     user_inputs = data.get('user_inputs', [])
 
-    persona = ONTOLOGY_DATA.get("personas", {}).get(persona_id)
+    snapshot = get_snapshot()
+    ontology = snapshot.data
+    persona = ontology.get("personas", {}).get(persona_id)
     if not persona:
         return jsonify({"error": f"Persona '{persona_id}' não encontrada."}), 404
 
     sender_name, sender_email = parse_sender_info(original_email)
 
-    # --- LÓGICA DO PROMPT RECONSTRUÍDA PARA MÁXIMA QUALIDADE ---
+    # A persona escolhida na interface é um exemplo de treino para o classificador de formalidade do worker.
+    # Guarda-se o mesmo texto que o worker classifica: sem histórico citado nem assinatura.
+    if session.get('user_email') and original_email:
+        record_persona_choice(session['user_email'], persona_id, strip_quoted_reply(original_email), 'user')
 
     # 1. Obter todo o conhecimento disponível
-    base_knowledge = ONTOLOGY_DATA.get("base_knowledge", [])
-    persona_specific_knowledge = persona.get("personal_knowledge_base", [])
-    combined_knowledge = base_knowledge + persona_specific_knowledge
-
     learned_corrections = persona.get("learned_knowledge_base", [])
     relevant_memories, relevant_corrections = find_relevant_knowledge(
-        original_email, combined_knowledge, learned_corrections
+        original_email, snapshot.knowledge_indexes(persona_id), learned_corrections
     )
         # --- INÍCIO DA LÓGICA DE ESTADO E DESCONFLITUALIZAÇÃO (VERSÃO FINAL) ---
-    final_task_instruction = "A sua tarefa é escrever um rascunho de e-mail completo e natural, seguindo as instruções."
+    final_task_instruction = DEFAULT_TASK_INSTRUCTION
 
-    is_scheduling_request = 'reunião' in original_email.lower() or 'marcar' in original_email.lower()
-    has_scheduling_guidance = any('reunião' in item.get('point', '').lower() or 'marcar' in item.get('point', '').lower() for item in user_inputs if item.get('guidance'))
+    has_scheduling_guidance = any(is_scheduling_request(item.get('point', '')) for item in user_inputs if item.get('guidance'))
 
     # Cenário 1: Pedido de agendamento SEM guidance do utilizador. Ativa o modo de segurança.
-    if is_scheduling_request and not has_scheduling_guidance:
-        relevant_corrections = [rule for rule in relevant_corrections if "agendamento" not in rule.lower()]
+    if is_scheduling_request(original_email) and not has_scheduling_guidance:
+        relevant_corrections = without_scheduling_rules(relevant_corrections)
         logging.info("Regra de agendamento suprimida para ativar o protocolo de segurança.")
         # A tarefa da IA é refinada para ser mais natural e proativa, mas segura.
-        final_task_instruction = "A sua tarefa é acusar a receção do pedido de agendamento e indicar que as datas/horas precisam de ser confirmadas internamente. Para isso, construa uma frase natural que utilize os placeholders '[Confirmar data aqui]' e '[Confirmar hora aqui]' para propor as datas. NÃO INVENTE NENHUMA DATA OU HORA."
+        final_task_instruction = SCHEDULING_TASK_INSTRUCTION
 
     # Cenário 2: O utilizador DEU guidance sobre o agendamento. A guidance tem prioridade.
     elif has_scheduling_guidance:
-        relevant_corrections = [rule for rule in relevant_corrections if "agendamento" not in rule.lower()]
+        relevant_corrections = without_scheduling_rules(relevant_corrections)
         logging.info("Regra de agendamento suprimida para garantir que a guidance do utilizador é seguida.")
     # --- FIM DA LÓGICA ---
 
-    # 2. Construir um bloco de contexto limpo e dinâmico
-    prompt_context_parts = []
-    
-    style_profile = persona.get("style_profile", {})
-    
-    # --- INÍCIO DA CORREÇÃO 1: INJETAR ESTILO E TOM ---
-    tone_keywords = style_profile.get('tone_keywords', [])
-    verbosity = style_profile.get('verbosity')
-    
-    style_instructions = []
-    if tone_keywords:
-        style_instructions.append(f"Tom geral a adotar: {', '.join(tone_keywords)}.")
-    if verbosity:
-        style_instructions.append(f"Nível de detalhe do texto: {verbosity}.")
-    
-    if style_instructions:
-        prompt_context_parts.append("--- Estilo e Tom (Seguir estritamente) ---\n" + "\n".join(style_instructions))
-    # --- FIM DA CORREÇÃO 1 ---
-
-    key_principles = style_profile.get('key_principles', [])
-    if key_principles:
-        prompt_context_parts.append("--- Princípios Chave da Persona (Regras Gerais) ---\n- " + "\n- ".join(key_principles))
-
-    # Adiciona contexto do interlocutor, se existir
-    if sender_email:
-        profiles = ONTOLOGY_DATA.get("interlocutor_profiles", {})
-        for key, profile in profiles.items():
-            if profile.get("email_match", "").lower() == sender_email.lower():
-                context_parts = [f"Nome: {profile.get('full_name')}", f"Relação: {profile.get('relationship')}"]
-                interlocutor_context = "--- Contexto Sobre o Interlocutor ---\n" + " | ".join(filter(None, context_parts))
-                prompt_context_parts.append(interlocutor_context)
-
-                personalization_rules = profile.get("personalization_rules", [])
-                if personalization_rules:
-                    formatted_rules = "\n- ".join(personalization_rules)
-                    override_rules_context = f"--- Regras Específicas Para Este Contacto (Prioridade Máxima) ---\n- {formatted_rules}"
-                    prompt_context_parts.append(override_rules_context)
-                break
-    
-    # --- INÍCIO DA CORREÇÃO 3: PROCESSAR FACTOS ESTRUTURADOS ---
-    if relevant_memories:
-        formatted_memories = [f"{mem.get('label', 'Facto')} = {mem.get('value')}" for mem in relevant_memories if mem.get('value')]
-        if formatted_memories:
-            prompt_context_parts.append(f"--- Factos Relevantes da Memória (Usar apenas se solicitado) ---\n- " + "\n- ".join(formatted_memories))
-    # --- FIM DA CORREÇÃO 3 ---
-
-    # --- INÍCIO DA CORREÇÃO 2: PROCESSAR REGRAS CRÍTICAS E STANDARD ---
-    if relevant_corrections:
-        critical_rules = []
-        standard_rules = []
-        for rule in relevant_corrections:
-            if re.search(r'\b(Nunca|Jamais|Regra Crítica)\b', rule, re.IGNORECASE):
-                critical_rules.append(rule)
-            else:
-                standard_rules.append(rule)
-        
-        if standard_rules:
-            formatted_corrections = "\n- ".join(standard_rules)
-            prompt_context_parts.append(f"--- Regras Aprendidas (Sobrepõem-se aos Princípios Chave) ---\n- {formatted_corrections}")
-
-        if critical_rules:
-            formatted_critical_rules = "\n- ".join(critical_rules)
-            prompt_context_parts.insert(0, f"--- REGRAS CRÍTICAS E INVIOLÁVEIS (OBRIGATÓRIO CUMPRIR) ---\n- {formatted_critical_rules}")
-    # --- FIM DA CORREÇÃO 2 ---
-
-    final_context_block = "\n\n".join(prompt_context_parts)
+    # 2. Construir um bloco de contexto limpo e dinâmico (estilo, interlocutor, factos e regras)
+    interlocutor_profile = snapshot.find_interlocutor(sender_email)
+    final_context_block = build_context_block(persona, interlocutor_profile, relevant_memories, relevant_corrections)
 
     # 3. Obter as diretrizes do utilizador
     guidance_parts = []
@@ -519,50 +372,18 @@ def draft_response_route():
             guidance_parts.append(instruction)
 
     if not guidance_parts:
-        guidance_summary = "Nenhuma instrução específica. Gerar uma resposta com base no contexto do email e na persona."
+        guidance_summary = DEFAULT_GUIDANCE_SUMMARY
     else:
         guidance_summary = "\n- ".join(guidance_parts)
 
     # 4. Construir o prompt final
-    default_ids = persona.get("default_components", {})
-    recipient_first_name = sender_name.split()[0] if sender_name else ""
-    greeting_text = resolve_component(get_component("greetings", default_ids.get("greeting_id")), recipient_first_name)
-    closing_text = resolve_component(get_component("closings", default_ids.get("closing_id")))
-    signature_text = resolve_component(get_component("signatures", default_ids.get("signature_id")))
-
-    prompt = f"""
-Você é um assistente de escrita que encarna a persona '{persona.get('label', persona_id)}'.
-{final_task_instruction}
-
-{final_context_block}
-
---- E-mail Original a Responder ---
-{original_email}
-
---- Instruções do Utilizador (Seguir à risca) ---
-{guidance_summary}
-
---- Rascunho Final (Comece aqui) ---
-{greeting_text}
-
-[ESCREVA O CORPO DO E-MAIL AQUI]
-
-{closing_text}
-{signature_text}
-"""
+    prompt = build_draft_prompt(persona, persona_id, final_task_instruction, final_context_block, original_email, guidance_summary, sender_name)
 
     llm_response = call_gemini(prompt, temperature=0.5)
     if "error" in llm_response:
         return jsonify({"error": llm_response["error"], "prompt_sent": prompt}), 500
 
-    raw_draft = llm_response.get("text", "").strip()
-    
-    if "--- Rascunho Final (Comece aqui) ---" in raw_draft:
-        raw_draft = raw_draft.split("--- Rascunho Final (Comece aqui) ---")[-1]
-
-    final_draft = raw_draft.replace('[ESCREVA O CORPO DO E-MAIL AQUI]', '').strip()
-    final_draft = re.sub(r'\n{3,}', '\n\n', final_draft).strip()
-
+    final_draft = clean_draft_text(llm_response.get("text", ""))
     return jsonify({"draft": final_draft, "prompt_sent_for_debug": prompt})
 
 # --- ROTAS ADICIONAIS (Feedback, Refine, etc.) ---
@@ -628,7 +449,7 @@ Produza APENAS um objeto JSON com uma única chave "inferred_rule".
     llm_response = call_gemini(inference_prompt, temperature=0.3)
     if "error" not in llm_response:
         try:
-            json_str_match = re.search(r'\{.*\}', llm_response.get("text", ""), re.DOTALL)
+            json_str_match = JSON_OBJECT_RE.search(llm_response.get("text", ""))
             if json_str_match:
                 rule_data = json.loads(json_str_match.group(0))
                 inferred_rule = rule_data.get("inferred_rule", inferred_rule)
@@ -653,8 +474,6 @@ Produza APENAS um objeto JSON com uma única chave "inferred_rule".
             
             if not save_ontology_file(current_data): raise IOError("Falha ao salvar no ficheiro.")
             
-            global ONTOLOGY_DATA
-            ONTOLOGY_DATA = current_data
         return jsonify({"message": "Feedback submetido!", "inferred_rule": inferred_rule}), 200
     except Exception as e:
         logging.error(f"ERRO CRÍTICO ao salvar feedback: {e}")
@@ -664,9 +483,8 @@ Produza APENAS um objeto JSON com uma única chave "inferred_rule".
 # (As rotas /api/personas, /api/personas/<key>, e as novas rotas de memória permanecem as mesmas)
 @app.route('/api/personas', methods=['GET', 'POST'])
 def personas_api_route():
-    global ONTOLOGY_DATA
     if request.method == 'GET':
-        return jsonify(ONTOLOGY_DATA.get("personas", {}))
+        return jsonify(get_ontology().get("personas", {}))
     if request.method == 'POST':
         data = request.json
         new_key = data.get('persona_key')
@@ -677,12 +495,10 @@ def personas_api_route():
             if new_key in current_data.get("personas", {}): return jsonify({"error": "Chave já existe."}), 409
             current_data.setdefault("personas", {})[new_key] = new_data
             if not save_ontology_file(current_data): return jsonify({"error": "Falha ao salvar."}), 500
-            ONTOLOGY_DATA = current_data
         return jsonify({"message": "Persona criada."}), 201
 
 @app.route('/api/personas/<persona_key>', methods=['GET', 'PUT', 'DELETE'])
 def persona_detail_api_route(persona_key):
-    global ONTOLOGY_DATA
     with ontology_file_lock:
         current_data = load_ontology_file()
         if persona_key not in current_data.get("personas", {}): return jsonify({"error": "Não encontrado."}), 404
@@ -695,17 +511,14 @@ def persona_detail_api_route(persona_key):
             updated_data["personal_knowledge_base"] = current_data["personas"][persona_key].get("personal_knowledge_base", [])
             current_data["personas"][persona_key].update(updated_data)
             if not save_ontology_file(current_data): return jsonify({"error": "Falha ao salvar."}), 500
-            ONTOLOGY_DATA = current_data
             return jsonify({"message": "Persona atualizada."})
         if request.method == 'DELETE':
             del current_data["personas"][persona_key]
             if not save_ontology_file(current_data): return jsonify({"error": "Falha ao salvar."}), 500
-            ONTOLOGY_DATA = current_data
             return jsonify({"message": "Persona removida."})
 
 @app.route('/api/personas/<persona_key>/memories', methods=['GET', 'POST'])
 def memories_api_route(persona_key):
-    global ONTOLOGY_DATA
     with ontology_file_lock:
         current_data = load_ontology_file()
         persona = current_data.get("personas", {}).get(persona_key)
@@ -729,12 +542,10 @@ def memories_api_route(persona_key):
             new_memory['id'] = f"mem_{uuid.uuid4().hex[:8]}"
             persona["personal_knowledge_base"].append(new_memory)
             if not save_ontology_file(current_data): return jsonify({"error": "Falha ao salvar."}), 500
-            ONTOLOGY_DATA = current_data
             return jsonify(new_memory), 201
 
 @app.route('/api/personas/<persona_key>/memories/<memory_id>', methods=['PUT', 'DELETE'])
 def memory_detail_api_route(persona_key, memory_id):
-    global ONTOLOGY_DATA
     with ontology_file_lock:
         current_data = load_ontology_file()
         persona = current_data.get("personas", {}).get(persona_key)
@@ -747,18 +558,15 @@ def memory_detail_api_route(persona_key, memory_id):
             if not updated_data or 'value' not in updated_data: return jsonify({"error": "Campo 'value' obrigatório."}), 400
             memory_to_modify.update(updated_data)
             if not save_ontology_file(current_data): return jsonify({"error": "Falha ao atualizar."}), 500
-            ONTOLOGY_DATA = current_data
             return jsonify(memory_to_modify)
         if request.method == 'DELETE':
             persona["personal_knowledge_base"] = [mem for mem in knowledge_base if mem.get("id") != memory_id]
             if not save_ontology_file(current_data): return jsonify({"error": "Falha ao apagar."}), 500
-            ONTOLOGY_DATA = current_data
             return jsonify({"message": "Memória apagada."})
 
 @app.route('/api/base_knowledge', methods=['GET', 'POST'])
 def base_knowledge_api_route():
     """Lida com a listagem e criação de memórias na base partilhada."""
-    global ONTOLOGY_DATA
     with ontology_file_lock:
         current_data = load_ontology_file()
         base_knowledge = current_data.setdefault("base_knowledge", [])
@@ -774,13 +582,11 @@ def base_knowledge_api_route():
             base_knowledge.append(new_memory)
             if not save_ontology_file(current_data):
                 return jsonify({"error": "Falha ao salvar."}), 500
-            ONTOLOGY_DATA = current_data
             return jsonify(new_memory), 201
 
 @app.route('/api/base_knowledge/<memory_id>', methods=['PUT', 'DELETE'])
 def base_knowledge_detail_api_route(memory_id):
     """Lida com a atualização e eliminação de memórias na base partilhada."""
-    global ONTOLOGY_DATA
     with ontology_file_lock:
         current_data = load_ontology_file()
         base_knowledge = current_data.get("base_knowledge", [])
@@ -796,18 +602,29 @@ def base_knowledge_detail_api_route(memory_id):
             memory_to_modify.update(updated_data)
             if not save_ontology_file(current_data):
                 return jsonify({"error": "Falha ao atualizar."}), 500
-            ONTOLOGY_DATA = current_data
             return jsonify(memory_to_modify)
             
         if request.method == 'DELETE':
             current_data["base_knowledge"] = [mem for mem in base_knowledge if mem.get("id") != memory_id]
             if not save_ontology_file(current_data):
                 return jsonify({"error": "Falha ao apagar."}), 500
-            ONTOLOGY_DATA = current_data
             return jsonify({"message": "Memória apagada."})
         
 
 # --- AUTOMATION APPROVAL ROUTES ---
+def build_draft_send_body(draft):
+    """Constrói o corpo do pedido messages.send para responder na thread original do rascunho."""
+    message = MIMEText(draft['body'], _charset='utf-8')
+    message['to'] = draft['recipient']
+    message['subject'] = draft['subject']
+
+    if draft.get('original_message_id'):
+        message['In-Reply-To'] = draft['original_message_id']
+        message['References'] = draft['original_message_id']
+
+    raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
+    return {'raw': raw_message, 'threadId': draft['thread_id']}
+
 @app.route('/approve/<draft_id>')
 def approve_draft_route(draft_id):
     """Esta rota é acionada pelo link do Pushover."""
@@ -815,36 +632,14 @@ def approve_draft_route(draft_id):
     if not draft:
         return "<h1>Rascunho Não Encontrado</h1><p>Este rascunho pode já ter sido processado ou não existe.</p>", 404
 
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT email FROM user_credentials LIMIT 1")
-    user_row = cursor.fetchone()
-    conn.close()
-
-    if not user_row:
-        return "<h1>Erro</h1><p>Nenhuma credencial de utilizador encontrada na base de dados.</p>", 500
-
-    user_email = user_row[0]
-    user_credentials = get_user_credentials(user_email)
-
-    if not user_credentials:
-        return "<h1>Erro</h1><p>Não foi possível carregar as credenciais para o utilizador.</p>", 500
-
+    # O link não tem sessão: o rascunho é enviado pela conta a que pertence.
+    user_email = draft['user_email']
     try:
-        creds = google.oauth2.credentials.Credentials(**user_credentials)
-        service = googleapiclient.discovery.build('gmail', 'v1', credentials=creds)
+        service = get_gmail_client(user_email)
+        if not service:
+            return "<h1>Erro</h1><p>Não foi possível carregar as credenciais para o utilizador.</p>", 500
 
-        message = MIMEText(draft['body'], _charset='utf-8')
-        message['to'] = draft['recipient']
-        message['subject'] = draft['subject']
-        
-        if draft.get('original_message_id'):
-            message['In-Reply-To'] = draft['original_message_id']
-            message['References'] = draft['original_message_id']
-        
-        raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
-        send_options = {'raw': raw_message, 'threadId': draft['thread_id']}
-        service.users().messages().send(userId='me', body=send_options).execute()
+        service.users().messages().send(userId='me', body=build_draft_send_body(draft)).execute()
 
         update_draft_status(draft_id, 'approved')
         logging.info(f"Pushover: Rascunho {draft_id} aprovado e enviado com sucesso.")
@@ -865,10 +660,11 @@ def reject_draft_route(draft_id):
 @app.route('/api/draft/<draft_id>', methods=['GET'])
 def get_draft_details_route(draft_id):
     """Devolve os detalhes de um rascunho específico para o modal de edição."""
-    if 'credentials' not in session:
+    user_email = session.get('user_email')
+    if 'credentials' not in session or not user_email:
         return jsonify({"error": "Não autenticado."}), 401
     
-    draft = get_draft_by_id(draft_id)
+    draft = get_draft_by_id(draft_id, user_email)
     if not draft:
         return jsonify({"error": "Rascunho não encontrado."}), 404
         
@@ -877,7 +673,8 @@ def get_draft_details_route(draft_id):
 @app.route('/api/draft/<draft_id>', methods=['PUT'])
 def update_draft_details_route(draft_id):
     """Atualiza o corpo de um rascunho a partir do modal de edição."""
-    if 'credentials' not in session:
+    user_email = session.get('user_email')
+    if 'credentials' not in session or not user_email:
         return jsonify({"error": "Não autenticado."}), 401
         
     data = request.json
@@ -885,47 +682,87 @@ def update_draft_details_route(draft_id):
     if new_body is None:
         return jsonify({"error": "Corpo do e-mail em falta."}), 400
 
-    update_draft_body(draft_id, new_body)
+    if not update_draft_body(draft_id, new_body, user_email):
+        return jsonify({"error": "Rascunho não encontrado."}), 404
     return jsonify({"message": "Rascunho atualizado com sucesso."})
     
+# --- MÉTRICAS ---
+
+@app.route('/metrics')
+def metrics_route():
+    """Métricas Prometheus por etapa do pipeline (Gemini, Gmail, SQLite, pesquisa, prompts)."""
+    metrics = render_metrics()
+    if metrics is None:
+        return Response("prometheus_client não instalado.\n", status=501, mimetype='text/plain')
+    body, content_type = metrics
+    return Response(body, content_type=content_type)
+
+# --- PERFIS (ADMIN) ---
+
+def require_admin():
+    user_email = (session.get('user_email') or '').lower()
+    if 'credentials' not in session or not user_email:
+        abort(401)
+    if user_email not in ADMIN_EMAILS:
+        abort(403)
+
+@app.route('/admin/profiles')
+def list_profiles_route():
+    """Lista os perfis recolhidos por amostragem (PROFILE_SAMPLE_RATE) de /draft e do worker."""
+    require_admin()
+    return jsonify({"sample_rate": PROFILE_SAMPLE_RATE, "profiler": PROFILER, "profiles": list_profiles()})
+
+@app.route('/admin/profiles/<name>')
+def profile_detail_route(name):
+    """Resumo em texto de um perfil cProfile (?sort=tottime&limit=100), o HTML do pyinstrument ou o ficheiro (?download=1)."""
+    require_admin()
+    path = profile_file_path(name)
+    if not path:
+        return jsonify({"error": "Perfil não encontrado."}), 404
+    if request.args.get('download') or not name.endswith('.prof'):
+        return send_file(path, as_attachment=bool(request.args.get('download')), download_name=name)
+    sort = request.args.get('sort', 'cumulative')
+    if sort not in ('cumulative', 'tottime', 'calls', 'ncalls'):
+        return jsonify({"error": f"Ordenação inválida: {sort}"}), 400
+    limit = min(request.args.get('limit', 60, type=int), 500)
+    return Response(profile_summary(path, limit, sort), mimetype='text/plain')
+
 # --- AUTOMATION TRIGGER & SETUP ---
 
 @app.route('/gmail-webhook', methods=['POST'])
 def gmail_webhook_route():
-    from automation.celery_worker import process_new_email
-    """Receives push notifications from Google Cloud Pub/Sub."""
-    if 'message' not in request.json:
+    """
+    Receives push notifications from Google Cloud Pub/Sub.
+    Only validates, dedupes and enqueues: all Gmail calls happen in the sync_mailbox task,
+    so a slow Gmail API never delays the acknowledgement to Pub/Sub.
+    """
+    from automation.celery_worker import sync_mailbox, mailbox_queue_for, QUEUE_INGEST
+    envelope = request.get_json(silent=True) or {}
+    pubsub_message = envelope.get('message')
+    if not pubsub_message or 'data' not in pubsub_message:
         return "Bad Request: No message data", 400
 
     try:
-        message_data = base64.b64decode(request.json['message']['data']).decode('utf-8')
-        message_json = json.loads(message_data)
+        message_json = json.loads(base64.b64decode(pubsub_message['data']).decode('utf-8'))
         user_email = message_json['emailAddress']
-        
-        user_credentials = get_user_credentials(user_email)
-        if not user_credentials:
-            logging.warning(f"Received webhook for {user_email}, but no credentials found in database. Skipping.")
+    except Exception as e:
+        # Payloads inválidos são confirmados para que o Pub/Sub não os reentregue.
+        logging.warning(f"Ignoring malformed webhook payload: {e}")
+        return "OK", 200
+
+    try:
+        pubsub_message_id = pubsub_message.get('messageId') or pubsub_message.get('message_id')
+        if pubsub_message_id and not record_pubsub_delivery(pubsub_message_id):
+            logging.info(f"Webhook: Pub/Sub message {pubsub_message_id} already received. Skipping.")
             return "OK", 200
 
-        creds = google.oauth2.credentials.Credentials(**user_credentials)
-        service = googleapiclient.discovery.build('gmail', 'v1', credentials=creds)
-        
-        response = service.users().threads().list(userId='me', labelIds=['INBOX'], maxResults=1).execute()
-        
-        if 'threads' in response and response['threads']:
-            latest_thread_id = response['threads'][0]['id']
-            
-            if is_thread_processed(latest_thread_id):
-                logging.info(f"Webhook: Thread {latest_thread_id} has already been processed. Skipping.")
-            else:
-                mark_thread_as_processed(latest_thread_id)
-                process_new_email.delay(latest_thread_id, user_credentials)
-                logging.info(f"Webhook: Found new thread {latest_thread_id}. Queued for processing.")
-        else:
-            logging.info("Webhook received, but no threads found in inbox. Skipping.")
-            
+        sync_mailbox.apply_async(args=[user_email, message_json.get('historyId')], queue=mailbox_queue_for(user_email, QUEUE_INGEST))
     except Exception as e:
-        logging.error(f"Error processing webhook: {e}", exc_info=True)
+        # Sem o enqueue a notificação perde-se; um erro faz o Pub/Sub tentar novamente.
+        logging.error(f"Error enqueueing mailbox sync for {user_email}: {e}", exc_info=True)
+        if pubsub_message_id:
+            forget_pubsub_delivery(pubsub_message_id)
+        return "Service Unavailable", 503
 
     return "OK", 200
 
@@ -948,6 +785,9 @@ def start_watch_route():
         
         response = service.users().watch(userId='me', body=request_body).execute()
         logging.info(f"Successfully started watching inbox. Response: {response}")
+        # Ponto de partida para a sincronização incremental via users.history.list
+        if response.get('historyId'):
+            save_last_history_id(session['user_email'], response['historyId'])
         return f"<h1>Success!</h1><p>Your inbox is now being watched. Expiration: {response.get('expiration')}</p>"
 
     except Exception as e:
@@ -959,19 +799,47 @@ def start_watch_route():
 @app.route('/api/dashboard_stats')
 def dashboard_stats_route():
     """Fornece todas as estatísticas necessárias para o dashboard."""
-    if 'credentials' not in session:
+    user_email = session.get('user_email')
+    if 'credentials' not in session or not user_email:
         return jsonify({"error": "Não autenticado."}), 401
+    cursor = None
+    if raw_cursor := request.args.get('cursor'):
+        try:
+            cursor = parse_dashboard_cursor(raw_cursor)
+        except ValueError:
+            return jsonify({"error": "Cursor de paginação inválido."}), 400
     try:
-        stats = get_dashboard_stats()
+        limit = min(max(request.args.get('limit', DASHBOARD_PAGE_SIZE, type=int), 1), 200)
+        stats = get_dashboard_stats(user_email, limit=limit, cursor=cursor)
         return jsonify(stats)
     except Exception as e:
         logging.error(f"Erro ao obter estatísticas do dashboard: {e}")
         return jsonify({"error": "Erro interno ao buscar dados."}), 500
 
+@app.route('/api/events')
+def dashboard_events_route():
+    """Canal Server-Sent Events com a criação e mudanças de estado dos rascunhos."""
+    user_email = session.get('user_email')
+    if 'credentials' not in session or not user_email:
+        return jsonify({"error": "Não autenticado."}), 401
+    # 204 e 503 fecham o EventSource sem novas tentativas: o dashboard passa a consultar por polling.
+    try:
+        events = stream_draft_events(user_email)
+    except Exception as e:
+        logging.warning(f"Eventos de rascunhos indisponíveis: {e}")
+        return jsonify({"error": "Eventos indisponíveis."}), 503
+    if events is None:
+        return '', 204
+    response = Response(stream_with_context(events), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Desativa o buffering em proxies nginx
+    return response
+
 @app.route('/api/draft/<draft_id>/status', methods=['POST'])
 def update_draft_status_route(draft_id):
     """Atualiza o status de um rascunho (aprovado/rejeitado) a partir do dashboard."""
-    if 'credentials' not in session:
+    user_email = session.get('user_email')
+    if 'credentials' not in session or not user_email:
         return jsonify({"error": "Não autenticado."}), 401
     
     data = request.json
@@ -982,13 +850,13 @@ def update_draft_status_route(draft_id):
 
     try:
         if new_status == 'approved':
-            if update_draft_status(draft_id, 'approved'):
+            if update_draft_status(draft_id, 'approved', user_email):
                 return jsonify({"message": f"Rascunho {draft_id} marcado como aprovado."})
             else:
                 return jsonify({"error": "Rascunho não encontrado."}), 404
 
         elif new_status == 'rejected':
-            if update_draft_status(draft_id, 'rejected'):
+            if update_draft_status(draft_id, 'rejected', user_email):
                 return jsonify({"message": f"Rascunho {draft_id} rejeitado."})
             else:
                 return jsonify({"error": "Rascunho não encontrado."}), 404
@@ -1000,38 +868,22 @@ def update_draft_status_route(draft_id):
 @app.route('/api/draft/<draft_id>/send', methods=['POST'])
 def send_draft_from_dashboard_route(draft_id):
     """Envia um e-mail aprovado diretamente a partir de um pedido da API do dashboard."""
-    if 'credentials' not in session:
+    user_email = session.get('user_email')
+    if 'credentials' not in session or not user_email:
         return jsonify({"error": "Não autenticado."}), 401
 
-    draft = get_pending_draft(draft_id)
+    draft = get_pending_draft(draft_id, user_email)
     if not draft:
         return jsonify({"error": "Rascunho não encontrado ou já processado."}), 404
 
-    try:
-        creds = google.oauth2.credentials.Credentials(**session['credentials'])
-        if creds.expired and creds.refresh_token:
-            creds.refresh(google.auth.transport.requests.Request())
-            session['credentials'] = {
-                'token': creds.token, 'refresh_token': creds.refresh_token,
-                'token_uri': creds.token_uri, 'client_id': creds.client_id,
-                'client_secret': creds.client_secret, 'scopes': creds.scopes
-            }
-
-        service = googleapiclient.discovery.build('gmail', 'v1', credentials=creds)
-
-        message = MIMEText(draft['body'], _charset='utf-8')
-        message['to'] = draft['recipient']
-        message['subject'] = draft['subject']
-
-        if draft.get('original_message_id'):
-            message['In-Reply-To'] = draft['original_message_id']
-            message['References'] = draft['original_message_id']
+    service = get_gmail_service()
+    if not service:
+        return jsonify({"error": "Não autenticado."}), 401
 
-        raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
-        send_options = {'raw': raw_message, 'threadId': draft['thread_id']}
-        service.users().messages().send(userId='me', body=send_options).execute()
+    try:
+        service.users().messages().send(userId='me', body=build_draft_send_body(draft)).execute()
 
-        update_draft_status(draft_id, 'approved')
+        update_draft_status(draft_id, 'approved', user_email)
         logging.info(f"Dashboard: Rascunho {draft_id} aprovado e enviado com sucesso.")
         return jsonify({"message": "Email enviado com sucesso!"})
 
@@ -1040,11 +892,103 @@ def send_draft_from_dashboard_route(draft_id):
         return jsonify({"error": f"Ocorreu um erro ao tentar enviar o e-mail: {e}"}), 500
     
 
+def parse_bulk_draft_ids(data):
+    """Valida a lista de IDs de um pedido em massa. Devolve (ids, erro)."""
+    draft_ids = (data or {}).get('ids')
+    if not isinstance(draft_ids, list) or not draft_ids or not all(isinstance(i, str) for i in draft_ids):
+        return None, "Lista de IDs em falta ou inválida."
+    if len(draft_ids) > BULK_DRAFTS_LIMIT:
+        return None, f"Máximo de {BULK_DRAFTS_LIMIT} rascunhos por pedido."
+    return list(dict.fromkeys(draft_ids)), None
+
+def bulk_results(draft_ids, errors):
+    """Resposta por item de uma operação em massa: {'results': [...], 'succeeded': n, 'failed': n}."""
+    results = [
+        {'id': draft_id, 'ok': False, 'error': errors[draft_id]} if draft_id in errors else {'id': draft_id, 'ok': True}
+        for draft_id in draft_ids
+    ]
+    return {'results': results, 'succeeded': len(draft_ids) - len(errors), 'failed': len(errors)}
+
+@app.route('/api/drafts/bulk_status', methods=['POST'])
+def bulk_update_drafts_status_route():
+    """Aprova ou rejeita vários rascunhos pendentes numa única transação."""
+    user_email = session.get('user_email')
+    if 'credentials' not in session or not user_email:
+        return jsonify({"error": "Não autenticado."}), 401
+
+    data = request.get_json(silent=True)
+    draft_ids, error = parse_bulk_draft_ids(data)
+    if error:
+        return jsonify({"error": error}), 400
+    new_status = data.get('status')
+    if new_status not in ['approved', 'rejected']:
+        return jsonify({"error": "Status inválido."}), 400
+
+    try:
+        updated_ids = update_drafts_status(draft_ids, new_status, user_email)
+    except Exception as e:
+        logging.error(f"Erro ao atualizar o status de {len(draft_ids)} rascunhos: {e}")
+        return jsonify({"error": "Erro interno do servidor."}), 500
+
+    errors = {draft_id: "Rascunho não encontrado ou já processado." for draft_id in draft_ids if draft_id not in updated_ids}
+    return jsonify(bulk_results(draft_ids, errors))
+
+@app.route('/api/drafts/bulk_send', methods=['POST'])
+def bulk_send_drafts_route():
+    """
+    Envia vários rascunhos pendentes em pedidos batch à API do Gmail (GMAIL_SEND_BATCH_SIZE
+    envios por pedido). Os rascunhos enviados em cada lote são marcados como aprovados numa
+    única transação antes de passar ao lote seguinte, para que uma falha a meio não os reenvie.
+    """
+    user_email = session.get('user_email')
+    if 'credentials' not in session or not user_email:
+        return jsonify({"error": "Não autenticado."}), 401
+
+    draft_ids, error = parse_bulk_draft_ids(request.get_json(silent=True))
+    if error:
+        return jsonify({"error": error}), 400
+
+    service = get_gmail_service()
+    if not service:
+        return jsonify({"error": "Não autenticado."}), 401
+
+    drafts = get_pending_drafts(draft_ids, user_email)
+    errors = {draft_id: "Rascunho não encontrado ou já processado." for draft_id in draft_ids if draft_id not in drafts}
+    to_send = [drafts[draft_id] for draft_id in draft_ids if draft_id in drafts]
+
+    for start in range(0, len(to_send), GMAIL_SEND_BATCH_SIZE):
+        chunk = to_send[start:start + GMAIL_SEND_BATCH_SIZE]
+        sent_ids = set()
+        def collect_send_result(request_id, response, exception):
+            if exception:
+                errors[request_id] = f"Falha ao enviar: {exception}"
+            else:
+                sent_ids.add(request_id)
+
+        try:
+            batch = service.new_batch_http_request(callback=collect_send_result)
+            for draft in chunk:
+                batch.add(service.users().messages().send(userId='me', body=build_draft_send_body(draft)), request_id=draft['id'])
+            batch.execute()
+        except Exception as e:
+            logging.error(f"Dashboard: Falha no pedido batch de envio: {e}")
+            for draft in chunk:
+                if draft['id'] not in sent_ids:
+                    errors[draft['id']] = f"Falha ao enviar: {e}"
+
+        if sent_ids:
+            update_drafts_status(list(sent_ids), 'approved', user_email)
+
+    result = bulk_results(draft_ids, errors)
+    logging.info(f"Dashboard: envio em massa concluído ({result['succeeded']} enviados, {result['failed']} falhados).")
+    return jsonify(result)
+
+
 # --- PONTO DE ENTRADA DA APLICAÇÃO ---
 if __name__ == '__main__':
     logging.info("--- A Iniciar Aplicação Flask ---")
     if not os.path.exists(CLIENT_SECRETS_FILE): logging.critical("ERRO FATAL: `client_secret.json` não encontrado.")
     elif not GEMINI_API_KEY: logging.warning("A variável de ambiente GEMINI_API_KEY não está definida!")
-    elif not ONTOLOGY_DATA: logging.critical("A ONTOLOGIA está vazia!")
-    else: logging.info(f"{len(ONTOLOGY_DATA.get('personas', {}))} personas carregadas.")
+    elif not get_ontology(): logging.critical("A ONTOLOGIA está vazia!")
+    else: logging.info(f"{len(get_ontology().get('personas', {}))} personas carregadas.")
     app.run(host=APP_HOST, port=APP_PORT, debug=DEBUG_MODE)
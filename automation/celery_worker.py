@@ -1,83 +1,225 @@
 import os
+import time
+import uuid
+import zlib
 from dotenv import load_dotenv
 import logging
-import base64
-import google.oauth2.credentials
-import googleapiclient.discovery
-from bs4 import BeautifulSoup
-import re
 
 # Garante que as variáveis de ambiente são carregadas quando o worker inicia
 load_dotenv()
 
-from celery import Celery
-
-# Importa de outros ficheiros do nosso projeto
-from app import (
-    app, parse_sender_info, find_relevant_knowledge, call_gemini,
-    ONTOLOGY_DATA, resolve_component, get_component
+from celery import Celery, signals
+from celery.exceptions import Retry, SoftTimeLimitExceeded
+import googleapiclient.errors
+from kombu.exceptions import OperationalError as BrokerError
+
+# Importa de outros ficheiros do nosso projeto (sem carregar a app Flask)
+from core.ontology import get_snapshot
+from core.metrics import start_metrics_server, mark_process_dead, observe_stage
+from core.profiling import profiled
+from core.tracing import begin_span, current_traceparent, set_attribute, set_service_name, TRACEPARENT_HEADER
+from core.gemini import call_gemini
+from core.mime import extract_body
+from core.reply_parser import strip_quoted_reply
+from core.triage import triage_message
+from core.formality import get_classifier as get_formality_classifier, predict_persona
+from core.retrieval import find_relevant_knowledge
+from core.prompts import (
+    parse_sender_info, is_scheduling_request, without_scheduling_rules, build_context_block,
+    build_draft_prompt, clean_draft_text, DEFAULT_TASK_INSTRUCTION, SCHEDULING_TASK_INSTRUCTION, DEFAULT_GUIDANCE_SUMMARY
+)
+from automation.database import (
+    add_pending_draft, claim_message, release_message, purge_processed_threads,
+    get_last_history_id, save_last_history_id, purge_pubsub_deliveries,
+    record_persona_choice, get_persona_choices,
+    queue_notification, claim_notifications, delete_notifications, release_notifications
 )
-from automation.database import add_pending_draft
-from automation.notifications import send_approval_notification
+from automation.gmail_client import get_gmail_client, list_new_inbox_messages
+from automation.notifications import send_draft_notifications, TransientNotificationError
 
 # --- Configuração do Celery ---
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', 'redis://localhost:6379/1')
+
 celery = Celery(
-    app.import_name,
-    backend='redis://localhost:6379/1',
-    broker='redis://localhost:6379/0'
+    'automation',
+    backend=CELERY_RESULT_BACKEND,
+    broker=CELERY_BROKER_URL
 )
-celery.conf.update(app.config)
 
+# Filas por etapa: a sincronização (rápida) nunca espera atrás de gerações LLM (lentas),
+# e as notificações têm o seu próprio worker. Ver "Celery Worker" no README.
+QUEUE_INGEST = 'ingest'
+QUEUE_LLM = 'llm'
+QUEUE_NOTIFY = 'notify'
+
+# Limites por tarefa (segundos). O soft limit lança SoftTimeLimitExceeded dentro da tarefa;
+# o hard limit termina o processo filho. Uma geração faz até três chamadas ao Gemini.
+INGEST_SOFT_TIME_LIMIT = int(os.environ.get('INGEST_SOFT_TIME_LIMIT', 60))
+INGEST_TIME_LIMIT = int(os.environ.get('INGEST_TIME_LIMIT', 90))
+LLM_SOFT_TIME_LIMIT = int(os.environ.get('LLM_SOFT_TIME_LIMIT', 300))
+LLM_TIME_LIMIT = int(os.environ.get('LLM_TIME_LIMIT', 360))
+# Limite de débito por worker (formato Celery, ex: '30/m'); vazio desativa.
+LLM_RATE_LIMIT = os.environ.get('LLM_RATE_LIMIT', '30/m') or None
+NOTIFY_RATE_LIMIT = os.environ.get('NOTIFY_RATE_LIMIT', '60/m') or None
+# Janela (segundos) em que os rascunhos gerados são agregados numa só notificação; 0 envia logo.
+NOTIFY_DIGEST_WINDOW = int(os.environ.get('NOTIFY_DIGEST_WINDOW', 30))
+NOTIFY_MAX_RETRIES = int(os.environ.get('NOTIFY_MAX_RETRIES', 5))
+
+celery.conf.update(
+    task_routes={
+        'automation.celery_worker.sync_mailbox': {'queue': QUEUE_INGEST},
+        'automation.celery_worker.process_new_email': {'queue': QUEUE_LLM},
+        'automation.celery_worker.send_draft_notification': {'queue': QUEUE_NOTIFY},
+        'automation.celery_worker.flush_draft_notifications': {'queue': QUEUE_NOTIFY},
+    },
+    # As tarefas só são confirmadas no fim: se o worker morrer a meio, outra instância retoma-as.
+    task_acks_late=True,
+    # Cada processo reserva apenas a tarefa que está a executar; com o valor por omissão (4),
+    # mensagens novas ficavam presas atrás de gerações LLM lentas num processo ocupado.
+    worker_prefetch_multiplier=int(os.environ.get('CELERY_PREFETCH_MULTIPLIER', 1)),
+    task_soft_time_limit=LLM_SOFT_TIME_LIMIT,
+    task_time_limit=LLM_TIME_LIMIT,
+)
+
+# --- Métricas e rastreamento: exportador Prometheus, duração e span de cada tarefa ---
+@signals.worker_init.connect
+def start_worker_metrics(**kwargs):
+    set_service_name('worker')
+    start_metrics_server()
+
+@signals.worker_process_init.connect
+def init_worker_process(**kwargs):
+    set_service_name('worker')
+
+@signals.worker_process_shutdown.connect
+def cleanup_worker_metrics(pid=None, **kwargs):
+    mark_process_dead(pid or os.getpid())
+
+@signals.before_task_publish.connect
+def propagate_trace_context(headers=None, **kwargs):
+    # O contexto segue nos cabeçalhos da mensagem e chega à tarefa em task.request.
+    if headers is not None and (traceparent := current_traceparent()):
+        headers[TRACEPARENT_HEADER] = traceparent
+
+_running_tasks = {}
+
+@signals.task_prerun.connect
+def record_task_start(task_id=None, task=None, **kwargs):
+    span = begin_span(f"task.{task.name.rsplit('.', 1)[-1]}", task.request.get(TRACEPARENT_HEADER), {'celery.task_id': task_id}) if task is not None else None
+    _running_tasks[task_id] = (time.perf_counter(), span)
+
+@signals.task_postrun.connect
+def record_task_duration(task_id=None, task=None, state=None, **kwargs):
+    started, span = _running_tasks.pop(task_id, (None, None))
+    if started is not None and task is not None:
+        observe_stage(f"task.{task.name.rsplit('.', 1)[-1]}", time.perf_counter() - started)
+    if span is not None:
+        span.set_attribute('celery.state', state)
+        span.finish()
 
-# --- Função Auxiliar para Extrair Corpo do Email ---
-def get_email_body(payload):
+
+# Erros transitórios da API do Gmail, da rede ou do broker, que justificam uma nova tentativa.
+TRANSIENT_ERRORS = (googleapiclient.errors.HttpError, OSError, BrokerError)
+
+# Durante quanto tempo as mensagens processadas são lembradas para deduplicação.
+PROCESSED_MESSAGES_TTL_DAYS = int(os.environ.get('PROCESSED_MESSAGES_TTL_DAYS', 30))
+
+# Com MAILBOX_QUEUE_SHARDS > 0, cada caixa de correio é atribuída de forma estável a uma
+# fila '<etapa>.N' (ex: 'ingest.3', 'llm.3'), para que uma conta com muito tráfego não
+# atrase as restantes. Os workers consomem as filas com: -Q ingest.0,ingest.1,...
+# Com 0 (por omissão) as tarefas usam as filas por etapa definidas em task_routes.
+MAILBOX_QUEUE_SHARDS = int(os.environ.get('MAILBOX_QUEUE_SHARDS', 0))
+
+
+def mailbox_queue_for(user_email, stage):
+    """Devolve a fila Celery da etapa dedicada à caixa de correio, ou None para usar task_routes."""
+    if MAILBOX_QUEUE_SHARDS <= 0:
+        return None
+    return f"{stage}.{zlib.crc32(user_email.lower().encode('utf-8')) % MAILBOX_QUEUE_SHARDS}"
+
+
+# --- Sincronização da Caixa de Correio (acionada pelo webhook) ---
+@celery.task(
+    autoretry_for=TRANSIENT_ERRORS, retry_backoff=True, retry_backoff_max=300, max_retries=5,
+    soft_time_limit=INGEST_SOFT_TIME_LIMIT, time_limit=INGEST_TIME_LIMIT
+)
+def sync_mailbox(user_email, notification_history_id=None):
     """
-    Procura recursivamente pelo melhor corpo de texto num payload de email.
-    Prioritiza texto simples e recorre a uma versão limpa do HTML como fallback.
+    Obtém as threads novas desde o último historyId sincronizado e agenda um
+    process_new_email por cada thread ainda não processada.
+    A tarefa é idempotente (claim_message), por isso pode ser repetida após erros transitórios.
     """
-    if "parts" in payload:
-        for part in payload['parts']:
-            if part['mimeType'] == 'text/plain':
-                data = part['body'].get('data')
-                if data:
-                    return base64.urlsafe_b64decode(data).decode('utf-8')
-
-        for part in payload['parts']:
-            if part['mimeType'] == 'text/html':
-                data = part['body'].get('data')
-                if data:
-                    html_content = base64.urlsafe_b64decode(data).decode('utf-8')
-                    soup = BeautifulSoup(html_content, "html.parser")
-                    return soup.get_text(separator='\n', strip=True)
-
-    elif 'data' in payload.get('body', {}):
-        data = payload['body']['data']
-        if payload['mimeType'] == 'text/html':
-            html_content = base64.urlsafe_b64decode(data).decode('utf-8')
-            soup = BeautifulSoup(html_content, "html.parser")
-            return soup.get_text(separator='\n', strip=True)
-        elif payload['mimeType'] == 'text/plain':
-            return base64.urlsafe_b64decode(data).decode('utf-8')
-
-    return ""
+    service = get_gmail_client(user_email)
+    if not service:
+        logging.warning(f"Sync: sem credenciais guardadas para {user_email}. A ignorar.")
+        return
+
+    start_history_id = get_last_history_id(user_email)
+    new_messages, latest_history_id = (None, None)
+    if start_history_id:
+        new_messages, latest_history_id = list_new_inbox_messages(service, start_history_id)
+
+    if new_messages is None:
+        # Sem ponto de partida (primeira notificação ou historyId expirado): recorre à mensagem mais recente.
+        response = service.users().messages().list(userId='me', labelIds=['INBOX'], maxResults=1).execute()
+        new_messages = {message['threadId']: message['id'] for message in response.get('messages', [])}
+
+    if not new_messages:
+        logging.info(f"Sync: nenhuma mensagem nova na INBOX de {user_email} desde a última sincronização.")
+
+    for thread_id, message_id in new_messages.items():
+        if claim_message(user_email, thread_id, message_id):
+            try:
+                process_new_email.apply_async(args=[thread_id, user_email, message_id], queue=mailbox_queue_for(user_email, QUEUE_LLM))
+            except Exception:
+                # Sem a reclamação, a nova tentativa (ou o próximo webhook) volta a agendar a mensagem.
+                release_message(user_email, thread_id, message_id)
+                raise
+            logging.info(f"Sync: nova mensagem {message_id} da thread {thread_id} agendada para processamento.")
+        else:
+            logging.info(f"Sync: mensagem {message_id} da thread {thread_id} já processada. A ignorar.")
+
+    # O historyId só avança depois de todas as mensagens estarem agendadas: se o ciclo acima
+    # falhar, a nova tentativa volta a percorrer o mesmo intervalo do histórico.
+    sync_history_id = max(filter(None, [notification_history_id, latest_history_id]), key=int, default=None)
+    if sync_history_id:
+        save_last_history_id(user_email, sync_history_id)
+
+    purge_pubsub_deliveries()
+    purge_processed_threads(PROCESSED_MESSAGES_TTL_DAYS)
 
 
 # --- Tarefa Principal em Background (ATUALIZADA) ---
-@celery.task
-def process_new_email(thread_id, user_credentials):
+@celery.task(
+    bind=True, max_retries=3, default_retry_delay=30, rate_limit=LLM_RATE_LIMIT,
+    soft_time_limit=LLM_SOFT_TIME_LIMIT, time_limit=LLM_TIME_LIMIT
+)
+@profiled('process_new_email')
+def process_new_email(self, thread_id, user_email, message_id=None):
     """
     Busca um email, gera um rascunho de alta qualidade e guarda-o para aprovação.
     Esta lógica agora espelha a rota /draft do app.py para consistência total.
+    Só os erros transitórios ao obter a thread do Gmail são repetidos: depois de o
+    rascunho ser guardado, uma repetição criaria um duplicado.
     """
     logging.info(f"A iniciar processamento de novo email da thread: {thread_id}")
+    set_attribute('gmail.thread_id', thread_id)
 
     try:
-        creds = google.oauth2.credentials.Credentials(**user_credentials)
-        service = googleapiclient.discovery.build('gmail', 'v1', credentials=creds)
+        service = get_gmail_client(user_email)
+        if not service:
+            logging.warning(f"Sem credenciais guardadas para {user_email}. A ignorar a thread {thread_id}.")
+            return
 
-        thread = service.users().threads().get(userId='me', id=thread_id, format='full').execute()
+        try:
+            thread = service.users().threads().get(userId='me', id=thread_id, format='full').execute()
+        except TRANSIENT_ERRORS as e:
+            logging.warning(f"Falha transitória ao obter a thread {thread_id}: {e}. A tentar novamente.")
+            raise self.retry(exc=e)
 
-        last_message = thread['messages'][-1]
+        # Responde à mensagem reclamada; sem message_id, à última mensagem da thread.
+        last_message = next((m for m in thread['messages'] if m['id'] == message_id), thread['messages'][-1])
         if 'SENT' in last_message.get('labelIds', []):
             logging.info(f"Thread {thread_id} ignorada (prevenção de loop).")
             return
@@ -87,154 +229,91 @@ def process_new_email(thread_id, user_credentials):
 
         original_message_id = next((h['value'] for h in headers if h['name'].lower() == 'message-id'), None)
         original_subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), '')
-        email_body_text = get_email_body(payload)
+        # Só o texto novo da mensagem: o histórico citado e a assinatura não entram no resumo,
+        # na pesquisa de conhecimento nem no prompt.
+        email_body_text = strip_quoted_reply(extract_body(payload))
 
         if not email_body_text:
             logging.warning(f"Não foi possível extrair o corpo do texto da thread {thread_id}. A ignorar.")
             return
 
+        # --- PASSO 0: TRIAGEM LOCAL (antes de qualquer chamada ao LLM) ---
+        needs_reply, triage_reason = triage_message(last_message, email_body_text)
+        if not needs_reply:
+            logging.info(f"Thread {thread_id} ignorada pela triagem ({triage_reason}): não precisa de resposta.")
+            return
+
         # --- PASSO 1: RESUMO PARA NOTIFICAÇÃO ---
         summary_prompt = f"Resume o ponto principal deste email numa frase curta (máx 15 palavras) em Português. EMAIL: '{email_body_text}'"
         summary_response = call_gemini(summary_prompt, temperature=0.2)
         original_email_summary = summary_response.get("text", "Não foi possível resumir.").strip()
 
         # --- PASSO 2: SELEÇÃO DE PERSONA ---
+        # A ontologia é relida se tiver mudado (ex: personas editadas na interface web).
+        snapshot = get_snapshot()
+        ontology = snapshot.data
         sender_name, sender_email = parse_sender_info(str(headers))
-        interlocutor_profile = None
         persona_id = 'rodrigo_novelo_formal'
 
-        if sender_email:
-            profiles = ONTOLOGY_DATA.get("interlocutor_profiles", {})
-            for key, profile in profiles.items():
-                if profile.get("email_match", "").lower() == sender_email.lower():
-                    interlocutor_profile = profile
-                    relationship = profile.get('relationship', '').lower()
-                    if any(term in relationship for term in ['amigo', 'irmão', 'colega']):
-                        persona_id = 'rodrigo_novelo_informal'
-                    break
-        
-        if not interlocutor_profile:
+        interlocutor_profile = snapshot.find_interlocutor(sender_email)
+        if interlocutor_profile:
+            persona_source = 'profile'
+            relationship = interlocutor_profile.get('relationship', '').lower()
+            if any(term in relationship for term in ['amigo', 'irmão', 'colega']):
+                persona_id = 'rodrigo_novelo_informal'
+        elif predicted_persona_id := predict_persona(get_formality_classifier(snapshot, user_email, get_persona_choices), email_body_text):
+            # Classificador local confiante: poupa a chamada ao LLM para analisar o tom.
+            persona_source = 'classifier'
+            persona_id = predicted_persona_id
+        else:
+            persona_source = 'llm'
             tone_analysis_prompt = f"Analisa o tom do seguinte email e classifica-o como 'formal' ou 'informal'. Responde APENAS com uma palavra.\n\nE-MAIL:\n\"{email_body_text}\""
             tone_response = call_gemini(tone_analysis_prompt, temperature=0.0)
             if "informal" in tone_response.get("text", "formal").strip().lower():
                 persona_id = 'rodrigo_novelo_informal'
 
-        persona = ONTOLOGY_DATA.get("personas", {}).get(persona_id)
+        # As escolhas do próprio classificador não voltam a ser exemplos de treino.
+        if persona_source != 'classifier':
+            record_persona_choice(user_email, persona_id, email_body_text, persona_source)
+
+        persona = ontology.get("personas", {}).get(persona_id)
         if not persona:
             logging.error(f"Persona '{persona_id}' não encontrada.")
             return
         logging.info(f"A utilizar a persona: {persona.get('label')}")
 
         # --- PASSO 3: CONSTRUÇÃO DE CONTEXTO (LÓGICA ATUALIZADA) ---
-        base_knowledge = ONTOLOGY_DATA.get("base_knowledge", [])
-        persona_specific_knowledge = persona.get("personal_knowledge_base", [])
-        combined_knowledge = base_knowledge + persona_specific_knowledge
-
         learned_corrections = persona.get("learned_knowledge_base", [])
 
         relevant_memories, relevant_corrections = find_relevant_knowledge(
-            email_body_text, combined_knowledge, learned_corrections
+            email_body_text, snapshot.knowledge_indexes(persona_id), learned_corrections
         )
 
-                # --- INÍCIO DA LÓGICA DE ESTADO E DESCONFLITUALIZAÇÃO (AUTOMAÇÃO - VERSÃO FINAL) ---
-        final_task_instruction = "A sua tarefa é escrever um rascunho de e-mail completo e natural, seguindo as instruções."
-        is_scheduling_request = 'reunião' in email_body_text.lower() or 'marcar' in email_body_text.lower()
-
+        final_task_instruction = DEFAULT_TASK_INSTRUCTION
         # Na automação, um pedido de agendamento ATIVA SEMPRE o protocolo de segurança
-        if is_scheduling_request:
-            relevant_corrections = [rule for rule in relevant_corrections if "agendamento" not in rule.lower()]
+        if is_scheduling_request(email_body_text):
+            relevant_corrections = without_scheduling_rules(relevant_corrections)
             logging.info("Regra de agendamento suprimida para automação para forçar o uso da regra de segurança.")
-            # A tarefa da IA é refinada para ser mais natural e proativa, mas segura.
-            final_task_instruction = "A sua tarefa é acusar a receção do pedido de agendamento e indicar que as datas/horas precisam de ser confirmadas internamente. Para isso, construa uma frase natural que utilize os placeholders '[Confirmar data aqui]' e '[Confirmar hora aqui]' para propor as datas. NÃO INVENTE NENHUMA DATA OU HORA."
-        # --- FIM DA LÓGICA ---
-
-        prompt_context_parts = []
-        style_profile = persona.get("style_profile", {})
-        
-        tone_keywords = style_profile.get('tone_keywords', [])
-        verbosity = style_profile.get('verbosity')
-        
-        style_instructions = []
-        if tone_keywords:
-            style_instructions.append(f"Tom geral a adotar: {', '.join(tone_keywords)}.")
-        if verbosity:
-            style_instructions.append(f"Nível de detalhe do texto: {verbosity}.")
-        
-        if style_instructions:
-            prompt_context_parts.append("--- Estilo e Tom (Seguir estritamente) ---\n" + "\n".join(style_instructions))
-
-        if key_principles := style_profile.get('key_principles', []):
-            prompt_context_parts.append("--- Princípios Chave da Persona (Regras Gerais) ---\n- " + "\n- ".join(key_principles))
+            final_task_instruction = SCHEDULING_TASK_INSTRUCTION
 
-        if interlocutor_profile:
-            context_parts = [f"Nome: {interlocutor_profile.get('full_name')}", f"Relação: {interlocutor_profile.get('relationship')}"]
-            prompt_context_parts.append("--- Contexto Sobre o Interlocutor ---\n" + " | ".join(filter(None, context_parts)))
-            if personalization_rules := interlocutor_profile.get("personalization_rules", []):
-                prompt_context_parts.append(f"--- Regras Específicas Para Este Contacto (Prioridade Máxima) ---\n- " + "\n- ".join(personalization_rules))
-
-        if relevant_memories:
-            formatted_memories = [f"{mem.get('label', 'Facto')} = {mem.get('value')}" for mem in relevant_memories if mem.get('value')]
-            if formatted_memories:
-                prompt_context_parts.append(f"--- Factos Relevantes da Memória (Usar apenas se solicitado) ---\n- " + "\n- ".join(formatted_memories))
-
-        if relevant_corrections:
-            critical_rules, standard_rules = [], []
-            for rule in relevant_corrections:
-                if re.search(r'\b(Nunca|Jamais|Regra Crítica)\b', rule, re.IGNORECASE):
-                    critical_rules.append(rule)
-                else:
-                    standard_rules.append(rule)
-            if standard_rules:
-                prompt_context_parts.append(f"--- Regras Aprendidas (Sobrepõem-se aos Princípios Chave) ---\n- " + "\n- ".join(standard_rules))
-            if critical_rules:
-                prompt_context_parts.insert(0, f"--- REGRAS CRÍTICAS E INVIOLÁVEIS (OBRIGATÓRIO CUMPRIR) ---\n- " + "\n- ".join(critical_rules))
-
-        final_context_block = "\n\n".join(prompt_context_parts)
+        final_context_block = build_context_block(persona, interlocutor_profile, relevant_memories, relevant_corrections)
 
         # --- PASSO 4: PROMPT FINAL E CHAMADA À IA ---
-        guidance_summary = "Nenhuma instrução específica. Gerar uma resposta com base no contexto do email e na persona."
-        
-        default_ids = persona.get("default_components", {})
-        recipient_first_name = sender_name.split()[0] if sender_name else ""
-        greeting_text = resolve_component(get_component("greetings", default_ids.get("greeting_id")), recipient_first_name)
-        closing_text = resolve_component(get_component("closings", default_ids.get("closing_id")))
-        signature_text = resolve_component(get_component("signatures", default_ids.get("signature_id")))
-
-        final_prompt = f"""
-Você é um assistente de escrita que encarna a persona '{persona.get('label', persona_id)}'.
-{final_task_instruction}
-
-{final_context_block}
-
---- E-mail Original a Responder ---
-{email_body_text}
-
---- Instruções do Utilizador (Seguir à risca) ---
-{guidance_summary}
-
---- Rascunho Final (Comece aqui) ---
-{greeting_text}
-
-[ESCREVA O CORPO DO E-MAIL AQUI]
-
-{closing_text}
-{signature_text}
-"""
+        final_prompt = build_draft_prompt(
+            persona, persona_id, final_task_instruction, final_context_block,
+            email_body_text, DEFAULT_GUIDANCE_SUMMARY, sender_name
+        )
         llm_response = call_gemini(final_prompt, temperature=0.5)
         if "error" in llm_response:
             logging.error(f"Erro da API Gemini: {llm_response['error']}")
             return
 
         # --- PASSO 5: LIMPEZA DA RESPOSTA ---
-        raw_draft = llm_response.get("text", "").strip()
-        if "--- Rascunho Final (Comece aqui) ---" in raw_draft:
-            raw_draft = raw_draft.split("--- Rascunho Final (Comece aqui) ---")[-1]
-        
-        final_draft_body = raw_draft.replace('[ESCREVA O CORPO DO E-MAIL AQUI]', '').strip()
-        final_draft_body = re.sub(r'\n{3,}', '\n\n', final_draft_body).strip()
+        final_draft_body = clean_draft_text(llm_response.get("text", ""))
 
         # --- PASSO 6: GUARDAR E NOTIFICAR ---
         new_draft_id = add_pending_draft(
+            user_email=user_email,
             thread_id=thread_id,
             recipient=sender_email,
             subject=f"Re: {original_subject}",
@@ -242,13 +321,58 @@ Você é um assistente de escrita que encarna a persona '{persona.get('label', p
             original_message_id=original_message_id
         )
         logging.info(f"Rascunho {new_draft_id} gerado e guardado com sucesso para a thread {thread_id}.")
+        set_attribute('draft.id', new_draft_id)
 
         draft_details_for_notification = {
             "subject": f"Re: {original_subject}",
             "full_draft_body": final_draft_body,
             "original_summary": original_email_summary
         }
-        send_approval_notification(new_draft_id, draft_details_for_notification)
+        send_draft_notification.delay(new_draft_id, draft_details_for_notification, user_email)
 
+    except Retry:
+        # Deixa o Celery reagendar a tarefa (ver self.retry acima).
+        raise
+    except SoftTimeLimitExceeded:
+        logging.error(f"Limite de tempo excedido ao processar a thread {thread_id}.")
     except Exception as e:
         logging.error(f"Ocorreu um erro inesperado ao processar a thread {thread_id}: {e}", exc_info=True)
+
+
+# --- Notificações (fila própria, para não ocupar slots da geração LLM) ---
+@celery.task(soft_time_limit=30, time_limit=45)
+def send_draft_notification(draft_id, draft_details, user_email=''):
+    """
+    Põe em espera a notificação de um rascunho acabado de gerar e agenda o envio para o fim
+    da janela de agregação: os rascunhos de uma rajada seguem numa só notificação.
+    """
+    # Se o envio agendado se perder (ex: worker reiniciado), o próximo rascunho agenda outro.
+    flush_needed = queue_notification(user_email, draft_id, draft_details, stale_after_seconds=NOTIFY_DIGEST_WINDOW * 4 + 60)
+    if flush_needed or NOTIFY_DIGEST_WINDOW <= 0:
+        flush_draft_notifications.apply_async(countdown=NOTIFY_DIGEST_WINDOW)
+
+@celery.task(bind=True, max_retries=NOTIFY_MAX_RETRIES, rate_limit=NOTIFY_RATE_LIMIT, soft_time_limit=30, time_limit=45)
+def flush_draft_notifications(self):
+    """Envia as notificações em espera; falhas temporárias do fornecedor são repetidas com backoff."""
+    # O id da tarefa mantém-se entre tentativas: uma nova tentativa reenvia o mesmo lote
+    # (e o que entretanto tiver chegado).
+    claim_id = self.request.id or str(uuid.uuid4())
+    notifications = claim_notifications(claim_id)
+    if not notifications:
+        return
+    try:
+        send_draft_notifications(notifications)
+    except TransientNotificationError as e:
+        if e.delivered:
+            # Entrega parcial (ex: o resumo de um destinatário já saiu): não se repete.
+            delete_notifications(claim_id, [notification['draft_id'] for notification in e.delivered])
+            notifications = [notification for notification in notifications if notification not in e.delivered]
+        if self.request.retries >= self.max_retries:
+            logging.error(f"Notificação de {len(notifications)} rascunhos falhou após {self.request.retries} tentativas: {e}")
+            release_notifications(claim_id)
+            return
+        countdown = min(2 ** self.request.retries * 10, 600)
+        logging.warning(f"Falha temporária ao notificar {len(notifications)} rascunhos; nova tentativa em {countdown}s: {e}")
+        raise self.retry(exc=e, countdown=countdown)
+    # Rejeições definitivas (ex: token inválido) já foram registadas no log e não se repetem.
+    delete_notifications(claim_id)
@@ -1,15 +1,57 @@
+import os
 import sqlite3
+import hashlib
+import threading
 import uuid
 import json
-from datetime import datetime
+from datetime import datetime, timedelta
 
-DATABASE_FILE = 'automation.db'
+from core.metrics import stage_timer
+from automation.events import publish_draft_event
 
-def init_db():
-    """Initializes the database and creates all necessary tables if they don't exist."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    
+DATABASE_FILE = os.environ.get('AUTOMATION_DB_FILE', 'automation.db')
+# Tempo máximo (ms) que uma escrita espera pelo lock antes de falhar com "database is locked".
+BUSY_TIMEOUT_MS = int(os.environ.get('AUTOMATION_DB_BUSY_TIMEOUT_MS', 5000))
+# Nº de statements preparados mantidos em cache por ligação.
+STATEMENT_CACHE_SIZE = 128
+# Nº de rascunhos pendentes devolvidos por página no dashboard.
+DASHBOARD_PAGE_SIZE = int(os.environ.get('DASHBOARD_PAGE_SIZE', 50))
+
+_thread_local = threading.local()
+
+def get_connection():
+    """
+    Devolve a ligação SQLite da thread atual, criando-a na primeira utilização.
+    As ligações são reutilizadas por thread e recriadas após um fork (ex: workers Celery
+    prefork), e usam WAL para que leitores e escritores de processos diferentes não se bloqueiem.
+    """
+    conn = getattr(_thread_local, 'conn', None)
+    if conn is not None and _thread_local.pid == os.getpid():
+        return conn
+
+    conn = sqlite3.connect(DATABASE_FILE, timeout=BUSY_TIMEOUT_MS / 1000, cached_statements=STATEMENT_CACHE_SIZE)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    # Em WAL, NORMAL é seguro contra corrupção e evita um fsync por commit.
+    conn.execute("PRAGMA synchronous=NORMAL")
+    _thread_local.conn = conn
+    _thread_local.pid = os.getpid()
+    _ensure_schema(conn)
+    return conn
+
+def close_connection():
+    """Fecha a ligação da thread atual (ex: no fim de um processo ou benchmark)."""
+    conn = getattr(_thread_local, 'conn', None)
+    if conn is not None and _thread_local.pid == os.getpid():
+        conn.close()
+    _thread_local.conn = None
+
+# --- MIGRAÇÕES DE ESQUEMA ---
+# Cada migração corre uma única vez, pela ordem da lista; a versão aplicada fica guardada
+# em PRAGMA user_version. Novas alterações de esquema acrescentam uma função ao fim da lista.
+
+def _migration_001_initial_schema(cursor):
     # Schema includes the 'original_message_id' column for correct email threading.
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS pending_drafts (
@@ -20,142 +62,565 @@ def init_db():
             body TEXT NOT NULL,
             status TEXT NOT NULL DEFAULT 'pending',
             created_at TIMESTAMP NOT NULL,
-            original_message_id TEXT 
+            original_message_id TEXT
         )
     ''')
-    
+
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS user_credentials (
             email TEXT PRIMARY KEY,
             credentials_json TEXT NOT NULL
         )
     ''')
-    
+
+    # Versões antigas deduplicavam apenas por thread; migra para (thread_id, message_id).
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(processed_threads)").fetchall()]
+    if columns and 'message_id' not in columns:
+        cursor.execute("ALTER TABLE processed_threads RENAME TO processed_threads_legacy")
+
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS processed_threads (
-            thread_id TEXT PRIMARY KEY,
-            processed_at TIMESTAMP NOT NULL
+            thread_id TEXT NOT NULL,
+            message_id TEXT NOT NULL,
+            processed_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (thread_id, message_id)
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_processed_threads_processed_at ON processed_threads (processed_at)")
+
+    if columns and 'message_id' not in columns:
+        cursor.execute('''
+            INSERT OR IGNORE INTO processed_threads (thread_id, message_id, processed_at)
+            SELECT thread_id, '', processed_at FROM processed_threads_legacy
+        ''')
+        cursor.execute("DROP TABLE processed_threads_legacy")
+
+    # Último historyId do Gmail já sincronizado, por caixa de correio.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS mailbox_sync_state (
+            email TEXT PRIMARY KEY,
+            history_id TEXT NOT NULL,
+            updated_at TIMESTAMP NOT NULL
+        )
+    ''')
+
+    # IDs das mensagens Pub/Sub já recebidas, para ignorar reentregas do webhook.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS pubsub_deliveries (
+            message_id TEXT PRIMARY KEY,
+            received_at TIMESTAMP NOT NULL
+        )
+    ''')
+
+def _migration_002_dashboard_indexes_and_counters(cursor):
+    # Índice para a listagem paginada de rascunhos por estado (keyset em created_at, id).
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pending_drafts_status_created ON pending_drafts (status, created_at, id)")
+
+    # Contadores por estado mantidos por triggers, para que as estatísticas do dashboard
+    # não tenham de contar a tabela inteira a cada pedido.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS draft_status_counts (
+            status TEXT PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute("DELETE FROM draft_status_counts")
+    cursor.execute("INSERT INTO draft_status_counts (status, count) SELECT status, COUNT(*) FROM pending_drafts GROUP BY status")
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_pending_drafts_count_insert AFTER INSERT ON pending_drafts
+        BEGIN
+            INSERT OR IGNORE INTO draft_status_counts (status, count) VALUES (NEW.status, 0);
+            UPDATE draft_status_counts SET count = count + 1 WHERE status = NEW.status;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_pending_drafts_count_update AFTER UPDATE OF status ON pending_drafts
+        WHEN OLD.status IS NOT NEW.status
+        BEGIN
+            UPDATE draft_status_counts SET count = count - 1 WHERE status = OLD.status;
+            INSERT OR IGNORE INTO draft_status_counts (status, count) VALUES (NEW.status, 0);
+            UPDATE draft_status_counts SET count = count + 1 WHERE status = NEW.status;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_pending_drafts_count_delete AFTER DELETE ON pending_drafts
+        BEGIN
+            UPDATE draft_status_counts SET count = count - 1 WHERE status = OLD.status;
+        END
+    ''')
+
+def _migration_003_per_user_ownership(cursor):
+    # Com uma única conta pré-existente, os dados antigos passam a pertencer-lhe;
+    # com várias não é possível saber o dono e ficam sem utilizador ('').
+    emails = [row[0] for row in cursor.execute("SELECT email FROM user_credentials").fetchall()]
+    legacy_owner = emails[0] if len(emails) == 1 else ''
+
+    cursor.execute("ALTER TABLE pending_drafts ADD COLUMN user_email TEXT NOT NULL DEFAULT ''")
+    cursor.execute("UPDATE pending_drafts SET user_email = ?", (legacy_owner,))
+    cursor.execute("DROP INDEX IF EXISTS idx_pending_drafts_status_created")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pending_drafts_user_status_created ON pending_drafts (user_email, status, created_at, id)")
+
+    # Os IDs de threads e mensagens do Gmail só são únicos dentro de cada caixa de correio.
+    cursor.execute("DROP INDEX IF EXISTS idx_processed_threads_processed_at")
+    cursor.execute("ALTER TABLE processed_threads RENAME TO processed_threads_legacy")
+    cursor.execute('''
+        CREATE TABLE processed_threads (
+            user_email TEXT NOT NULL,
+            thread_id TEXT NOT NULL,
+            message_id TEXT NOT NULL,
+            processed_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (user_email, thread_id, message_id)
+        )
+    ''')
+    cursor.execute(
+        "INSERT INTO processed_threads (user_email, thread_id, message_id, processed_at) "
+        "SELECT ?, thread_id, message_id, processed_at FROM processed_threads_legacy",
+        (legacy_owner,)
+    )
+    cursor.execute("DROP TABLE processed_threads_legacy")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_processed_threads_processed_at ON processed_threads (processed_at)")
+
+    # Contadores do dashboard passam a ser por utilizador.
+    for trigger in ['trg_pending_drafts_count_insert', 'trg_pending_drafts_count_update', 'trg_pending_drafts_count_delete']:
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    cursor.execute("DROP TABLE IF EXISTS draft_status_counts")
+    cursor.execute('''
+        CREATE TABLE draft_status_counts (
+            user_email TEXT NOT NULL,
+            status TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_email, status)
         )
     ''')
-    
-    conn.commit()
-    conn.close()
-    print("Database initialized successfully with the new schema.")
+    cursor.execute(
+        "INSERT INTO draft_status_counts (user_email, status, count) "
+        "SELECT user_email, status, COUNT(*) FROM pending_drafts GROUP BY user_email, status"
+    )
+    cursor.execute('''
+        CREATE TRIGGER trg_pending_drafts_count_insert AFTER INSERT ON pending_drafts
+        BEGIN
+            INSERT OR IGNORE INTO draft_status_counts (user_email, status, count) VALUES (NEW.user_email, NEW.status, 0);
+            UPDATE draft_status_counts SET count = count + 1 WHERE user_email = NEW.user_email AND status = NEW.status;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER trg_pending_drafts_count_update AFTER UPDATE OF status ON pending_drafts
+        WHEN OLD.status IS NOT NEW.status
+        BEGIN
+            UPDATE draft_status_counts SET count = count - 1 WHERE user_email = OLD.user_email AND status = OLD.status;
+            INSERT OR IGNORE INTO draft_status_counts (user_email, status, count) VALUES (NEW.user_email, NEW.status, 0);
+            UPDATE draft_status_counts SET count = count + 1 WHERE user_email = NEW.user_email AND status = NEW.status;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER trg_pending_drafts_count_delete AFTER DELETE ON pending_drafts
+        BEGIN
+            UPDATE draft_status_counts SET count = count - 1 WHERE user_email = OLD.user_email AND status = OLD.status;
+        END
+    ''')
 
-def add_pending_draft(thread_id, recipient, subject, body, original_message_id):
+def _migration_004_persona_choices(cursor):
+    # Escolhas de persona (formal/informal) com o email que as motivou: exemplos de treino
+    # do classificador local de formalidade (core/formality.py).
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS persona_choices (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_email TEXT NOT NULL,
+            persona_id TEXT NOT NULL,
+            email_text TEXT NOT NULL,
+            source TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL
+        )
+    ''')
+
+def _migration_005_pending_notifications(cursor):
+    # Notificações à espera de envio: os rascunhos gerados numa rajada são agregados numa
+    # só notificação. claim_id identifica a tarefa de envio que as reclamou.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS pending_notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_email TEXT NOT NULL,
+            draft_id TEXT NOT NULL,
+            details_json TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL,
+            claim_id TEXT
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_pending_notifications_claim ON pending_notifications (claim_id, created_at)')
+
+def _migration_006_persona_choices_by_user(cursor):
+    # O classificador de formalidade treina só com as escolhas de cada utilizador.
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_persona_choices_user ON persona_choices (user_email, id)')
+
+def _migration_007_persona_choices_dedupe(cursor):
+    # Uma escolha por (utilizador, email): regenerar o rascunho do mesmo email não pode
+    # acrescentar exemplos repetidos ao classificador. Fica a escolha mais recente.
+    cursor.execute('ALTER TABLE persona_choices ADD COLUMN email_hash TEXT')
+    rows = cursor.execute('SELECT id, email_text FROM persona_choices').fetchall()
+    cursor.executemany('UPDATE persona_choices SET email_hash = ? WHERE id = ?', [(_email_hash(text), row_id) for row_id, text in rows])
+    cursor.execute('''
+        DELETE FROM persona_choices WHERE id NOT IN (
+            SELECT MAX(id) FROM persona_choices GROUP BY user_email, email_hash
+        )
+    ''')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_persona_choices_user_email_hash ON persona_choices (user_email, email_hash)')
+
+MIGRATIONS = [
+    _migration_001_initial_schema,
+    _migration_002_dashboard_indexes_and_counters,
+    _migration_003_per_user_ownership,
+    _migration_004_persona_choices,
+    _migration_005_pending_notifications,
+    _migration_006_persona_choices_by_user,
+    _migration_007_persona_choices_dedupe,
+]
+
+_schema_ready_pid = None
+
+def migrate(conn):
+    """Aplica as migrações em falta. Seguro com vários processos a arrancar em simultâneo."""
+    current_version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if current_version >= len(MIGRATIONS):
+        return current_version
+
+    # BEGIN IMMEDIATE obtém o lock de escrita antes de reler a versão, para que só um
+    # processo aplique cada migração.
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        current_version = conn.execute("PRAGMA user_version").fetchone()[0]
+        cursor = conn.cursor()
+        for version, migration in enumerate(MIGRATIONS[current_version:], start=current_version + 1):
+            migration(cursor)
+            cursor.execute(f"PRAGMA user_version = {version}")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return len(MIGRATIONS)
+
+def _ensure_schema(conn):
+    global _schema_ready_pid
+    if _schema_ready_pid != os.getpid():
+        migrate(conn)
+        _schema_ready_pid = os.getpid()
+
+def init_db():
+    """Initializes the database and applies any pending schema migrations."""
+    version = migrate(get_connection())
+    print(f"Database initialized successfully (schema version {version}).")
+
+@stage_timer('sqlite.add_pending_draft')
+def add_pending_draft(user_email, thread_id, recipient, subject, body, original_message_id):
     """Adds a new draft to the database, including the ID of the message being replied to."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
+    conn = get_connection()
     new_id = str(uuid.uuid4())
     created_time = datetime.now()
-    cursor.execute(
-        "INSERT INTO pending_drafts (id, thread_id, recipient, subject, body, created_at, original_message_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
-        (new_id, thread_id, recipient, subject, body, created_time, original_message_id)
-    )
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.execute(
+            "INSERT INTO pending_drafts (id, user_email, thread_id, recipient, subject, body, created_at, original_message_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (new_id, user_email, thread_id, recipient, subject, body, created_time, original_message_id)
+        )
+    publish_draft_event(user_email, 'draft_created', {
+        'id': new_id, 'recipient': recipient, 'subject': subject, 'created_at': created_time, 'status': 'pending'
+    }, get_draft_counts(user_email))
     return new_id
 
-def get_pending_draft(draft_id):
-    """Retrieves a single pending draft by its ID."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    conn.row_factory = sqlite3.Row 
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM pending_drafts WHERE id = ? AND status = 'pending'", (draft_id,))
-    draft = cursor.fetchone()
-    conn.close()
+@stage_timer('sqlite.get_pending_draft')
+def get_pending_draft(draft_id, user_email=None):
+    """Retrieves a single pending draft by its ID, optionally restricted to its owner."""
+    if user_email is None:
+        draft = get_connection().execute("SELECT * FROM pending_drafts WHERE id = ? AND status = 'pending'", (draft_id,)).fetchone()
+    else:
+        draft = get_connection().execute("SELECT * FROM pending_drafts WHERE id = ? AND user_email = ? AND status = 'pending'", (draft_id, user_email)).fetchone()
     return dict(draft) if draft else None
 
-def update_draft_status(draft_id, status):
-    """Updates the status of a draft (e.g., 'approved', 'rejected')."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    cursor.execute("UPDATE pending_drafts SET status = ? WHERE id = ?", (status, draft_id))
-    conn.commit()
-    updated_rows = conn.total_changes
-    conn.close()
-    return updated_rows > 0
-
-def get_dashboard_stats():
-    """Gathers statistics for the automation dashboard."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT COUNT(*) as count FROM pending_drafts WHERE status = 'pending'")
-    pending = cursor.fetchone()['count']
-    
-    cursor.execute("SELECT COUNT(*) as count FROM pending_drafts WHERE status = 'approved'")
-    sent = cursor.fetchone()['count']
-    
-    cursor.execute("SELECT COUNT(*) as count FROM pending_drafts WHERE status = 'rejected'")
-    rejected = cursor.fetchone()['count']
-    
-    cursor.execute("SELECT COUNT(*) as count FROM pending_drafts")
-    total = cursor.fetchone()['count']
-    
-    cursor.execute("SELECT id, recipient, subject, created_at FROM pending_drafts WHERE status = 'pending' ORDER BY created_at DESC")
-    drafts = [dict(row) for row in cursor.fetchall()]
-    
-    conn.close()
+@stage_timer('sqlite.update_draft_status')
+def update_draft_status(draft_id, status, user_email=None):
+    """Updates the status of a draft (e.g., 'approved', 'rejected'), optionally restricted to its owner."""
+    conn = get_connection()
+    with conn:
+        if user_email is None:
+            cursor = conn.execute("UPDATE pending_drafts SET status = ? WHERE id = ? RETURNING user_email", (status, draft_id))
+        else:
+            cursor = conn.execute("UPDATE pending_drafts SET status = ? WHERE id = ? AND user_email = ? RETURNING user_email", (status, draft_id, user_email))
+        row = cursor.fetchone()
+    if row:
+        owner = row['user_email']
+        publish_draft_event(owner, 'status_changed', {'id': draft_id, 'status': status}, get_draft_counts(owner))
+    return row is not None
+
+@stage_timer('sqlite.get_pending_drafts')
+def get_pending_drafts(draft_ids, user_email):
+    """Devolve {id: rascunho} para os rascunhos pendentes do utilizador entre os IDs indicados."""
+    if not draft_ids:
+        return {}
+    placeholders = ','.join('?' * len(draft_ids))
+    rows = get_connection().execute(
+        f"SELECT * FROM pending_drafts WHERE user_email = ? AND status = 'pending' AND id IN ({placeholders})",
+        (user_email, *draft_ids)
+    ).fetchall()
+    return {row['id']: dict(row) for row in rows}
+
+@stage_timer('sqlite.update_drafts_status')
+def update_drafts_status(draft_ids, status, user_email):
+    """
+    Atualiza o status de vários rascunhos pendentes do utilizador numa única transação.
+    Devolve o conjunto de IDs efetivamente atualizados.
+    """
+    if not draft_ids:
+        return set()
+    conn = get_connection()
+    placeholders = ','.join('?' * len(draft_ids))
+    with conn:
+        rows = conn.execute(
+            f"UPDATE pending_drafts SET status = ? WHERE user_email = ? AND status = 'pending' AND id IN ({placeholders}) RETURNING id",
+            (status, user_email, *draft_ids)
+        ).fetchall()
+    updated_ids = {row['id'] for row in rows}
+    if updated_ids:
+        counts = get_draft_counts(user_email)
+        for draft_id in updated_ids:
+            publish_draft_event(user_email, 'status_changed', {'id': draft_id, 'status': status}, counts)
+    return updated_ids
+
+@stage_timer('sqlite.get_draft_counts')
+def get_draft_counts(user_email):
+    """Devolve os contadores do dashboard do utilizador, a partir da tabela mantida por triggers."""
+    counts = {
+        row['status']: row['count']
+        for row in get_connection().execute("SELECT status, count FROM draft_status_counts WHERE user_email = ?", (user_email,))
+    }
     return {
-        'pending': pending,
-        'sent': sent,
-        'rejected': rejected,
-        'total': total,
-        'drafts': drafts
+        'pending': counts.get('pending', 0),
+        'sent': counts.get('approved', 0),
+        'rejected': counts.get('rejected', 0),
+        'total': sum(counts.values())
+    }
+
+def parse_dashboard_cursor(cursor):
+    """Valida um 'next_cursor' ('<created_at>|<id>') e devolve (created_at, id); ValueError se for inválido."""
+    created_at, separator, draft_id = cursor.partition('|')
+    if not separator:
+        raise ValueError("Cursor de paginação inválido.")
+    # Lançam ValueError se o cliente enviar um cursor adulterado.
+    datetime.fromisoformat(created_at)
+    uuid.UUID(draft_id)
+    return created_at, draft_id
+
+@stage_timer('sqlite.get_dashboard_stats')
+def get_dashboard_stats(user_email, limit=DASHBOARD_PAGE_SIZE, cursor=None):
+    """
+    Gathers statistics for the automation dashboard of one user.
+    Os contadores vêm da tabela mantida por triggers e a lista de pendentes é paginada por
+    keyset: 'cursor' é o par (created_at, id) do 'next_cursor' devolvido pela página anterior,
+    já validado com parse_dashboard_cursor.
+    """
+    conn = get_connection()
+    if cursor:
+        cursor_created_at, cursor_id = cursor
+        rows = conn.execute(
+            "SELECT id, recipient, subject, created_at FROM pending_drafts "
+            "WHERE user_email = ? AND status = 'pending' AND (created_at, id) < (?, ?) "
+            "ORDER BY created_at DESC, id DESC LIMIT ?",
+            (user_email, cursor_created_at, cursor_id, limit + 1)
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            "SELECT id, recipient, subject, created_at FROM pending_drafts "
+            "WHERE user_email = ? AND status = 'pending' ORDER BY created_at DESC, id DESC LIMIT ?",
+            (user_email, limit + 1)
+        ).fetchall()
+    drafts = [dict(row) for row in rows[:limit]]
+    next_cursor = f"{drafts[-1]['created_at']}|{drafts[-1]['id']}" if len(rows) > limit else None
+
+    return {
+        **get_draft_counts(user_email),
+        'drafts': drafts,
+        'next_cursor': next_cursor
     }
 
 def save_user_credentials(email, credentials):
     """Saves or updates a user's OAuth credentials in the database."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
+    conn = get_connection()
     credentials_json = json.dumps(credentials)
-    cursor.execute("REPLACE INTO user_credentials (email, credentials_json) VALUES (?, ?)", (email, credentials_json))
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.execute("REPLACE INTO user_credentials (email, credentials_json) VALUES (?, ?)", (email, credentials_json))
 
+@stage_timer('sqlite.get_user_credentials')
 def get_user_credentials(email):
     """Retrieves a user's OAuth credentials from the database."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT credentials_json FROM user_credentials WHERE email = ?", (email,))
-    row = cursor.fetchone()
-    conn.close()
+    row = get_connection().execute("SELECT credentials_json FROM user_credentials WHERE email = ?", (email,)).fetchone()
     return json.loads(row[0]) if row else None
 
-def is_thread_processed(thread_id):
-    """Checks if a thread has already been processed to prevent duplicates."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT 1 FROM processed_threads WHERE thread_id = ?", (thread_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result is not None
-
-def mark_thread_as_processed(thread_id):
-    """Marks a thread as processed."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    cursor.execute("REPLACE INTO processed_threads (thread_id, processed_at) VALUES (?, ?)", (thread_id, datetime.now()))
-    conn.commit()
-    conn.close()
-
-def get_draft_by_id(draft_id):
-    """Busca um rascunho específico pelo seu ID, independentemente do status."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    conn.row_factory = sqlite3.Row 
-    draft = conn.execute('SELECT * FROM pending_drafts WHERE id = ?', (draft_id,)).fetchone()
-    conn.close()
+@stage_timer('sqlite.claim_message')
+def claim_message(user_email, thread_id, message_id):
+    """
+    Reclama atomicamente o processamento de uma mensagem de uma thread.
+    Devolve True apenas para o primeiro chamador; entregas concorrentes recebem False.
+    """
+    conn = get_connection()
+    with conn:
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO processed_threads (user_email, thread_id, message_id, processed_at) VALUES (?, ?, ?, ?)",
+            (user_email, thread_id, message_id, datetime.now())
+        )
+    return cursor.rowcount == 1
+
+def release_message(user_email, thread_id, message_id):
+    """Apaga a reclamação de uma mensagem que não chegou a ser agendada, para que possa ser reclamada de novo."""
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "DELETE FROM processed_threads WHERE user_email = ? AND thread_id = ? AND message_id = ?",
+            (user_email, thread_id, message_id)
+        )
+
+def purge_processed_threads(max_age_days=30):
+    """Remove registos de mensagens processadas mais antigos do que o TTL."""
+    conn = get_connection()
+    with conn:
+        cursor = conn.execute(
+            "DELETE FROM processed_threads WHERE processed_at < ?",
+            (datetime.now() - timedelta(days=max_age_days),)
+        )
+    return cursor.rowcount
+
+def get_last_history_id(email):
+    """Devolve o último historyId sincronizado para a caixa de correio, ou None."""
+    row = get_connection().execute("SELECT history_id FROM mailbox_sync_state WHERE email = ?", (email,)).fetchone()
+    return row[0] if row else None
+
+def save_last_history_id(email, history_id):
+    """Guarda o historyId sincronizado. Nunca recua para um historyId mais antigo."""
+    conn = get_connection()
+    with conn:
+        conn.execute('''
+            INSERT INTO mailbox_sync_state (email, history_id, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT(email) DO UPDATE SET history_id = excluded.history_id, updated_at = excluded.updated_at
+            WHERE CAST(excluded.history_id AS INTEGER) > CAST(mailbox_sync_state.history_id AS INTEGER)
+        ''', (email, str(history_id), datetime.now()))
+
+def record_pubsub_delivery(message_id):
+    """Regista uma entrega Pub/Sub. Devolve False se a mensagem já tinha sido recebida."""
+    conn = get_connection()
+    with conn:
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO pubsub_deliveries (message_id, received_at) VALUES (?, ?)",
+            (message_id, datetime.now())
+        )
+    return cursor.rowcount == 1
+
+def forget_pubsub_delivery(message_id):
+    """Apaga o registo de uma entrega, para que a reentrega do Pub/Sub seja aceite."""
+    conn = get_connection()
+    with conn:
+        conn.execute("DELETE FROM pubsub_deliveries WHERE message_id = ?", (message_id,))
+
+def purge_pubsub_deliveries(max_age_hours=24):
+    """Remove registos de entregas Pub/Sub mais antigos do que a janela de reentrega."""
+    conn = get_connection()
+    with conn:
+        cursor = conn.execute(
+            "DELETE FROM pubsub_deliveries WHERE received_at < ?",
+            (datetime.now() - timedelta(hours=max_age_hours),)
+        )
+    return cursor.rowcount
+
+def get_draft_by_id(draft_id, user_email=None):
+    """Busca um rascunho específico pelo seu ID, independentemente do status (opcionalmente só do dono)."""
+    if user_email is None:
+        draft = get_connection().execute('SELECT * FROM pending_drafts WHERE id = ?', (draft_id,)).fetchone()
+    else:
+        draft = get_connection().execute('SELECT * FROM pending_drafts WHERE id = ? AND user_email = ?', (draft_id, user_email)).fetchone()
     return dict(draft) if draft else None
 
-def update_draft_body(draft_id, new_body):
-    """Atualiza o corpo de um rascunho específico."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    conn.execute('UPDATE pending_drafts SET body = ? WHERE id = ?', (new_body, draft_id))
-    conn.commit()
-    conn.close()
-    return True
+def update_draft_body(draft_id, new_body, user_email):
+    """Atualiza o corpo de um rascunho específico do utilizador."""
+    conn = get_connection()
+    with conn:
+        cursor = conn.execute('UPDATE pending_drafts SET body = ? WHERE id = ? AND user_email = ?', (new_body, draft_id, user_email))
+    return cursor.rowcount > 0
+
+# O modelo de embedding só lê os primeiros ~128 tokens: não vale a pena guardar mais.
+PERSONA_CHOICE_MAX_CHARS = 2000
+
+def _email_hash(email_text):
+    return hashlib.sha256(email_text[:PERSONA_CHOICE_MAX_CHARS].encode('utf-8')).hexdigest()
+
+@stage_timer('sqlite.record_persona_choice')
+def record_persona_choice(user_email, persona_id, email_text, source):
+    """
+    Regista a persona escolhida para um email ('user', 'profile' ou 'llm'). Cada email conta
+    uma vez por utilizador: uma nova escolha para o mesmo email substitui a anterior.
+    """
+    email_text = email_text[:PERSONA_CHOICE_MAX_CHARS]
+    conn = get_connection()
+    with conn:
+        conn.execute('''
+            INSERT INTO persona_choices (user_email, persona_id, email_text, email_hash, source, created_at) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(user_email, email_hash) DO UPDATE SET
+                persona_id = excluded.persona_id, source = excluded.source, created_at = excluded.created_at
+        ''', (user_email, persona_id, email_text, _email_hash(email_text), source, datetime.now()))
+
+@stage_timer('sqlite.get_persona_choices')
+def get_persona_choices(user_email, limit=2000):
+    """Devolve as escolhas de persona mais recentes do utilizador como pares (texto do email, persona_id)."""
+    rows = get_connection().execute(
+        "SELECT email_text, persona_id FROM persona_choices WHERE user_email = ? ORDER BY id DESC LIMIT ?", (user_email, limit)
+    ).fetchall()
+    return [(row['email_text'], row['persona_id']) for row in rows]
+
+@stage_timer('sqlite.queue_notification')
+def queue_notification(user_email, draft_id, details, stale_after_seconds):
+    """
+    Põe a notificação de um rascunho em espera. Devolve True se é preciso agendar um envio:
+    quando não havia outras à espera (já há um envio agendado para elas), ou quando a mais
+    antiga espera há mais de 'stale_after_seconds' (o envio agendado perdeu-se).
+    """
+    conn = get_connection()
+    now = datetime.now()
+    with conn:
+        conn.execute(
+            "INSERT INTO pending_notifications (user_email, draft_id, details_json, created_at) VALUES (?, ?, ?, ?)",
+            (user_email, draft_id, json.dumps(details), now)
+        )
+        waiting, oldest = conn.execute(
+            "SELECT COUNT(*), MIN(created_at) FROM pending_notifications WHERE claim_id IS NULL"
+        ).fetchone()
+    return waiting == 1 or datetime.fromisoformat(oldest) < now - timedelta(seconds=stale_after_seconds)
+
+@stage_timer('sqlite.claim_notifications')
+def claim_notifications(claim_id):
+    """
+    Reclama as notificações em espera para o envio 'claim_id' e devolve todas as que lhe
+    pertencem (incluindo as de uma tentativa anterior do mesmo envio), da mais antiga à mais recente.
+    """
+    conn = get_connection()
+    with conn:
+        conn.execute("UPDATE pending_notifications SET claim_id = ? WHERE claim_id IS NULL", (claim_id,))
+        rows = conn.execute(
+            "SELECT user_email, draft_id, details_json FROM pending_notifications WHERE claim_id = ? ORDER BY id", (claim_id,)
+        ).fetchall()
+    return [{'user_email': row['user_email'], 'draft_id': row['draft_id'], 'details': json.loads(row['details_json'])} for row in rows]
+
+def delete_notifications(claim_id, draft_ids=None):
+    """Apaga as notificações de um envio concluído (ou só as dos rascunhos 'draft_ids', já entregues)."""
+    conn = get_connection()
+    with conn:
+        if draft_ids is None:
+            conn.execute("DELETE FROM pending_notifications WHERE claim_id = ?", (claim_id,))
+        else:
+            conn.executemany(
+                "DELETE FROM pending_notifications WHERE claim_id = ? AND draft_id = ?",
+                [(claim_id, draft_id) for draft_id in draft_ids]
+            )
+
+def release_notifications(claim_id):
+    """Devolve à espera as notificações de um envio que falhou, para seguirem com o próximo."""
+    conn = get_connection()
+    with conn:
+        conn.execute("UPDATE pending_notifications SET claim_id = NULL WHERE claim_id = ?", (claim_id,))
 
 if __name__ == '__main__':
-    init_db()
\ No newline at end of file
+    init_db()
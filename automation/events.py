@@ -0,0 +1,109 @@
+# automation/events.py
+
+import os
+import json
+import time
+import queue
+import logging
+import threading
+import redis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Os rascunhos são escritos tanto pelo Flask como pelos workers Celery, por isso os eventos
+# passam pelo Redis (pub/sub) para chegarem a todos os processos web com clientes ligados.
+# Um valor vazio desativa a publicação (ex: benchmarks sem Redis).
+EVENTS_REDIS_URL = os.environ.get('EVENTS_REDIS_URL', 'redis://localhost:6379/2')
+# Cada utilizador tem o seu canal, para que os dashboards só recebam os próprios rascunhos.
+DRAFT_EVENTS_CHANNEL_PREFIX = 'draft-events:'
+# Intervalo (s) entre heartbeats SSE, para manter a ligação viva através de proxies.
+SSE_HEARTBEAT_SECONDS = 15
+# A publicação corre numa thread própria, fora das escritas de rascunhos. Com o Redis
+# inacessível, os eventos são descartados durante EVENTS_RETRY_SECONDS antes de nova ligação.
+EVENTS_CONNECT_TIMEOUT = float(os.environ.get('EVENTS_CONNECT_TIMEOUT', 0.25))
+EVENTS_RETRY_SECONDS = float(os.environ.get('EVENTS_RETRY_SECONDS', 30))
+EVENTS_QUEUE_SIZE = 1000
+
+_redis_client = None
+_publish_queue = None
+_publish_queue_lock = threading.Lock()
+
+
+def _get_redis():
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(EVENTS_REDIS_URL, socket_timeout=1, socket_connect_timeout=EVENTS_CONNECT_TIMEOUT)
+    return _redis_client
+
+
+def _get_publish_queue():
+    global _publish_queue
+    if _publish_queue is None or _publish_queue[1] != os.getpid():
+        with _publish_queue_lock:
+            if _publish_queue is None or _publish_queue[1] != os.getpid():
+                # Uma thread de publicação por processo (recriada após um fork do worker prefork).
+                events = queue.Queue(maxsize=EVENTS_QUEUE_SIZE)
+                threading.Thread(target=_publish_loop, args=(events,), name='draft-events', daemon=True).start()
+                _publish_queue = (events, os.getpid())
+    return _publish_queue[0]
+
+
+def _publish_loop(events):
+    redis_down_until = 0.0
+    while True:
+        channel, message, event_type = events.get()
+        if time.monotonic() < redis_down_until:
+            continue
+        try:
+            _get_redis().publish(channel, message)
+        except Exception as e:
+            redis_down_until = time.monotonic() + EVENTS_RETRY_SECONDS
+            logging.warning(f"Não foi possível publicar o evento '{event_type}'; eventos suspensos durante {EVENTS_RETRY_SECONDS:.0f}s: {e}")
+
+
+def publish_draft_event(user_email, event_type, draft, counts):
+    """
+    Publica um evento de rascunho ('draft_created' ou 'status_changed') com os contadores
+    atuais do dashboard. Os eventos são best-effort: ficam numa fila em memória e seguem
+    para o Redis numa thread própria, por isso nunca atrasam a escrita que os originou.
+    """
+    if not EVENTS_REDIS_URL:
+        return
+    event = {'type': event_type, 'draft': draft, 'counts': counts}
+    try:
+        _get_publish_queue().put_nowait((DRAFT_EVENTS_CHANNEL_PREFIX + user_email, json.dumps(event, default=str), event_type))
+    except queue.Full:
+        logging.warning(f"Fila de eventos cheia; evento '{event_type}' descartado.")
+
+
+def stream_draft_events(user_email):
+    """
+    Subscreve o canal do utilizador e devolve um gerador de mensagens Server-Sent Events, ou
+    None com os eventos desativados. A subscrição é feita já, para que um Redis inacessível
+    lance redis.RedisError antes de a resposta começar (e o cliente passe a consultar por polling).
+    """
+    if not EVENTS_REDIS_URL:
+        return None
+    pubsub = redis.Redis.from_url(EVENTS_REDIS_URL, socket_connect_timeout=2).pubsub(ignore_subscribe_messages=True)
+    try:
+        pubsub.subscribe(DRAFT_EVENTS_CHANNEL_PREFIX + user_email)
+    except Exception:
+        pubsub.close()
+        raise
+    return _sse_messages(pubsub)
+
+
+def _sse_messages(pubsub):
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            message = pubsub.get_message(timeout=SSE_HEARTBEAT_SECONDS)
+            if message is None:
+                yield ": heartbeat\n\n"
+                continue
+            data = message['data'].decode('utf-8') if isinstance(message['data'], bytes) else message['data']
+            event_type = json.loads(data).get('type', 'message')
+            yield f"event: {event_type}\ndata: {data}\n\n"
+    finally:
+        pubsub.close()
@@ -0,0 +1,187 @@
+# automation/gmail_client.py
+
+import os
+import json
+import logging
+import threading
+import datetime
+import httplib2
+import requests
+import google.oauth2.credentials
+import google.auth.transport.requests
+import google_auth_httplib2
+import googleapiclient.discovery
+import googleapiclient.discovery_cache
+import googleapiclient.errors
+from dotenv import load_dotenv
+
+from core.metrics import stage_timer
+from automation.database import get_user_credentials, save_user_credentials
+
+load_dotenv()
+
+# Permite apontar o cliente Gmail para um servidor gravado/falso (ex: http://127.0.0.1:8089/)
+GMAIL_API_ROOT = os.environ.get('GMAIL_API_ROOT')
+GMAIL_HTTP_TIMEOUT = int(os.environ.get('GMAIL_HTTP_TIMEOUT', 60))
+
+# O documento de descoberta é estático e partilhado por todos os clientes do processo.
+_discovery_document = None
+_discovery_lock = threading.Lock()
+
+# httplib2.Http não é thread-safe, por isso cada thread mantém os seus próprios clientes
+# (e ligações keep-alive). A geração permite invalidar clientes em todas as threads.
+_thread_local = threading.local()
+_client_generations = {}
+_generations_lock = threading.Lock()
+
+# Sessão partilhada para os pedidos de refresh de tokens OAuth.
+_refresh_session = requests.Session()
+
+
+class _TimedHttp(httplib2.Http):
+    """httplib2.Http que mede cada pedido à API do Gmail (incluindo pedidos batch)."""
+
+    def request(self, *args, **kwargs):
+        with stage_timer('gmail'):
+            return super().request(*args, **kwargs)
+
+
+def credentials_to_dict(creds):
+    """Serializa as credenciais OAuth no formato guardado na sessão e na base de dados."""
+    return {
+        'token': creds.token, 'refresh_token': creds.refresh_token,
+        'token_uri': creds.token_uri, 'client_id': creds.client_id,
+        'client_secret': creds.client_secret, 'scopes': creds.scopes,
+        'expiry': creds.expiry.isoformat() if creds.expiry else None
+    }
+
+
+def credentials_from_dict(credentials_info):
+    """Reconstrói as credenciais OAuth a partir do dicionário guardado."""
+    info = dict(credentials_info)
+    expiry = info.pop('expiry', None)
+    creds = google.oauth2.credentials.Credentials(**info)
+    if expiry:
+        # A google-auth trabalha com datetimes UTC "naive".
+        creds.expiry = datetime.datetime.fromisoformat(expiry).replace(tzinfo=None)
+    return creds
+
+
+def _get_discovery_document():
+    global _discovery_document
+    if _discovery_document is None:
+        with _discovery_lock:
+            if _discovery_document is None:
+                document = json.loads(googleapiclient.discovery_cache.get_static_doc('gmail', 'v1'))
+                if GMAIL_API_ROOT:
+                    # O batchPath é resolvido a partir do rootUrl do documento de descoberta,
+                    # por isso reescrevemos o documento em vez de usar apenas client_options.
+                    document['rootUrl'] = GMAIL_API_ROOT
+                _discovery_document = document
+    return _discovery_document
+
+
+def _current_generation(user_email):
+    with _generations_lock:
+        return _client_generations.get(user_email, 0)
+
+
+def invalidate_gmail_client(user_email):
+    """Descarta os clientes em cache de um utilizador (ex: após nova autorização OAuth)."""
+    with _generations_lock:
+        _client_generations[user_email] = _client_generations.get(user_email, 0) + 1
+
+
+def _persist_if_refreshed(user_email, entry):
+    """Escreve de volta na base de dados um token que tenha sido renovado."""
+    creds = entry['credentials']
+    if creds.token and creds.token != entry['saved_token']:
+        save_user_credentials(user_email, credentials_to_dict(creds))
+        entry['saved_token'] = creds.token
+        logging.info(f"Token OAuth renovado e guardado para {user_email}.")
+
+
+def get_gmail_client(user_email):
+    """
+    Devolve um cliente Gmail em cache para o utilizador, renovando o token quando expirado.
+    O cliente reutiliza o documento de descoberta estático e a ligação HTTP da thread atual.
+    Devolve None se não existirem credenciais guardadas para o utilizador.
+    """
+    if not user_email:
+        return None
+
+    clients = getattr(_thread_local, 'clients', None)
+    if clients is None:
+        clients = _thread_local.clients = {}
+
+    generation = _current_generation(user_email)
+    entry = clients.get(user_email)
+    if entry is None or entry['generation'] != generation:
+        credentials_info = get_user_credentials(user_email)
+        if not credentials_info:
+            clients.pop(user_email, None)
+            return None
+        creds = credentials_from_dict(credentials_info)
+        authorized_http = google_auth_httplib2.AuthorizedHttp(creds, http=_TimedHttp(timeout=GMAIL_HTTP_TIMEOUT))
+        service = googleapiclient.discovery.build_from_document(_get_discovery_document(), http=authorized_http)
+        entry = {'credentials': creds, 'service': service, 'saved_token': creds.token, 'generation': generation}
+        clients[user_email] = entry
+
+    creds = entry['credentials']
+    if creds.expired and creds.refresh_token:
+        # Outro processo (web ou worker) pode já ter renovado e guardado o token.
+        stored_info = get_user_credentials(user_email)
+        if stored_info and stored_info.get('token') != creds.token:
+            stored_creds = credentials_from_dict(stored_info)
+            if stored_creds.valid:
+                creds.token, creds.expiry = stored_creds.token, stored_creds.expiry
+                entry['saved_token'] = creds.token
+    if creds.expired and creds.refresh_token:
+        creds.refresh(google.auth.transport.requests.Request(session=_refresh_session))
+    # O AuthorizedHttp também renova o token sozinho ao receber um 401; nesse caso a
+    # escrita na base de dados acontece no próximo acesso ao cliente.
+    _persist_if_refreshed(user_email, entry)
+    return entry['service']
+
+
+def list_new_inbox_messages(service, start_history_id):
+    """
+    Usa users.history.list para obter as mensagens novas na INBOX desde start_history_id.
+    Devolve ({thread_id: message_id mais recente}, latest_history_id) pela ordem de chegada,
+    ou (None, None) se o historyId já expirou e é necessária uma sincronização completa.
+    """
+    new_messages = {}
+    latest_history_id = None
+    page_token = None
+    try:
+        while True:
+            list_options = {
+                'userId': 'me', 'startHistoryId': start_history_id,
+                'historyTypes': ['messageAdded'], 'labelId': 'INBOX'
+            }
+            if page_token:
+                list_options['pageToken'] = page_token
+            response = service.users().history().list(**list_options).execute()
+            latest_history_id = response.get('historyId', latest_history_id)
+
+            for record in response.get('history', []):
+                for added in record.get('messagesAdded', []):
+                    message = added.get('message', {})
+                    labels = message.get('labelIds', [])
+                    # Ignora rascunhos e mensagens enviadas por nós (prevenção de loop).
+                    if 'DRAFT' in labels or 'SENT' in labels:
+                        continue
+                    if message.get('threadId') and message.get('id'):
+                        # Numa rajada, só a mensagem mais recente de cada thread precisa de resposta.
+                        new_messages[message['threadId']] = message['id']
+
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+    except googleapiclient.errors.HttpError as e:
+        if e.resp.status == 404:
+            logging.warning(f"historyId {start_history_id} expirado. É necessária uma sincronização completa.")
+            return None, None
+        raise
+
+    return new_messages, latest_history_id
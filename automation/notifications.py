@@ -1,64 +1,373 @@
 # automation/notifications.py
 
 import os
-import requests
+import abc
 import json
+import smtplib
+import requests
 import logging
+import threading
+from datetime import datetime
+from email.message import EmailMessage
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+from core.metrics import stage_timer
 
 load_dotenv()
 
+# Backend das notificações de aprovação: 'pushover', 'webhook', 'email' (resumo por SMTP),
+# 'file' (JSONL local) ou 'memory' (lista em memória, para testes de carga sem rede).
+NOTIFIER_BACKEND = os.environ.get('NOTIFIER_BACKEND', 'pushover').lower()
+
 PUSHOVER_USER_KEY = os.environ.get("PUSHOVER_USER_KEY")
 PUSHOVER_API_TOKEN = os.environ.get("PUSHOVER_API_TOKEN")
 FLASK_BASE_URL = os.environ.get("FLASK_BASE_URL")
+PUSHOVER_API_URL = "https://api.pushover.net/1/messages.json"
+
+NOTIFY_WEBHOOK_URL = os.environ.get('NOTIFY_WEBHOOK_URL')
+# Opcional: enviado como 'Authorization: Bearer <token>'.
+NOTIFY_WEBHOOK_TOKEN = os.environ.get('NOTIFY_WEBHOOK_TOKEN')
+
+SMTP_HOST = os.environ.get('SMTP_HOST')
+SMTP_PORT = int(os.environ.get('SMTP_PORT', 587))
+SMTP_USERNAME = os.environ.get('SMTP_USERNAME')
+SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD')
+SMTP_STARTTLS = os.environ.get('SMTP_STARTTLS', '1') != '0'
+NOTIFY_EMAIL_FROM = os.environ.get('NOTIFY_EMAIL_FROM') or SMTP_USERNAME
+# Sem destinatário fixo, cada resumo vai para o dono da caixa de correio dos rascunhos.
+NOTIFY_EMAIL_TO = os.environ.get('NOTIFY_EMAIL_TO')
+
+NOTIFY_FILE = os.environ.get('NOTIFY_FILE', 'notifications.jsonl')
+
+# Tempo máximo (segundos) de ligação e de resposta do fornecedor de notificações.
+NOTIFY_CONNECT_TIMEOUT = float(os.environ.get('NOTIFY_CONNECT_TIMEOUT', 5))
+NOTIFY_READ_TIMEOUT = float(os.environ.get('NOTIFY_READ_TIMEOUT', 10))
+# Nº máximo de rascunhos listados numa notificação agregada (os restantes só são contados).
+NOTIFY_DIGEST_MAX_ITEMS = int(os.environ.get('NOTIFY_DIGEST_MAX_ITEMS', 10))
+# O Pushover rejeita mensagens com mais de 1024 caracteres.
+PUSHOVER_MAX_MESSAGE_CHARS = 1024
 
-def send_approval_notification(draft_id, draft_details):
-    """Envia uma notificação PUSH com links HTML para as ações."""
-    if not all([PUSHOVER_USER_KEY, PUSHOVER_API_TOKEN, FLASK_BASE_URL]):
-        logging.warning("Pushover ou FLASK_BASE_URL não configurados. A saltar notificação.")
-        return
 
+class TransientNotificationError(Exception):
+    """
+    Falha temporária do fornecedor (rede, timeout, 429 ou 5xx): a entrega deve ser repetida.
+    'delivered' lista as notificações do lote que já foram entregues e não devem ser repetidas.
+    """
+
+    def __init__(self, message, delivered=()):
+        super().__init__(message)
+        self.delivered = list(delivered)
+
+
+# Uma sessão HTTP por processo (recriada após um fork do worker prefork), para reutilizar
+# as ligações TLS ao fornecedor em vez de abrir uma por notificação.
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    global _session
+    if _session is None or _session[1] != os.getpid():
+        with _session_lock:
+            if _session is None or _session[1] != os.getpid():
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=10)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = (session, os.getpid())
+    return _session[0]
+
+def _post(url, stage, **kwargs):
+    """POST com a sessão partilhada; erros de rede, 429 e 5xx tornam-se TransientNotificationError."""
     try:
-        subject = draft_details.get('subject', 'N/A')
-        original_summary = draft_details.get('original_summary', 'Contexto indisponível.')
-        full_draft_body = draft_details.get('full_draft_body', 'Rascunho indisponível.')
-        
-        title = "Novo Rascunho para Aprovação"
-        dashboard_url = f"{FLASK_BASE_URL}"
-        approve_url = f"{FLASK_BASE_URL}/approve/{draft_id}"
-        reject_url = f"{FLASK_BASE_URL}/reject/{draft_id}"
-
-        # --- NOVA LÓGICA COM HTML ---
-        # Construímos a mensagem com tags <a> para criar os links clicáveis.
-        # A tag <b> torna os links mais visíveis.
-        formatted_message = (
-            f"<b>Assunto:</b> {subject}\n\n"
-            f"<b>Resumo do Email Recebido:</b>\n"
-            f'<i>"{original_summary}"</i>\n\n'
-            f"<b>--- Rascunho Proposto ---</b>\n"
-            f"{full_draft_body}\n\n"
-            f"-------------------------------------\n"
-            f'<b>Ações Rápidas:</b> <a href="{approve_url}">Aprovar</a> | <a href="{reject_url}">Rejeitar</a>'
-        )
+        with stage_timer(stage):
+            response = get_session().post(url, timeout=(NOTIFY_CONNECT_TIMEOUT, NOTIFY_READ_TIMEOUT), **kwargs)
+    except requests.RequestException as e:
+        raise TransientNotificationError(f"{url} inacessível: {e}") from e
+    if response.status_code == 429 or response.status_code >= 500:
+        raise TransientNotificationError(f"{url} respondeu {response.status_code}.")
+    return response
+
+
+# --- CONTEÚDO DAS NOTIFICAÇÕES ---
+
+def _truncate(text, limit):
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + '…'
+
+def draft_links(draft_id):
+    """URLs de aprovação e de rejeição de um rascunho."""
+    return f"{FLASK_BASE_URL}/approve/{draft_id}", f"{FLASK_BASE_URL}/reject/{draft_id}"
+
+def build_approval_message(draft_id, draft_details):
+    """Título e mensagem HTML da notificação de um único rascunho."""
+    subject = draft_details.get('subject', 'N/A')
+    original_summary = draft_details.get('original_summary', 'Contexto indisponível.')
+    full_draft_body = draft_details.get('full_draft_body', 'Rascunho indisponível.')
+    approve_url, reject_url = draft_links(draft_id)
+
+    # Construímos a mensagem com tags <a> para criar os links clicáveis.
+    # A tag <b> torna os links mais visíveis.
+    header = (
+        f"<b>Assunto:</b> {subject}\n\n"
+        f"<b>Resumo do Email Recebido:</b>\n"
+        f'<i>"{original_summary}"</i>\n\n'
+        f"<b>--- Rascunho Proposto ---</b>\n"
+    )
+    footer = (
+        f"\n\n-------------------------------------\n"
+        f'<b>Ações Rápidas:</b> <a href="{approve_url}">Aprovar</a> | <a href="{reject_url}">Rejeitar</a>'
+    )
+    # O corpo do rascunho é cortado para que os links de ação cheguem sempre ao telemóvel.
+    body = _truncate(full_draft_body, max(PUSHOVER_MAX_MESSAGE_CHARS - len(header) - len(footer), 80))
+    return "Novo Rascunho para Aprovação", header + body + footer
+
+def build_digest_message(notifications):
+    """Título e mensagem HTML de uma notificação que agrega vários rascunhos [{'draft_id', 'details'}]."""
+    lines = []
+    # Só entram linhas completas, para não cortar as tags <a> a meio; sobra espaço para o rodapé.
+    budget = PUSHOVER_MAX_MESSAGE_CHARS - 40
+    for notification in notifications[:NOTIFY_DIGEST_MAX_ITEMS]:
+        subject = _truncate(notification['details'].get('subject', 'N/A'), 60)
+        approve_url, reject_url = draft_links(notification['draft_id'])
+        line = f'• {subject} — <a href="{approve_url}">Aprovar</a> | <a href="{reject_url}">Rejeitar</a>'
+        if len(line) + 1 > budget:
+            break
+        budget -= len(line) + 1
+        lines.append(line)
+    if len(notifications) > len(lines):
+        lines.append(f"… e mais {len(notifications) - len(lines)} no dashboard.")
+    return f"{len(notifications)} Novos Rascunhos para Aprovação", "\n".join(lines)
+
+def notification_record(notification):
+    """Representação JSON de uma notificação, usada pelo webhook e pelos sinks locais."""
+    details = notification['details']
+    approve_url, reject_url = draft_links(notification['draft_id'])
+    return {
+        'draft_id': notification['draft_id'],
+        'user_email': notification.get('user_email', ''),
+        'subject': details.get('subject'),
+        'original_summary': details.get('original_summary'),
+        'draft_body': details.get('full_draft_body'),
+        'approve_url': approve_url,
+        'reject_url': reject_url,
+    }
+
+
+# --- BACKENDS ---
+
+class Notifier(abc.ABC):
+    """
+    Interface dos backends de notificação. send_batch recebe as notificações em espera
+    [{'user_email', 'draft_id', 'details'}] e envia-as da forma mais agregada que o backend
+    permitir. Devolve True se foram aceites, False se foram rejeitadas de forma definitiva,
+    e lança TransientNotificationError quando vale a pena tentar de novo.
+    """
+
+    name = None
+
+    def missing_settings(self):
+        """Variáveis de ambiente em falta para este backend."""
+        return []
+
+    @abc.abstractmethod
+    def send_batch(self, notifications):
+        """Envia o lote; ver a docstring da classe."""
+
+
+class PushoverNotifier(Notifier):
+    """Notificação push: completa para um rascunho, um resumo com links para uma rajada."""
+
+    name = 'pushover'
 
+    def missing_settings(self):
+        return [name for name, value in (('PUSHOVER_USER_KEY', PUSHOVER_USER_KEY), ('PUSHOVER_API_TOKEN', PUSHOVER_API_TOKEN), ('FLASK_BASE_URL', FLASK_BASE_URL)) if not value]
+
+    def send_batch(self, notifications):
+        if len(notifications) == 1:
+            title, message = build_approval_message(notifications[0]['draft_id'], notifications[0]['details'])
+        else:
+            title, message = build_digest_message(notifications)
         payload = {
             "token": PUSHOVER_API_TOKEN,
             "user": PUSHOVER_USER_KEY,
-            "url": dashboard_url,
+            "url": FLASK_BASE_URL,
             "url_title": "✍️ Rever e Editar no Dashboard",
             "title": title,
-            "message": formatted_message,
+            "message": message,
             "html": 1  # Informamos a API do Pushover que a mensagem contém HTML
         }
+        response = _post(PUSHOVER_API_URL, 'pushover', data=payload)
+        try:
+            response_data = response.json()
+        except ValueError:
+            response_data = {}
+        if response.ok and response_data.get("status") == 1:
+            return True
+        # Erros 4xx (token ou utilizador inválidos, mensagem rejeitada) não se resolvem repetindo.
+        logging.error(f"Pushover rejeitou a notificação '{title}' ({response.status_code}). Erros: {response_data.get('errors')}")
+        return False
+
+
+class WebhookNotifier(Notifier):
+    """POST JSON genérico com todo o lote: {'event': 'drafts_pending', 'drafts': [...]}."""
+
+    name = 'webhook'
+
+    def missing_settings(self):
+        return [] if NOTIFY_WEBHOOK_URL else ['NOTIFY_WEBHOOK_URL']
+
+    def send_batch(self, notifications):
+        headers = {'Authorization': f"Bearer {NOTIFY_WEBHOOK_TOKEN}"} if NOTIFY_WEBHOOK_TOKEN else {}
+        body = {'event': 'drafts_pending', 'drafts': [notification_record(notification) for notification in notifications]}
+        response = _post(NOTIFY_WEBHOOK_URL, 'webhook', json=body, headers=headers)
+        if response.ok:
+            return True
+        logging.error(f"O webhook rejeitou {len(notifications)} notificações ({response.status_code}): {response.text[:200]}")
+        return False
+
+
+class EmailDigestNotifier(Notifier):
+    """Um email de resumo por destinatário, enviados todos na mesma ligação SMTP."""
+
+    name = 'email'
+
+    def missing_settings(self):
+        return [name for name, value in (('SMTP_HOST', SMTP_HOST), ('NOTIFY_EMAIL_FROM', NOTIFY_EMAIL_FROM), ('FLASK_BASE_URL', FLASK_BASE_URL)) if not value]
+
+    @staticmethod
+    def build_email(recipient, notifications):
+        message = EmailMessage()
+        message['From'] = NOTIFY_EMAIL_FROM
+        message['To'] = recipient
+        message['Subject'] = (
+            f"Novo rascunho para aprovação: {notifications[0]['details'].get('subject', 'N/A')}" if len(notifications) == 1
+            else f"{len(notifications)} novos rascunhos para aprovação"
+        )
+        sections = []
+        for notification in notifications:
+            record = notification_record(notification)
+            sections.append(
+                f"Assunto: {record['subject']}\n"
+                f"Resumo do email recebido: {record['original_summary']}\n\n"
+                f"{record['draft_body']}\n\n"
+                f"Aprovar: {record['approve_url']}\n"
+                f"Rejeitar: {record['reject_url']}"
+            )
+        sections.append(f"Rever e editar no dashboard: {FLASK_BASE_URL}")
+        message.set_content(f"\n\n{'-' * 40}\n\n".join(sections))
+        return message
+
+    def send_batch(self, notifications):
+        by_recipient = {}
+        for notification in notifications:
+            recipient = NOTIFY_EMAIL_TO or notification.get('user_email')
+            if recipient:
+                by_recipient.setdefault(recipient, []).append(notification)
+            else:
+                logging.error(f"Sem destinatário para a notificação do rascunho {notification['draft_id']}.")
+        if not by_recipient:
+            return False
+        # Os resumos já entregues seguem na exceção, para que uma nova tentativa só envie os restantes.
+        delivered = []
+        try:
+            with stage_timer('smtp'), smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=NOTIFY_CONNECT_TIMEOUT + NOTIFY_READ_TIMEOUT) as smtp:
+                if SMTP_STARTTLS:
+                    smtp.starttls()
+                if SMTP_USERNAME:
+                    smtp.login(SMTP_USERNAME, SMTP_PASSWORD or '')
+                for recipient, recipient_notifications in by_recipient.items():
+                    try:
+                        smtp.send_message(self.build_email(recipient, recipient_notifications))
+                    except smtplib.SMTPRecipientsRefused as e:
+                        # Um destinatário recusado não impede os resumos dos outros.
+                        logging.error(f"O servidor SMTP recusou o destinatário {recipient}: {e.recipients}")
+                        continue
+                    delivered.extend(recipient_notifications)
+        except smtplib.SMTPResponseException as e:
+            # Códigos 4xx do SMTP são temporários (ex: caixa cheia, limite de envio).
+            if 400 <= e.smtp_code < 500:
+                raise TransientNotificationError(f"SMTP respondeu {e.smtp_code}: {e.smtp_error}", delivered) from e
+            logging.error(f"O servidor SMTP rejeitou o resumo ({e.smtp_code}): {e.smtp_error}")
+            return bool(delivered)
+        except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError) as e:
+            raise TransientNotificationError(f"SMTP inacessível: {e}", delivered) from e
+        except smtplib.SMTPException as e:
+            logging.error(f"Falha ao enviar o resumo por email: {e}")
+            return bool(delivered)
+        return bool(delivered)
+
+
+class FileNotifier(Notifier):
+    """Sink local: acrescenta uma linha JSON por rascunho a NOTIFY_FILE, com o lote a que pertenceu."""
+
+    name = 'file'
+
+    def __init__(self, path=None):
+        self.path = path or NOTIFY_FILE
+        self._lock = threading.Lock()
+
+    def send_batch(self, notifications):
+        sent_at = datetime.now().isoformat()
+        lines = ''.join(
+            json.dumps({**notification_record(notification), 'batch_size': len(notifications), 'sent_at': sent_at}, ensure_ascii=False) + '\n'
+            for notification in notifications
+        )
+        try:
+            with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+        except OSError as e:
+            raise TransientNotificationError(f"Não foi possível escrever em {self.path}: {e}") from e
+        return True
+
+
+class MemoryNotifier(Notifier):
+    """Sink em memória: guarda os lotes enviados em 'batches' (testes e benchmarks sem rede)."""
+
+    name = 'memory'
+
+    def __init__(self):
+        self.batches = []
+        self._lock = threading.Lock()
+
+    @property
+    def notifications(self):
+        with self._lock:
+            return [notification for batch in self.batches for notification in batch]
+
+    def send_batch(self, notifications):
+        with self._lock:
+            self.batches.append([notification_record(notification) for notification in notifications])
+        return True
+
+
+NOTIFIERS = {notifier.name: notifier for notifier in (PushoverNotifier, WebhookNotifier, EmailDigestNotifier, FileNotifier, MemoryNotifier)}
+
+_notifier = None
+_notifier_lock = threading.Lock()
+
+def get_notifier():
+    """Devolve o backend configurado em NOTIFIER_BACKEND, partilhado pelo processo."""
+    global _notifier
+    if _notifier is None:
+        with _notifier_lock:
+            if _notifier is None:
+                if NOTIFIER_BACKEND not in NOTIFIERS:
+                    raise ValueError(f"NOTIFIER_BACKEND desconhecido: '{NOTIFIER_BACKEND}'. Opções: {', '.join(NOTIFIERS)}.")
+                _notifier = NOTIFIERS[NOTIFIER_BACKEND]()
+    return _notifier
 
-        response = requests.post("https://api.pushover.net/1/messages.json", data=payload)
-        response.raise_for_status()
-        
-        response_data = response.json()
-        if response_data.get("status") == 1:
-            logging.info(f"Notificação de revisão enviada com sucesso para o rascunho {draft_id}")
-        else:
-            logging.error(f"Falha ao enviar notificação para {draft_id}. Erros: {response_data.get('errors')}")
 
-    except Exception as e:
-        logging.error(f"Ocorreu um erro na função de notificação: {e}", exc_info=True)
\ No newline at end of file
+def send_draft_notifications(notifications):
+    """
+    Notifica um lote de rascunhos [{'user_email', 'draft_id', 'details'}] pelo backend
+    configurado: um rascunho sozinho segue com todo o detalhe, uma rajada num só envio.
+    """
+    if not notifications:
+        return True
+    notifier = get_notifier()
+    if missing := notifier.missing_settings():
+        logging.warning(f"Notificações '{notifier.name}' não configuradas (falta {', '.join(missing)}). A saltar notificação.")
+        return False
+    if sent := notifier.send_batch(notifications):
+        logging.info(f"Notificação '{notifier.name}' enviada para {len(notifications)} rascunho(s): {', '.join(str(n['draft_id']) for n in notifications)}")
+    return sent
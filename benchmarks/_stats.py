@@ -0,0 +1,8 @@
+# benchmarks/_stats.py
+
+
+def percentile(values, pct):
+    """Percentil 'pct' (0-100) de uma lista de medições, pelo valor mais próximo."""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
@@ -0,0 +1,95 @@
+"""
+Benchmark da topologia de filas do worker Celery com um broker em memória.
+
+Usa a aplicação Celery real (rotas, acks_late, prefetch) com tarefas sintéticas que
+simulam as etapas: 'ingest' (sincronização rápida) e 'llm' (geração lenta). Primeiro
+enche a fila LLM com um backlog e depois envia tarefas de ingestão, medindo quanto tempo
+cada ingestão espera até começar e o débito total.
+
+Modos:
+    split   um worker por etapa (-Q ingest e -Q llm), como recomendado no README
+    single  um único worker a consumir ambas as filas (comportamento antigo)
+
+Uso (a partir da raiz do repositório):
+    python -m benchmarks.bench_celery --mode split --llm-tasks 40 --ingest-tasks 40
+    python -m benchmarks.bench_celery --mode single --llm-tasks 40 --ingest-tasks 40
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+import threading
+from contextlib import ExitStack
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks._stats import percentile
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=['split', 'single'], default='split')
+    parser.add_argument('--llm-tasks', type=int, default=40)
+    parser.add_argument('--ingest-tasks', type=int, default=40)
+    parser.add_argument('--llm-delay', type=float, default=0.5, help="Duração (s) simulada de uma geração LLM.")
+    parser.add_argument('--ingest-delay', type=float, default=0.01, help="Duração (s) simulada de uma sincronização.")
+    parser.add_argument('--concurrency', type=int, default=4, help="Threads do worker LLM (ou do worker único).")
+    args = parser.parse_args()
+
+    os.environ['AUTOMATION_DB_FILE'] = os.path.join(tempfile.mkdtemp(prefix='bench_celery_'), 'automation.db')
+    os.environ['CELERY_BROKER_URL'] = 'memory://'
+    os.environ['CELERY_RESULT_BACKEND'] = 'cache+memory://'
+    os.environ.setdefault('EVENTS_REDIS_URL', '')
+
+    from celery.contrib.testing.worker import start_worker
+    from automation.celery_worker import celery, QUEUE_INGEST, QUEUE_LLM
+
+    ingest_waits = []
+    finished = threading.Semaphore(0)
+
+    @celery.task(name='bench.llm')
+    def bench_llm():
+        time.sleep(args.llm_delay)
+        finished.release()
+
+    @celery.task(name='bench.ingest')
+    def bench_ingest(enqueued_at):
+        ingest_waits.append((time.time() - enqueued_at) * 1000)
+        time.sleep(args.ingest_delay)
+        finished.release()
+
+    if args.mode == 'split':
+        workers = [
+            {'queues': [QUEUE_INGEST], 'concurrency': 1},
+            {'queues': [QUEUE_LLM], 'concurrency': args.concurrency},
+        ]
+    else:
+        workers = [{'queues': [QUEUE_INGEST, QUEUE_LLM], 'concurrency': args.concurrency}]
+
+    with ExitStack() as stack:
+        for worker in workers:
+            stack.enter_context(start_worker(
+                celery, pool='threads', concurrency=worker['concurrency'], queues=worker['queues'],
+                perform_ping_check=False, loglevel='WARNING', shutdown_timeout=30
+            ))
+
+        started = time.perf_counter()
+        for _ in range(args.llm_tasks):
+            bench_llm.apply_async(queue=QUEUE_LLM)
+        for _ in range(args.ingest_tasks):
+            bench_ingest.apply_async(args=[time.time()], queue=QUEUE_INGEST)
+        for _ in range(args.llm_tasks + args.ingest_tasks):
+            finished.acquire()
+        elapsed = time.perf_counter() - started
+
+    total = args.llm_tasks + args.ingest_tasks
+    print(f"Modo: {args.mode}  |  {args.llm_tasks} gerações de {args.llm_delay:.2f}s, {args.ingest_tasks} ingestões, concorrência {args.concurrency}")
+    print(f"Espera das ingestões (ms): p50={statistics.median(ingest_waits):.1f}  "
+          f"p95={percentile(ingest_waits, 95):.1f}  max={max(ingest_waits):.1f}")
+    print(f"Débito: {total / elapsed:.1f} tarefas/s ({elapsed:.2f}s no total)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Benchmark das estatísticas do dashboard com bases de dados semeadas.
+
+Para cada tamanho, semeia a tabela pending_drafts com rascunhos distribuídos pelos
+estados (maioritariamente já enviados/rejeitados, como num histórico real) e mede a
+latência de get_dashboard_stats() (contadores mantidos + página keyset) face ao conjunto
+de queries antigo (quatro COUNT(*) e a lista completa de pendentes).
+
+Uso (a partir da raiz do repositório):
+    python -m benchmarks.bench_dashboard --sizes 10000,100000,1000000
+"""
+import os
+import sys
+import time
+import uuid
+import random
+import argparse
+import importlib
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('EVENTS_REDIS_URL', '')
+
+BENCH_USER = 'bench-owner@example.com'
+
+LEGACY_QUERIES = [
+    "SELECT COUNT(*) as count FROM pending_drafts WHERE status = 'pending'",
+    "SELECT COUNT(*) as count FROM pending_drafts WHERE status = 'approved'",
+    "SELECT COUNT(*) as count FROM pending_drafts WHERE status = 'rejected'",
+    "SELECT COUNT(*) as count FROM pending_drafts",
+    "SELECT id, recipient, subject, created_at FROM pending_drafts WHERE status = 'pending' ORDER BY created_at DESC",
+]
+
+
+def seed(conn, count, pending_ratio):
+    start = datetime(2024, 1, 1)
+    rows = []
+    for i in range(count):
+        roll = random.random()
+        status = 'pending' if roll < pending_ratio else ('approved' if roll < 0.8 else 'rejected')
+        rows.append((str(uuid.uuid4()), BENCH_USER, f"t{i}", "bench@example.com", f"Re: assunto {i}", "corpo do rascunho",
+                     status, start + timedelta(seconds=i * 30), None))
+        if len(rows) == 50000:
+            with conn:
+                conn.executemany("INSERT INTO pending_drafts (id, user_email, thread_id, recipient, subject, body, status, created_at, original_message_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            rows = []
+    if rows:
+        with conn:
+            conn.executemany("INSERT INTO pending_drafts (id, user_email, thread_id, recipient, subject, body, status, created_at, original_message_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+
+def time_call(fn, repeats):
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--pending-ratio', type=float, default=0.01)
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_dashboard_')
+    print(f"{'rascunhos':>10} {'stats novas (ms)':>18} {'página 2 (ms)':>15} {'queries antigas (ms)':>22}")
+    for size in [int(value) for value in args.sizes.split(',')]:
+        os.environ['AUTOMATION_DB_FILE'] = os.path.join(workdir, f"dashboard_{size}.db")
+        # O módulo lê o caminho da base de dados ao ser importado: recarregá-lo aponta-o para
+        # a base de dados deste tamanho (tirá-lo de sys.modules não chega, o pacote guarda-o).
+        database = importlib.reload(importlib.import_module('automation.database'))
+
+        conn = database.get_connection()
+        seed(conn, size, args.pending_ratio)
+        first_page = database.get_dashboard_stats(BENCH_USER)
+
+        new_ms = time_call(lambda: database.get_dashboard_stats(BENCH_USER), args.repeats)
+        next_ms = time_call(lambda: database.get_dashboard_stats(BENCH_USER, cursor=database.parse_dashboard_cursor(first_page['next_cursor'])), args.repeats) if first_page['next_cursor'] else float('nan')
+        legacy_ms = time_call(lambda: [conn.execute(query).fetchall() for query in LEGACY_QUERIES], max(1, args.repeats // 4))
+        print(f"{size:>10} {new_ms:>18.2f} {next_ms:>15.2f} {legacy_ms:>22.2f}")
+        database.close_connection()
+
+
+if __name__ == '__main__':
+    main()
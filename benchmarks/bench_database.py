@@ -0,0 +1,115 @@
+"""
+Benchmark de concorrência da base de dados de automação.
+
+Lança N processos escritores (como o worker Celery a gravar rascunhos) e M processos
+leitores (como o dashboard) contra o mesmo ficheiro SQLite durante um período fixo, e
+reporta o débito e o número de erros "database is locked".
+
+O modo --legacy reproduz o comportamento antigo (uma ligação nova por operação, journal
+de rollback por omissão) para comparação direta com as ligações reutilizadas em WAL.
+
+Uso (a partir da raiz do repositório):
+    python -m benchmarks.bench_database --writers 4 --readers 4 --seconds 10
+    python -m benchmarks.bench_database --writers 4 --readers 4 --seconds 10 --legacy
+"""
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('EVENTS_REDIS_URL', '')
+
+BENCH_USER = 'bench-owner@example.com'
+
+
+def legacy_add_draft(db_file, i):
+    conn = sqlite3.connect(db_file)
+    conn.execute(
+        "INSERT INTO pending_drafts (id, user_email, thread_id, recipient, subject, body, created_at, original_message_id) VALUES (?, ?, ?, ?, ?, ?, datetime('now'), ?)",
+        (f"{os.getpid()}-{i}", BENCH_USER, f"t{i}", "bench@example.com", "Re: bench", "corpo " * 50, None)
+    )
+    conn.commit()
+    conn.close()
+
+
+def legacy_read_pending(db_file):
+    conn = sqlite3.connect(db_file)
+    conn.execute("SELECT COUNT(*) FROM pending_drafts WHERE user_email = ? AND status = 'pending'", (BENCH_USER,)).fetchone()
+    conn.close()
+
+
+def worker(role, db_file, seconds, legacy, results):
+    os.environ['AUTOMATION_DB_FILE'] = db_file
+    from automation import database
+
+    operations = errors = 0
+    deadline = time.perf_counter() + seconds
+    i = 0
+    while time.perf_counter() < deadline:
+        i += 1
+        try:
+            if role == 'writer':
+                if legacy:
+                    legacy_add_draft(db_file, i)
+                else:
+                    draft_id = database.add_pending_draft(BENCH_USER, f"t{i}", "bench@example.com", "Re: bench", "corpo " * 50, None)
+                    if i % 4 == 0:
+                        database.update_draft_status(draft_id, 'approved')
+            else:
+                if legacy:
+                    legacy_read_pending(db_file)
+                else:
+                    database.get_pending_draft(f"missing-{i}")
+                    database.get_connection().execute("SELECT COUNT(*) FROM pending_drafts WHERE user_email = ? AND status = 'pending'", (BENCH_USER,)).fetchone()
+            operations += 1
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e):
+                raise
+            errors += 1
+    results.put((role, operations, errors))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--legacy', action='store_true', help="Uma ligação por operação, sem WAL (comportamento antigo).")
+    args = parser.parse_args()
+
+    db_file = os.path.join(tempfile.mkdtemp(prefix='bench_db_'), 'automation.db')
+    os.environ['AUTOMATION_DB_FILE'] = db_file
+    from automation import database
+    database.init_db()
+    database.close_connection()
+    if args.legacy:
+        # Repõe o journal de rollback por omissão para reproduzir o comportamento antigo.
+        conn = sqlite3.connect(db_file)
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.close()
+
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=worker, args=('writer', db_file, args.seconds, args.legacy, results)) for _ in range(args.writers)]
+    processes += [multiprocessing.Process(target=worker, args=('reader', db_file, args.seconds, args.legacy, results)) for _ in range(args.readers)]
+    for process in processes:
+        process.start()
+    totals = {'writer': [0, 0], 'reader': [0, 0]}
+    for _ in processes:
+        role, operations, errors = results.get()
+        totals[role][0] += operations
+        totals[role][1] += errors
+    for process in processes:
+        process.join()
+
+    mode = 'legacy (ligação por operação, rollback journal)' if args.legacy else 'pooled (ligação por thread, WAL)'
+    print(f"Modo: {mode}  |  {args.writers} escritores, {args.readers} leitores, {args.seconds:.0f}s")
+    for role, (operations, errors) in totals.items():
+        print(f"  {role:<7} {operations / args.seconds:>10.0f} ops/s   {errors} erros 'database is locked'")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Benchmark da extração do corpo dos emails (core.mime.extract_body).
+
+Converte mensagens .eml (pasta indicada em --corpus) em payloads no formato da API do
+Gmail e junta-lhes newsletters HTML sintéticas de vários tamanhos. Mede o tempo por
+mensagem do extrator por blocos e, se o beautifulsoup4 estiver instalado, da extração
+antiga com BeautifulSoup(...).get_text() sobre o HTML inteiro.
+
+Uso (a partir da raiz do repositório):
+    python -m benchmarks.bench_mime
+    python -m benchmarks.bench_mime --corpus ~/Mail/amostra --repeat 20
+"""
+import os
+import sys
+import time
+import email
+import base64
+import argparse
+import statistics
+import importlib.util
+from email import policy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.mime import extract_body, iter_parts, _decode_part
+from benchmarks._stats import percentile
+
+
+def encode_data(raw):
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def message_to_payload(message):
+    """Converte um email.message.Message na estrutura 'payload' devolvida pela API do Gmail."""
+    part = {
+        'mimeType': message.get_content_type(),
+        'filename': message.get_filename() or '',
+        'headers': [{'name': name, 'value': str(value)} for name, value in message.items()],
+        'body': {},
+    }
+    if message.is_multipart():
+        part['parts'] = [message_to_payload(child) for child in message.get_payload()]
+    else:
+        raw = message.get_payload(decode=True) or b''
+        part['body'] = {'size': len(raw), 'data': encode_data(raw)}
+    return part
+
+
+def load_corpus(directory):
+    payloads = []
+    for name in sorted(os.listdir(directory)):
+        if not name.lower().endswith('.eml'):
+            continue
+        with open(os.path.join(directory, name), 'rb') as f:
+            payloads.append(message_to_payload(email.message_from_binary_file(f, policy=policy.compat32)))
+    return payloads
+
+
+def synthetic_newsletter(blocks):
+    """Newsletter multipart/mixed > multipart/alternative só com HTML, com CSS, tabelas e um anexo."""
+    style = '<style>' + '.c{color:#333;padding:0}' * 200 + '</style>'
+    rows = ''.join(
+        f'<tr><td class="c"><h2>Artigo {i}</h2><p>Lorem ipsum dolor sit amet, consectetur &amp; adipiscing '
+        f'<a href="https://exemplo.pt/{i}">ler mais</a></p><img src="https://exemplo.pt/{i}.png"/></td></tr>'
+        for i in range(blocks)
+    )
+    html = f'<html><head>{style}</head><body><table>{rows}</table></body></html>'.encode('utf-8')
+    html_part = {
+        'mimeType': 'text/html',
+        'headers': [{'name': 'Content-Type', 'value': 'text/html; charset="utf-8"'}],
+        'body': {'size': len(html), 'data': encode_data(html)},
+    }
+    attachment = {
+        'mimeType': 'application/pdf', 'filename': 'catalogo.pdf',
+        'headers': [{'name': 'Content-Disposition', 'value': 'attachment; filename="catalogo.pdf"'}],
+        'body': {'attachmentId': 'x', 'size': 100000},
+    }
+    return {
+        'mimeType': 'multipart/mixed', 'headers': [],
+        'parts': [{'mimeType': 'multipart/alternative', 'headers': [], 'parts': [html_part]}, attachment],
+    }
+
+
+def bs4_extract(payload):
+    """Extração antiga: texto simples se existir, senão BeautifulSoup sobre o HTML completo."""
+    from bs4 import BeautifulSoup
+    html_part = None
+    for part in iter_parts(payload):
+        if part.get('mimeType') == 'text/plain' and part.get('body', {}).get('data'):
+            return _decode_part(part, sys.maxsize)
+        if part.get('mimeType') == 'text/html' and html_part is None and part.get('body', {}).get('data'):
+            html_part = part
+    if html_part is None:
+        return ''
+    return BeautifulSoup(_decode_part(html_part, sys.maxsize), 'html.parser').get_text(separator='\n', strip=True)
+
+
+def run(label, extractor, payloads, repeat):
+    timings = []
+    for _ in range(repeat):
+        for payload in payloads:
+            started = time.perf_counter()
+            extractor(payload)
+            timings.append((time.perf_counter() - started) * 1000)
+    print(f"{label:<14} p50={statistics.median(timings):.3f}ms  p95={percentile(timings, 95):.3f}ms  "
+          f"max={max(timings):.3f}ms  total={sum(timings):.0f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', help="Pasta com ficheiros .eml reais.")
+    parser.add_argument('--sizes', default='10,200,2000', help="Número de artigos de cada newsletter sintética.")
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    payloads = load_corpus(args.corpus) if args.corpus else []
+    newsletters = [synthetic_newsletter(int(size)) for size in args.sizes.split(',') if size]
+    payloads.extend(newsletters)
+    print(f"{len(payloads)} mensagens ({len(newsletters)} newsletters sintéticas), {args.repeat} repetições")
+
+    run('core.mime', extract_body, payloads, args.repeat)
+    if importlib.util.find_spec('bs4') is None:
+        print("beautifulsoup4 não instalado: comparação omitida.")
+    else:
+        run('BeautifulSoup', bs4_extract, payloads, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+"""
+Benchmark do pipeline de rascunhos com um Gemini falso e uma API Gmail falsa.
+
+Arranca dois servidores HTTP locais: um Gemini falso (latência e tamanho de resposta
+configuráveis, via GEMINI_API_BASE) e um Gmail falso que devolve uma thread sintética
+(via GMAIL_API_ROOT). Para cada tamanho de ontologia sintética (memórias na base de
+conhecimento e correções aprendidas, gerada a partir de personas2.0.json) mede:
+    retrieval   find_relevant_knowledge com os índices do snapshot
+    prompt      build_context_block + build_draft_prompt
+    analyze     rota /analyze (extremo a extremo, 1 chamada ao Gemini)
+    draft       rota /draft (extremo a extremo, 1 chamada ao Gemini)
+    worker      process_new_email (Gmail + triagem + resumo, tom e rascunho no Gemini)
+    notify      send_draft_notification + envio pelo backend de notificações
+e reporta p50/p95, débito e a memória residente (RSS) do processo.
+
+As memórias sintéticas não têm embeddings, exceto com --embeddings (vetores aleatórios;
+exige o torch e o sentence-transformers).
+
+As tarefas Celery correm em modo eager e as notificações vão, por omissão, para o sink em
+memória (NOTIFIER_BACKEND=memory), por isso nenhum pedido sai da máquina.
+
+Uso (a partir da raiz do repositório):
+    python -m benchmarks.bench_pipeline
+    python -m benchmarks.bench_pipeline --memories 10,1000,100000 --corrections 10,1000,10000 --gemini-delay 0.2
+"""
+import os
+import sys
+import json
+import time
+import base64
+import random
+import argparse
+import tempfile
+import datetime
+import statistics
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from benchmarks._stats import percentile
+
+BENCH_USER = 'bench@example.com'
+VOCABULARY = [f"termo{i}" for i in range(5000)] + ['reunião', 'projeto', 'relatório', 'orçamento', 'tese', 'prazo']
+EMAIL_TEXT = (
+    "Bom dia Professor,\n\nGostaria de saber se podemos marcar uma reunião para discutir o relatório "
+    "do projeto e o orçamento da tese. O prazo de entrega é na próxima semana.\n\nCumprimentos,\nAna Silva"
+)
+
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    delay = 0.05
+    response_chars = 800
+    hits = 0
+
+    def do_POST(self):
+        FakeGeminiHandler.hits += 1
+        prompt = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))['contents'][0]['parts'][0]['text']
+        time.sleep(self.delay)
+        if 'APENAS com uma palavra' in prompt:
+            text = 'formal'
+        elif 'APENAS um objeto JSON' in prompt:
+            text = json.dumps({'email_intent': 'direct_question', 'points': ['Confirmar a data da reunião.']})
+        else:
+            text = ('Lorem ipsum dolor sit amet. ' * (self.response_chars // 28 + 1))[:self.response_chars]
+        body = json.dumps({'candidates': [{'content': {'parts': [{'text': text}]}}]}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeGmailHandler(BaseHTTPRequestHandler):
+    hits = 0
+
+    def do_GET(self):
+        FakeGmailHandler.hits += 1
+        thread_id = self.path.split('?')[0].rstrip('/').rsplit('/', 1)[-1]
+        data = base64.urlsafe_b64encode(EMAIL_TEXT.encode('utf-8')).decode('ascii')
+        thread = {'id': thread_id, 'messages': [{
+            'id': f"{thread_id}-m1", 'threadId': thread_id, 'labelIds': ['INBOX'],
+            'payload': {
+                'mimeType': 'text/plain',
+                'headers': [
+                    {'name': 'From', 'value': 'Ana Silva <ana.silva@universidade.pt>'},
+                    {'name': 'Subject', 'value': 'Reunião sobre o projeto'},
+                    {'name': 'Message-ID', 'value': f"<{thread_id}@universidade.pt>"},
+                ],
+                'body': {'data': data},
+            },
+        }]}
+        body = json.dumps(thread).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(handler):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def rss_mb():
+    """Memória residente atual (Linux) ou o pico, noutros sistemas."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except OSError:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def synthetic_ontology(template, memories, corrections, embeddings, rng):
+    ontology = json.loads(json.dumps(template))
+    ontology['base_knowledge'] = [
+        {
+            'id': f"mem_{i}", 'label': f"Facto {i}", 'value': f"valor {i}", 'type': 'fact',
+            'keywords': rng.sample(VOCABULARY, 3),
+            **({'embedding': [rng.uniform(-0.5, 0.5) for _ in range(384)]} if embeddings else {}),
+        }
+        for i in range(memories)
+    ]
+    # Todas as correções ficam na persona formal: com uma só persona rotulada, o classificador
+    # de formalidade não é treinado e o modelo de embedding não é carregado.
+    for persona_id, persona in ontology['personas'].items():
+        persona['personal_knowledge_base'] = [mem for mem in persona.get('personal_knowledge_base', []) if embeddings or 'embedding' not in mem]
+        persona['learned_knowledge_base'] = [] if persona_id != 'rodrigo_novelo_formal' else [
+            {
+                'inferred_rule_pt': f"{'Nunca ' if i % 10 == 0 else ''}Regra aprendida {i}.",
+                'interaction_context_snapshot': {'original_email_text': ' '.join(rng.sample(VOCABULARY, 15))},
+            }
+            for i in range(corrections)
+        ]
+    return ontology
+
+
+def measure(label, operation, iterations, results):
+    timings = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        op_started = time.perf_counter()
+        operation(i)
+        timings.append((time.perf_counter() - op_started) * 1000)
+    elapsed = time.perf_counter() - started
+    results.append((label, statistics.median(timings), percentile(timings, 95), iterations / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--memories', default='10,1000,100000', help="Tamanhos da base de conhecimento.")
+    parser.add_argument('--corrections', default='10,1000,10000', help="Nº de correções aprendidas (emparelhado com --memories).")
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--e2e-iterations', type=int, default=20, help="Iterações das etapas com chamadas HTTP.")
+    parser.add_argument('--gemini-delay', type=float, default=0.05, help="Latência (s) do Gemini falso.")
+    parser.add_argument('--response-chars', type=int, default=800, help="Tamanho do rascunho devolvido pelo Gemini falso.")
+    parser.add_argument('--embeddings', action='store_true', help="Inclui embeddings aleatórios nas memórias.")
+    parser.add_argument('--notifier', default='memory', help="Backend de notificações (memory, file, webhook, ...).")
+    args = parser.parse_args()
+
+    memory_sizes = [int(size) for size in args.memories.split(',')]
+    correction_sizes = [int(size) for size in args.corrections.split(',')]
+    correction_sizes += correction_sizes[-1:] * (len(memory_sizes) - len(correction_sizes))
+
+    FakeGeminiHandler.delay = args.gemini_delay
+    FakeGeminiHandler.response_chars = args.response_chars
+    gemini_server = start_server(FakeGeminiHandler)
+    gmail_server = start_server(FakeGmailHandler)
+
+    workdir = tempfile.mkdtemp(prefix='bench_pipeline_')
+    os.environ['AUTOMATION_DB_FILE'] = os.path.join(workdir, 'automation.db')
+    os.environ['ONTOLOGY_FILE'] = os.path.join(workdir, 'ontology.json')
+    os.environ['GEMINI_API_BASE'] = f"http://127.0.0.1:{gemini_server.server_port}"
+    os.environ['GEMINI_API_KEY'] = 'bench'
+    os.environ['GMAIL_API_ROOT'] = f"http://127.0.0.1:{gmail_server.server_port}/"
+    os.environ['CELERY_BROKER_URL'] = 'memory://'
+    os.environ['CELERY_RESULT_BACKEND'] = 'cache+memory://'
+    os.environ.setdefault('EVENTS_REDIS_URL', '')
+    os.environ['NOTIFIER_BACKEND'] = args.notifier
+    os.environ.setdefault('NOTIFY_FILE', os.path.join(workdir, 'notifications.jsonl'))
+    os.environ.setdefault('FLASK_BASE_URL', 'http://localhost:5000')
+
+    import logging
+    logging.disable(logging.WARNING)
+
+    from automation.database import init_db, save_user_credentials
+    init_db()
+    save_user_credentials(BENCH_USER, {
+        'token': 'bench-token', 'refresh_token': None, 'token_uri': 'https://oauth2.googleapis.com/token',
+        'client_id': 'bench', 'client_secret': 'bench', 'scopes': ['https://www.googleapis.com/auth/gmail.modify'],
+        'expiry': (datetime.datetime.utcnow() + datetime.timedelta(days=1)).isoformat(),
+    })
+
+    from core.ontology import save_ontology_file, get_snapshot
+    from core.retrieval import find_relevant_knowledge
+    from core.prompts import build_context_block, build_draft_prompt, DEFAULT_TASK_INSTRUCTION, DEFAULT_GUIDANCE_SUMMARY
+    from app import app
+    from automation.celery_worker import celery, process_new_email, send_draft_notification
+    from automation.notifications import get_notifier
+    # As tarefas encadeadas (notificação e envio agregado) correm no próprio processo.
+    celery.conf.task_always_eager = True
+
+    with open(os.path.join(BASE_DIR, 'personas2.0.json'), 'r', encoding='utf-8') as f:
+        template = json.load(f)
+    client = app.test_client()
+    persona_id = 'rodrigo_novelo_formal'
+    rng = random.Random(42)
+
+    print(f"Gemini falso: {args.gemini_delay * 1000:.0f} ms, {args.response_chars} caracteres  |  "
+          f"RSS inicial: {rss_mb():.0f} MB")
+    for memories, corrections in zip(memory_sizes, correction_sizes):
+        build_started = time.perf_counter()
+        save_ontology_file(synthetic_ontology(template, memories, corrections, args.embeddings, rng))
+        snapshot = get_snapshot()
+        persona = snapshot.data['personas'][persona_id]
+        learned = persona['learned_knowledge_base']
+        build_ms = (time.perf_counter() - build_started) * 1000
+
+        def retrieval(_):
+            return find_relevant_knowledge(EMAIL_TEXT, snapshot.knowledge_indexes(persona_id), learned)
+
+        memories_found, corrections_found = retrieval(0)
+
+        def prompt(_):
+            context_block = build_context_block(persona, None, memories_found, corrections_found)
+            return build_draft_prompt(persona, persona_id, DEFAULT_TASK_INSTRUCTION, context_block, EMAIL_TEXT, DEFAULT_GUIDANCE_SUMMARY, 'Ana Silva')
+
+        def analyze(_):
+            assert client.post('/analyze', json={'email_text': EMAIL_TEXT}).status_code == 200
+
+        def draft(_):
+            response = client.post('/draft', json={'original_email': EMAIL_TEXT, 'persona_name': persona_id, 'user_inputs': []})
+            assert response.status_code == 200, response.data
+
+        def worker(i):
+            process_new_email(f"thread-{memories}-{i}", BENCH_USER, f"thread-{memories}-{i}-m1")
+
+        def notify(i):
+            send_draft_notification(f"bench-{memories}-{i}", {'subject': 'Re: Reunião', 'full_draft_body': EMAIL_TEXT, 'original_summary': 'Pedido de reunião.'}, BENCH_USER)
+
+        results = []
+        measure('retrieval', retrieval, args.iterations, results)
+        measure('prompt', prompt, args.iterations, results)
+        measure('analyze', analyze, args.e2e_iterations, results)
+        measure('draft', draft, args.e2e_iterations, results)
+        measure('worker', worker, args.e2e_iterations, results)
+        measure('notify', notify, args.iterations, results)
+
+        print(f"\n{memories} memórias, {corrections} correções  |  snapshot em {build_ms:.0f} ms  |  RSS: {rss_mb():.0f} MB")
+        for label, p50, p95, throughput in results:
+            print(f"  {label:<10} p50={p50:9.2f}ms  p95={p95:9.2f}ms  {throughput:9.1f} ops/s")
+
+    notifier = get_notifier()
+    delivered = f"{len(notifier.notifications)} rascunhos em {len(notifier.batches)} envios" if args.notifier == 'memory' else args.notifier
+    print(f"\nPedidos ao Gemini falso: {FakeGeminiHandler.hits}  |  ao Gmail falso: {FakeGmailHandler.hits}  |  notificações: {delivered}")
+    gemini_server.shutdown()
+    gmail_server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Micro-benchmark do caminho quente da pesquisa de conhecimento (sem embeddings).
+
+Gera uma base de conhecimento sintética grande (memórias com palavras-chave e correções
+aprendidas com o email original) e mede o tempo de CPU por rascunho de:
+    legacy   normalização inline como antes (re.sub + unidecode em cada correção,
+             stopwords recriadas e regex das regras críticas recompilada por chamada)
+    core     find_relevant_knowledge + build_context_block com core.text (padrões
+             pré-compilados e normalização memoizada do texto da ontologia)
+
+Uso (a partir da raiz do repositório):
+    python -m benchmarks.bench_retrieval --memories 20000 --corrections 2000 --drafts 200
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import unidecode
+from core.retrieval import KnowledgeIndex, find_relevant_knowledge
+from core.prompts import build_context_block
+from benchmarks._stats import percentile
+
+VOCABULARY = [f"termo{i}" for i in range(5000)] + [
+    'reunião', 'projeto', 'relatório', 'orçamento', 'júri', 'tese', 'aula', 'horário', 'sala', 'prazo',
+]
+FILLER = "Olá, espero que esteja bem. Gostaria de saber se é possível, por favor, confirmar o seguinte assunto."
+
+
+def synthetic_knowledge(rng, memories, corrections):
+    knowledge = [
+        {'id': f"mem{i}", 'label': f"Facto {i}", 'value': f"valor {i}", 'keywords': rng.sample(VOCABULARY, 3)}
+        for i in range(memories)
+    ]
+    learned = [
+        {
+            'inferred_rule_pt': f"{'Nunca ' if i % 10 == 0 else ''}Regra aprendida {i}.",
+            'interaction_context_snapshot': {'original_email_text': f"{FILLER} {' '.join(rng.sample(VOCABULARY, 12))}"},
+        }
+        for i in range(corrections)
+    ]
+    return knowledge, learned
+
+
+def synthetic_email(rng):
+    return f"{FILLER} {' '.join(rng.sample(VOCABULARY, 20))}\n\nCumprimentos,\nAna"
+
+
+def legacy_draft(email_text, knowledge_index, learned):
+    """Reprodução da normalização anterior a core.text, para comparação."""
+    stopwords = set(['a', 'o', 'e', 'de', 'do', 'da', 'em', 'um', 'uma', 'com', 'por', 'para'])
+    email_words = set(re.sub(r'[^\w\s]', '', unidecode.unidecode(email_text.lower())).split()) - stopwords
+    knowledge_index.keyword_matches(email_words)
+    scored_rules = []
+    for item in learned:
+        context = item['interaction_context_snapshot']['original_email_text']
+        context_words = set(re.sub(r'[^\w\s]', '', unidecode.unidecode(context.lower())).split())
+        union = len(email_words.union(context_words))
+        score = len(email_words.intersection(context_words)) / union if union else 0
+        if score > 0.05:
+            scored_rules.append((score, item['inferred_rule_pt']))
+    scored_rules.sort(key=lambda x: x[0], reverse=True)
+    return [rule for rule in (rule for _, rule in scored_rules[:2]) if re.search(r'\b(Nunca|Jamais|Regra Crítica)\b', rule, re.IGNORECASE)]
+
+
+def core_draft(email_text, knowledge_index, learned):
+    memories, corrections = find_relevant_knowledge(email_text, [knowledge_index], learned)
+    return build_context_block({}, None, memories, corrections)
+
+
+def run(label, draft, emails, knowledge_index, learned):
+    timings = []
+    for email_text in emails:
+        started = time.process_time()
+        draft(email_text, knowledge_index, learned)
+        timings.append((time.process_time() - started) * 1000)
+    print(f"{label:<7} CPU por rascunho (ms): p50={statistics.median(timings):.2f}  "
+          f"p95={percentile(timings, 95):.2f}  total={sum(timings):.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--memories', type=int, default=20000)
+    parser.add_argument('--corrections', type=int, default=2000)
+    parser.add_argument('--drafts', type=int, default=200)
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.INFO)
+
+    rng = random.Random(42)
+    knowledge, learned = synthetic_knowledge(rng, args.memories, args.corrections)
+    knowledge_index = KnowledgeIndex(knowledge)
+    emails = [synthetic_email(rng) for _ in range(args.drafts)]
+    print(f"{args.memories} memórias, {args.corrections} correções, {args.drafts} rascunhos")
+
+    run('legacy', legacy_draft, emails, knowledge_index, learned)
+    run('core', core_draft, emails, knowledge_index, learned)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Avaliação da triagem local (core.triage) sobre uma amostra rotulada.
+
+Cada linha do JSONL descreve uma mensagem e se ela precisava de resposta:
+    {"headers": {"From": "...", "List-Unsubscribe": "..."}, "labelIds": ["INBOX"],
+     "body": "...", "needs_reply": true}
+
+Reporta quantas mensagens foram descartadas, quantas delas precisavam de resposta
+(descartes errados), as chamadas ao LLM poupadas e o tempo da triagem por mensagem.
+Sem --sample usa uma amostra sintética. O classificador por embeddings entra se
+TRIAGE_EXAMPLES_FILE estiver definido (e o sentence-transformers instalado).
+
+Uso (a partir da raiz do repositório):
+    python -m benchmarks.bench_triage
+    TRIAGE_EXAMPLES_FILE=exemplos.jsonl python -m benchmarks.bench_triage --sample amostra.jsonl
+"""
+import os
+import sys
+import time
+import json
+import random
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.triage import triage_message
+from benchmarks._stats import percentile
+
+
+def to_message(item):
+    return {
+        'labelIds': item.get('labelIds', ['INBOX']),
+        'payload': {
+            'mimeType': item.get('mimeType', 'text/plain'),
+            'headers': [{'name': name, 'value': value} for name, value in item.get('headers', {}).items()],
+        },
+    }
+
+
+def synthetic_sample(count, seed=7):
+    rng = random.Random(seed)
+    templates = [
+        ({'From': 'Ana Silva <ana@empresa.pt>'}, ['INBOX'], "Podemos marcar uma reunião para a próxima semana?", True),
+        ({'From': 'João <joao@universidade.pt>'}, ['INBOX'], "Pode enviar-me o relatório revisto até sexta?", True),
+        ({'From': 'Secretaria <secretaria@faculdade.pt>'}, ['INBOX'], "Confirma a sua presença no júri?", True),
+        ({'From': 'Loja <news@loja.pt>', 'List-Unsubscribe': '<mailto:unsub@loja.pt>'}, ['INBOX', 'CATEGORY_PROMOTIONS'], "Promoções de verão: até 50% de desconto.", False),
+        ({'From': 'GitHub <notifications@github.com>', 'List-Id': 'repo.github.com'}, ['INBOX', 'CATEGORY_UPDATES'], "Novo comentário no pull request.", False),
+        ({'From': 'Banco <no-reply@banco.pt>'}, ['INBOX'], "O seu extrato mensal está disponível.", False),
+        ({'From': 'Calendário <calendar@empresa.pt>', 'Auto-Submitted': 'auto-generated'}, ['INBOX'], "Lembrete: reunião às 15h.", False),
+        ({'From': 'Pedro <pedro@empresa.pt>', 'Auto-Submitted': 'auto-replied'}, ['INBOX'], "Estou ausente até dia 20.", False),
+    ]
+    sample = []
+    for _ in range(count):
+        headers, labels, body, needs_reply = rng.choice(templates)
+        sample.append({'headers': headers, 'labelIds': labels, 'body': body, 'needs_reply': needs_reply})
+    return sample
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sample', help="JSONL com a amostra rotulada.")
+    parser.add_argument('--count', type=int, default=1000, help="Tamanho da amostra sintética.")
+    parser.add_argument('--calls-per-email', type=float, default=2.5,
+                        help="Chamadas ao LLM por email respondido (resumo + rascunho + tom quando não há perfil).")
+    args = parser.parse_args()
+
+    if args.sample:
+        with open(args.sample, 'r', encoding='utf-8') as f:
+            sample = [json.loads(line) for line in f if line.strip()]
+    else:
+        sample = synthetic_sample(args.count)
+
+    skipped = wrongly_skipped = missed = 0
+    reasons = {}
+    timings = []
+    for item in sample:
+        started = time.perf_counter()
+        needs_reply, reason = triage_message(to_message(item), item.get('body', ''))
+        timings.append((time.perf_counter() - started) * 1000)
+        if not needs_reply:
+            skipped += 1
+            reasons[reason] = reasons.get(reason, 0) + 1
+            wrongly_skipped += bool(item['needs_reply'])
+        elif not item['needs_reply']:
+            missed += 1
+
+    no_reply_total = sum(1 for item in sample if not item['needs_reply'])
+    print(f"{len(sample)} mensagens ({no_reply_total} sem necessidade de resposta)")
+    print(f"Descartadas: {skipped}  |  descartes errados: {wrongly_skipped}  |  não detetadas: {missed}")
+    print(f"Chamadas ao LLM poupadas: {skipped * args.calls_per_email:.0f} de {len(sample) * args.calls_per_email:.0f} "
+          f"({skipped / len(sample) * 100:.1f}%)")
+    print(f"Triagem (ms): p50={statistics.median(timings):.3f}  p95={percentile(timings, 95):.3f}")
+    for reason, count in sorted(reasons.items(), key=lambda item: -item[1]):
+        print(f"  {count:>6}  {reason}")
+
+
+if __name__ == '__main__':
+    main()
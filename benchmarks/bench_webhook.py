@@ -0,0 +1,106 @@
+"""
+Benchmark do webhook do Gmail com pushes Pub/Sub falsos.
+
+Simula entregas Pub/Sub (incluindo reentregas do mesmo messageId) contra a rota
+/gmail-webhook e mede a latência de resposta. O cliente Gmail é apontado para um
+servidor local propositadamente lento, que conta os pedidos recebidos: o webhook
+não lhe deve fazer nenhum.
+
+Uso (a partir da raiz do repositório):
+    python -m benchmarks.bench_webhook --requests 500 --gmail-delay 2.0
+"""
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import importlib
+import tempfile
+import statistics
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks._stats import percentile
+
+
+class SlowGmailHandler(BaseHTTPRequestHandler):
+    delay = 2.0
+    hits = 0
+
+    def _respond(self):
+        SlowGmailHandler.hits += 1
+        time.sleep(self.delay)
+        body = b'{}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = _respond
+
+    def log_message(self, *args):
+        pass
+
+
+def start_slow_gmail(delay):
+    SlowGmailHandler.delay = delay
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SlowGmailHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def pubsub_push(message_id, email, history_id):
+    data = base64.b64encode(json.dumps({'emailAddress': email, 'historyId': history_id}).encode()).decode()
+    return {
+        'message': {'data': data, 'messageId': message_id, 'publishTime': '2025-01-01T00:00:00Z'},
+        'subscription': 'projects/bench/subscriptions/gmail-inbox-updates'
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--duplicate-ratio', type=float, default=0.2, help="Fração de reentregas do mesmo messageId.")
+    parser.add_argument('--gmail-delay', type=float, default=2.0, help="Latência (s) do servidor Gmail falso.")
+    args = parser.parse_args()
+
+    gmail_server = start_slow_gmail(args.gmail_delay)
+    workdir = tempfile.mkdtemp(prefix='bench_webhook_')
+    os.environ['AUTOMATION_DB_FILE'] = os.path.join(workdir, 'automation.db')
+    os.environ['GMAIL_API_ROOT'] = f"http://127.0.0.1:{gmail_server.server_port}/"
+    os.environ['CELERY_BROKER_URL'] = 'memory://'
+    os.environ['CELERY_RESULT_BACKEND'] = 'cache+memory://'
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    from automation.database import init_db
+    init_db()
+    from app import app
+    # O webhook só importa o worker Celery no primeiro pedido; importá-lo já deixa esse custo
+    # (registo das tarefas e ligação ao broker em memória) fora da medição.
+    importlib.import_module('automation.celery_worker')
+
+    client = app.test_client()
+    latencies = []
+    duplicates = 0
+    duplicate_stride = max(1, round(1 / args.duplicate_ratio)) if args.duplicate_ratio > 0 else 0
+    for i in range(args.requests):
+        is_duplicate = bool(duplicate_stride) and i > 0 and i % duplicate_stride == 0
+        message_id = f"msg-{i - 1}" if is_duplicate else f"msg-{i}"
+        duplicates += is_duplicate
+        payload = pubsub_push(message_id, 'bench@example.com', str(1000 + i))
+        started = time.perf_counter()
+        response = client.post('/gmail-webhook', json=payload)
+        latencies.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200, response.data
+
+    print(f"Pedidos: {args.requests} ({duplicates} reentregas)  |  Gmail falso: {args.gmail_delay:.1f}s de latência")
+    print(f"Latência do webhook (ms): p50={statistics.median(latencies):.2f}  "
+          f"p95={percentile(latencies, 95):.2f}  p99={percentile(latencies, 99):.2f}  max={max(latencies):.2f}")
+    print(f"Pedidos feitos ao Gmail durante o webhook: {SlowGmailHandler.hits}")
+    gmail_server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,4 @@
+# core/__init__.py
+#
+# Lógica partilhada entre a aplicação Flask e o worker Celery (ontologia, pesquisa de
+# conhecimento, construção de prompts e cliente Gemini), importável sem carregar a app web.
@@ -0,0 +1,86 @@
+# core/formality.py
+
+import os
+import time
+import logging
+import threading
+
+from core.retrieval import CentroidClassifier
+
+# Classificador local de formalidade: escolhe a persona (formal/informal) pelo centroide mais
+# próximo do embedding do email. Treina com os emails das correções aprendidas de cada persona
+# e com as escolhas de persona guardadas; abaixo da margem mínima, quem decide é o LLM.
+FORMALITY_MIN_MARGIN = float(os.environ.get('FORMALITY_MIN_MARGIN', 0.05))
+FORMALITY_MIN_EXAMPLES = int(os.environ.get('FORMALITY_MIN_EXAMPLES', 5))
+FORMALITY_MAX_EXAMPLES = int(os.environ.get('FORMALITY_MAX_EXAMPLES', 2000))
+FORMALITY_RETRAIN_SECONDS = int(os.environ.get('FORMALITY_RETRAIN_SECONDS', 3600))
+
+# Um classificador por utilizador: {user_email: (classificador, versão da ontologia, treinado em)}.
+_classifiers = {}
+# Um lock por utilizador, para que o treino de uma conta não bloqueie as previsões das outras.
+_user_locks = {}
+_user_locks_lock = threading.Lock()
+
+
+def ontology_examples(ontology):
+    """Pares (email original, persona) das correções aprendidas de cada persona."""
+    for persona_id, persona in ontology.get('personas', {}).items():
+        for item in persona.get('learned_knowledge_base', []):
+            text = (item.get('interaction_context_snapshot') or {}).get('original_email_text')
+            if text:
+                yield text, persona_id
+
+
+def build_classifier(examples, persona_ids):
+    """
+    Constrói o classificador com os exemplos das personas existentes, ou devolve None se
+    houver menos de duas personas com FORMALITY_MIN_EXAMPLES exemplos.
+    """
+    counts = {}
+    for _, persona_id in examples:
+        counts[persona_id] = counts.get(persona_id, 0) + 1
+    trained_personas = {persona_id for persona_id, count in counts.items() if persona_id in persona_ids and count >= FORMALITY_MIN_EXAMPLES}
+    if len(trained_personas) < 2:
+        return None
+    return CentroidClassifier((text, persona_id) for text, persona_id in examples if persona_id in trained_personas)
+
+
+def get_classifier(snapshot, user_email, load_stored_examples):
+    """
+    Classificador do utilizador, retreinado quando a ontologia muda ou a cada
+    FORMALITY_RETRAIN_SECONDS. 'load_stored_examples(user_email, limit)' devolve as escolhas
+    guardadas desse utilizador: o email de uma conta nunca influencia a persona de outra.
+    """
+    classifier, trained_for_version, trained_at = _classifiers.get(user_email, (None, None, 0.0))
+    if trained_for_version == snapshot.version and time.monotonic() - trained_at < FORMALITY_RETRAIN_SECONDS:
+        return classifier
+    with _user_locks_lock:
+        user_lock = _user_locks.setdefault(user_email, threading.Lock())
+    with user_lock:
+        classifier, trained_for_version, trained_at = _classifiers.get(user_email, (None, None, 0.0))
+        if trained_for_version != snapshot.version or time.monotonic() - trained_at >= FORMALITY_RETRAIN_SECONDS:
+            try:
+                examples = list(ontology_examples(snapshot.data)) + load_stored_examples(user_email, FORMALITY_MAX_EXAMPLES)
+                classifier = build_classifier(examples, set(snapshot.data.get('personas', {})))
+                logging.info(f"Classificador de formalidade de {user_email} {'treinado' if classifier else 'sem exemplos suficientes'} ({len(examples)} exemplos).")
+            except Exception as e:
+                logging.error(f"Falha ao treinar o classificador de formalidade de {user_email}: {e}")
+                classifier = None
+            _classifiers[user_email] = (classifier, snapshot.version, time.monotonic())
+    return classifier
+
+
+def predict_persona(classifier, text):
+    """Persona prevista para o email, ou None se não houver classificador ou a margem for baixa."""
+    if classifier is None or not text:
+        return None
+    try:
+        persona_id, margin = classifier.predict(text)
+    except Exception as e:
+        logging.error(f"Erro no classificador de formalidade: {e}")
+        return None
+    if margin < FORMALITY_MIN_MARGIN:
+        logging.info(f"Classificador de formalidade pouco confiante (margem {margin:.2f}).")
+        return None
+    logging.info(f"Persona '{persona_id}' escolhida pelo classificador local (margem {margin:.2f}).")
+    return persona_id
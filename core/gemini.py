@@ -0,0 +1,41 @@
+# core/gemini.py
+
+import os
+import requests
+from dotenv import load_dotenv
+
+from core.metrics import stage_timer, record_gemini_usage
+
+load_dotenv()
+
+GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
+GEMINI_MODEL = os.environ.get('GEMINI_MODEL', 'gemini-2.5-flash-lite')
+# Permite apontar o cliente para um servidor local (ex: o Gemini falso de benchmarks/bench_pipeline.py).
+GEMINI_API_BASE = os.environ.get('GEMINI_API_BASE', 'https://generativelanguage.googleapis.com').rstrip('/')
+
+
+# --- COMUNICAÇÃO COM A API GEMINI ---
+def call_gemini(prompt, model=GEMINI_MODEL, temperature=0.6):
+    if not GEMINI_API_KEY: return {"error": "ERROR_CONFIG: Chave da API do Gemini não configurada."}
+    api_url = f"{GEMINI_API_BASE}/v1beta/models/{model}:generateContent?key={GEMINI_API_KEY}"
+    payload = {
+        "contents": [{"parts": [{"text": prompt}]}],
+        "generationConfig": {"temperature": temperature, "responseMimeType": "text/plain"},
+        "safetySettings": [{"category": c, "threshold": "BLOCK_MEDIUM_AND_ABOVE"} for c in ["HARM_CATEGORY_HARASSMENT", "HARM_CATEGORY_HATE_SPEECH", "HARM_CATEGORY_SEXUALLY_EXPLICIT", "HARM_CATEGORY_DANGEROUS_CONTENT"]]
+    }
+    try:
+        with stage_timer('gemini'):
+            response = requests.post(api_url, json=payload, headers={'Content-Type': 'application/json'}, timeout=180)
+        response.raise_for_status()
+        data = response.json()
+        record_gemini_usage(model, data.get('usageMetadata'))
+        if data.get('promptFeedback', {}).get('blockReason'): return {"error": f"ERROR_GEMINI_BLOCKED_PROMPT: {data['promptFeedback']['blockReason']}"}
+        if candidates := data.get('candidates'):
+            if text_parts := candidates[0].get('content', {}).get('parts', []):
+                return {"text": text_parts[0]['text'].strip()}
+        return {"error": "ERROR_GEMINI_PARSE: Resposta válida, mas nenhum texto gerado encontrado."}
+    except requests.exceptions.RequestException as e:
+        record_gemini_usage(model, None, 'error')
+        return {"error": f"ERROR_GEMINI_REQUEST: O pedido à API falhou com o estado {e.response.status_code if e.response else 'N/A'}."}
+    except Exception as e:
+        return {"error": f"ERROR_UNEXPECTED: {e.__class__.__name__} - {e}"}
@@ -0,0 +1,115 @@
+# core/metrics.py
+
+import os
+import time
+import logging
+import contextlib
+
+from core.tracing import begin_span
+
+# Métricas Prometheus por etapa do pipeline. O prometheus_client é opcional: sem ele, os
+# temporizadores continuam a funcionar (e a registar no log em DEBUG) mas nada é exportado.
+try:
+    import prometheus_client
+    from prometheus_client import Histogram, Counter
+except ImportError:
+    prometheus_client = None
+
+# Porta do exportador HTTP dos workers Celery (0 desativa). Com o pool prefork, definir
+# também PROMETHEUS_MULTIPROC_DIR para agregar as métricas de todos os processos filho.
+CELERY_METRICS_PORT = int(os.environ.get('CELERY_METRICS_PORT', 0))
+PROMETHEUS_MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.environ.get('prometheus_multiproc_dir')
+
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class _NoopMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+
+if prometheus_client is not None:
+    STAGE_SECONDS = Histogram(
+        'draft_pipeline_stage_seconds', "Duração de cada etapa do pipeline de rascunhos.",
+        ['stage'], buckets=STAGE_BUCKETS
+    )
+    STAGE_ERRORS = Counter('draft_pipeline_stage_errors_total', "Etapas terminadas com exceção.", ['stage'])
+    GEMINI_TOKENS = Counter('gemini_tokens_total', "Tokens reportados no usageMetadata do Gemini.", ['model', 'kind'])
+    GEMINI_REQUESTS = Counter('gemini_requests_total', "Pedidos ao Gemini por resultado.", ['model', 'outcome'])
+else:
+    STAGE_SECONDS = STAGE_ERRORS = GEMINI_TOKENS = GEMINI_REQUESTS = _NoopMetric()
+
+
+@contextlib.contextmanager
+def stage_timer(stage):
+    """
+    Mede a duração de uma etapa (ex: 'retrieval.semantic', 'gemini', 'sqlite.claim_message')
+    no histograma draft_pipeline_stage_seconds e, com o rastreamento ativo, num span com o
+    mesmo nome (ver core/tracing.py). Também serve de decorador.
+    """
+    started = time.perf_counter()
+    span = begin_span(stage)
+    try:
+        yield
+    except BaseException as e:
+        STAGE_ERRORS.labels(stage).inc()
+        if span is not None:
+            span.finish(e)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(stage).observe(elapsed)
+        if span is not None:
+            span.finish()
+        logging.debug(f"Etapa {stage}: {elapsed * 1000:.1f} ms")
+
+
+def observe_stage(stage, seconds):
+    """Regista uma duração medida fora de stage_timer (ex: entre sinais do Celery)."""
+    STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def record_gemini_usage(model, usage_metadata, outcome='ok'):
+    """Contabiliza um pedido ao Gemini e os tokens do usageMetadata da resposta, se existirem."""
+    GEMINI_REQUESTS.labels(model, outcome).inc()
+    for kind, field in (('prompt', 'promptTokenCount'), ('completion', 'candidatesTokenCount'), ('total', 'totalTokenCount')):
+        if count := (usage_metadata or {}).get(field):
+            GEMINI_TOKENS.labels(model, kind).inc(count)
+
+
+def _registry():
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import CollectorRegistry, multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return prometheus_client.REGISTRY
+
+def render_metrics():
+    """Devolve (corpo, content-type) da página /metrics, ou None sem o prometheus_client."""
+    if prometheus_client is None:
+        return None
+    return prometheus_client.generate_latest(_registry()), prometheus_client.CONTENT_TYPE_LATEST
+
+def start_metrics_server(port=CELERY_METRICS_PORT):
+    """Arranca o exportador HTTP (ex: no processo principal do worker). Devolve True se arrancou."""
+    if not port:
+        return False
+    if prometheus_client is None:
+        logging.warning("CELERY_METRICS_PORT definido, mas o prometheus_client não está instalado.")
+        return False
+    prometheus_client.start_http_server(port, registry=_registry())
+    logging.info(f"Exportador de métricas Prometheus a escutar na porta {port}.")
+    return True
+
+def mark_process_dead(pid):
+    """Limpa os ficheiros de métricas de um processo filho terminado (modo multiprocesso)."""
+    if prometheus_client is not None and PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(pid)
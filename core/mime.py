@@ -0,0 +1,129 @@
+# core/mime.py
+
+import os
+import re
+import base64
+import codecs
+from html.parser import HTMLParser
+
+# Limites de processamento: bytes descodificados por parte e caracteres de texto devolvidos.
+# Newsletters com centenas de KB de HTML são cortadas em vez de processadas por inteiro.
+MIME_MAX_PART_BYTES = int(os.environ.get('MIME_MAX_PART_BYTES', 512 * 1024))
+MIME_MAX_TEXT_CHARS = int(os.environ.get('MIME_MAX_TEXT_CHARS', 50000))
+
+HTML_FEED_CHUNK = 64 * 1024
+
+_CHARSET_RE = re.compile(r'charset\s*=\s*"?([^";\s]+)"?', re.IGNORECASE)
+
+
+def _header(part, name):
+    name = name.lower()
+    return next((h['value'] for h in part.get('headers', []) if h['name'].lower() == name), '')
+
+def _charset(part):
+    match = _CHARSET_RE.search(_header(part, 'Content-Type'))
+    charset = match.group(1) if match else 'utf-8'
+    try:
+        return codecs.lookup(charset).name
+    except LookupError:
+        return 'utf-8'
+
+def _is_attachment(part):
+    return bool(part.get('filename')) or _header(part, 'Content-Disposition').lower().startswith('attachment')
+
+def _decode_part(part, max_bytes):
+    """Descodifica o base64url da parte (só até max_bytes) com o charset declarado."""
+    data = part.get('body', {}).get('data')
+    if not data:
+        return ''
+    # Cada 4 caracteres base64 dão 3 bytes: corta antes de descodificar.
+    encoded_limit = -(-max_bytes // 3) * 4
+    data = data[:encoded_limit]
+    raw = base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))[:max_bytes]
+    return raw.decode(_charset(part), errors='replace')
+
+
+class _HTMLTextExtractor(HTMLParser):
+    """Extrai o texto visível de HTML, com quebras de linha nos elementos de bloco."""
+
+    BLOCK_TAGS = {'p', 'div', 'br', 'tr', 'li', 'ul', 'ol', 'table', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'blockquote', 'section', 'article', 'header', 'footer', 'hr'}
+    SKIP_TAGS = {'script', 'style', 'head', 'title', 'noscript', 'template'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.chunks = []
+        self.length = 0
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag in self.BLOCK_TAGS:
+            self.chunks.append('\n')
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in self.BLOCK_TAGS:
+            self.chunks.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag in self.BLOCK_TAGS:
+            self.chunks.append('\n')
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.chunks.append(data)
+            self.length += len(data)
+
+
+def normalize_text(text):
+    """Uma linha por bloco de texto, sem espaços repetidos nem linhas vazias (como get_text(strip=True))."""
+    lines = (' '.join(line.split()) for line in text.splitlines())
+    return '\n'.join(line for line in lines if line)
+
+def html_to_text(html, max_chars=MIME_MAX_TEXT_CHARS):
+    """
+    Converte HTML em texto com o HTMLParser da biblioteca padrão, alimentado por blocos:
+    o processamento para assim que há texto suficiente.
+    """
+    extractor = _HTMLTextExtractor()
+    for start in range(0, len(html), HTML_FEED_CHUNK):
+        extractor.feed(html[start:start + HTML_FEED_CHUNK])
+        if extractor.length >= max_chars:
+            break
+    else:
+        extractor.close()
+    return normalize_text(''.join(extractor.chunks))[:max_chars]
+
+
+def iter_parts(payload):
+    """Percorre em profundidade todas as partes do payload da API do Gmail, pela ordem do email."""
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        yield part
+        stack.extend(reversed(part.get('parts', [])))
+
+def extract_body(payload, max_chars=MIME_MAX_TEXT_CHARS):
+    """
+    Devolve o melhor corpo de texto de um payload do Gmail, a qualquer profundidade
+    (ex: multipart/alternative dentro de multipart/mixed). Prefere a primeira parte
+    text/plain e recorre à primeira text/html; anexos são ignorados.
+    """
+    plain_part = html_part = None
+    for part in iter_parts(payload):
+        mime_type = part.get('mimeType', '').lower()
+        if mime_type not in ('text/plain', 'text/html') or _is_attachment(part) or not part.get('body', {}).get('data'):
+            continue
+        if mime_type == 'text/plain':
+            plain_part = part
+            break
+        if html_part is None:
+            html_part = part
+
+    if plain_part is not None:
+        return _decode_part(plain_part, MIME_MAX_PART_BYTES)[:max_chars].replace('\r\n', '\n').strip()
+    if html_part is not None:
+        return html_to_text(_decode_part(html_part, MIME_MAX_PART_BYTES), max_chars)
+    return ""
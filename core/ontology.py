@@ -0,0 +1,228 @@
+# core/ontology.py
+
+import os
+import copy
+import fnmatch
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+import traceback
+
+from core.retrieval import KnowledgeIndex
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ONTOLOGY_FILE = os.environ.get('ONTOLOGY_FILE', os.path.join(BASE_DIR, 'personas2.0.json'))
+
+# Serializa as sequências ler-modificar-gravar do ficheiro da ontologia.
+ontology_file_lock = threading.Lock()
+
+# Snapshot atual da ontologia. É substituído por inteiro (copy-on-write) e nunca alterado
+# no lugar, por isso os leitores usam a referência sem lock. Só quem recarrega usa o
+# _reload_lock; um leitor que o encontre ocupado continua com o snapshot anterior.
+_snapshot = None
+_reload_lock = threading.Lock()
+
+
+class OntologySnapshot:
+    """
+    Versão imutável da ontologia com os índices derivados: mapa de interlocutores e um
+    KnowledgeIndex (palavras-chave + matriz de embeddings) por âmbito de conhecimento.
+    Os índices cujo conteúdo não mudou são reaproveitados do snapshot anterior.
+    'version' é monotónico dentro do processo; 'file_version' (mtime, tamanho) e
+    'content_hash' identificam o ficheiro de onde veio, para comparação entre processos.
+    """
+
+    def __init__(self, data, version, file_version, content_hash, previous=None):
+        self.data = data
+        self.version = version
+        self.file_version = file_version
+        self.content_hash = content_hash
+        profiles = data.get('interlocutor_profiles', {})
+        profiles_fingerprint = hashlib.sha1(json.dumps(profiles, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+        if previous is not None and previous._profiles_fingerprint == profiles_fingerprint:
+            self.interlocutors = previous.interlocutors
+        else:
+            self.interlocutors = InterlocutorIndex(profiles)
+        self._profiles_fingerprint = profiles_fingerprint
+
+        # Reconstrução incremental: os âmbitos cujo conteúdo não mudou reutilizam o índice
+        # (e a matriz de embeddings já construída) do snapshot anterior.
+        self.knowledge = {}
+        self._fingerprints = {}
+        for scope, memories in _knowledge_scopes(data):
+            fingerprint = hashlib.sha1(json.dumps(memories, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+            if previous is not None and previous._fingerprints.get(scope) == fingerprint:
+                self.knowledge[scope] = previous.knowledge[scope]
+            else:
+                self.knowledge[scope] = KnowledgeIndex(memories)
+            self._fingerprints[scope] = fingerprint
+
+    def knowledge_indexes(self, persona_id):
+        """Índices pesquisados para uma persona: a base partilhada seguida do conhecimento da persona."""
+        return [index for index in (self.knowledge.get('base'), self.knowledge.get(f'persona:{persona_id}')) if index]
+
+    def find_interlocutor(self, sender_email):
+        return self.interlocutors.lookup(sender_email)
+
+
+def _knowledge_scopes(data):
+    yield 'base', data.get('base_knowledge', [])
+    for persona_id, persona in data.get('personas', {}).items():
+        yield f'persona:{persona_id}', persona.get('personal_knowledge_base', [])
+
+class InterlocutorIndex:
+    """
+    Tabela de pesquisa dos perfis de interlocutor pelo email do remetente. Cada 'email_match'
+    (uma string ou uma lista, ex: contactos importados de um livro de endereços) pode ser:
+      - um endereço exato:          "ana@empresa.pt"
+      - um domínio inteiro:         "@empresa.pt" ou "*@empresa.pt"
+      - um padrão com wildcards:    "*.silva@*.pt" (sintaxe fnmatch)
+    A precedência é endereço > domínio > padrão; as duas primeiras são consultas O(1) e os
+    padrões, tipicamente poucos, são testados pela ordem da ontologia.
+    """
+
+    def __init__(self, profiles):
+        self.by_email = {}
+        self.by_domain = {}
+        self.patterns = []
+        for profile in profiles.values():
+            email_matches = profile.get('email_match', [])
+            if isinstance(email_matches, str):
+                email_matches = [email_matches]
+            for rule in email_matches:
+                rule = rule.strip().casefold()
+                if rule.startswith('*@') and not any(char in rule[2:] for char in '*?['):
+                    rule = rule[1:]
+                if not rule:
+                    continue
+                # Em caso de duplicados, prevalece o primeiro perfil (como no ciclo original).
+                if rule.startswith('@'):
+                    self.by_domain.setdefault(rule[1:], profile)
+                elif any(char in rule for char in '*?['):
+                    self.patterns.append((rule, profile))
+                else:
+                    self.by_email.setdefault(rule, profile)
+
+    def lookup(self, sender_email):
+        if not sender_email:
+            return None
+        sender_email = sender_email.strip().casefold()
+        profile = self.by_email.get(sender_email)
+        if profile is None and '@' in sender_email:
+            profile = self.by_domain.get(sender_email.rpartition('@')[2])
+        if profile is None:
+            profile = next((profile for pattern, profile in self.patterns if fnmatch.fnmatchcase(sender_email, pattern)), None)
+        return profile
+
+
+# --- CARREGAMENTO E GESTÃO DA ONTOLOGIA ---
+
+def _file_version():
+    try:
+        stat = os.stat(ONTOLOGY_FILE)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def load_ontology_file():
+    """Carrega de forma segura o conteúdo do ficheiro da ontologia."""
+    try:
+        with open(ONTOLOGY_FILE, 'r', encoding='utf-8') as f:
+            ontology_data = json.load(f)
+        logging.info(f"Ontologia carregada com sucesso do ficheiro: {ONTOLOGY_FILE}")
+        return ontology_data
+    except Exception as e:
+        logging.error(f"ERRO CRÍTICO ao carregar a ontologia: {e}\n{traceback.format_exc()}")
+        return {}
+
+def save_ontology_file(data):
+    """
+    Salva os dados da ontologia de forma atómica (ficheiro temporário + rename, para que
+    outros processos nunca leiam um JSON a meio) e publica o novo snapshot neste processo.
+    """
+    global _snapshot
+    try:
+        serialized = json.dumps(data, ensure_ascii=False, indent=2)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(ONTOLOGY_FILE), prefix='.ontology-', suffix='.json')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(serialized)
+            if os.path.exists(ONTOLOGY_FILE):
+                os.chmod(tmp_path, os.stat(ONTOLOGY_FILE).st_mode & 0o777)
+            os.replace(tmp_path, ONTOLOGY_FILE)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        logging.info(f"Ontologia salva com sucesso em {ONTOLOGY_FILE}")
+    except Exception as e:
+        logging.error(f"ERRO AO SALVAR O FICHEIRO DE ONTOLOGIA: {e}\n{traceback.format_exc()}")
+        return False
+
+    with _reload_lock:
+        previous = _snapshot
+        _snapshot = OntologySnapshot(
+            json.loads(serialized), (previous.version if previous else 0) + 1,
+            _file_version(), hashlib.sha1(serialized.encode('utf-8')).hexdigest(), previous
+        )
+    return True
+
+def _reload(file_version):
+    """Recarrega o ficheiro e publica um novo snapshot. Chamado com o _reload_lock adquirido."""
+    global _snapshot
+    previous = _snapshot
+    if previous is not None and previous.file_version == file_version:
+        return previous
+    try:
+        with open(ONTOLOGY_FILE, 'rb') as f:
+            raw = f.read()
+        content_hash = hashlib.sha1(raw).hexdigest()
+        if previous is not None and previous.content_hash == content_hash:
+            # Ficheiro tocado mas sem alterações: mantém dados e índices.
+            snapshot = copy.copy(previous)
+            snapshot.file_version = file_version
+        else:
+            snapshot = OntologySnapshot(json.loads(raw), (previous.version if previous else 0) + 1, file_version, content_hash, previous)
+            logging.info(f"Ontologia carregada com sucesso do ficheiro: {ONTOLOGY_FILE} (versão {snapshot.version})")
+    except Exception as e:
+        logging.error(f"ERRO CRÍTICO ao carregar a ontologia: {e}\n{traceback.format_exc()}")
+        if previous is not None:
+            return previous
+        snapshot = OntologySnapshot({}, 0, None, None)
+    _snapshot = snapshot
+    return snapshot
+
+def get_snapshot():
+    """
+    Devolve o snapshot atual, recarregando-o se o ficheiro mudou (ex: uma persona editada
+    noutro processo). A verificação custa um os.stat por chamada.
+    """
+    snapshot = _snapshot
+    file_version = _file_version()
+    if snapshot is not None and snapshot.file_version == file_version:
+        return snapshot
+    if snapshot is None:
+        with _reload_lock:
+            return _reload(file_version)
+    if not _reload_lock.acquire(blocking=False):
+        return snapshot  # Outra thread já está a recarregar; usa a versão anterior.
+    try:
+        return _reload(file_version)
+    finally:
+        _reload_lock.release()
+
+def get_ontology():
+    """Devolve os dados da ontologia atual (só de leitura: alterações passam por save_ontology_file)."""
+    return get_snapshot().data
+
+
+# --- FUNÇÕES HELPER PARA A ARQUITETURA ---
+
+def get_component(component_type, component_id):
+    if not component_id: return None
+    return get_ontology().get("communication_components", {}).get(component_type, {}).get(component_id)
+
+def find_interlocutor_profile(sender_email):
+    """Devolve o perfil de interlocutor cujo email_match corresponde ao remetente, se existir."""
+    return get_snapshot().find_interlocutor(sender_email)
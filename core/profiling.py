@@ -0,0 +1,115 @@
+# core/profiling.py
+
+import io
+import os
+import time
+import pstats
+import random
+import logging
+import cProfile
+import threading
+import contextlib
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Fração de pedidos /draft e tarefas process_new_email perfilados (0 desativa).
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
+# Nº máximo de perfis guardados: os mais antigos são apagados (diretório rotativo).
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 200))
+# 'cprofile' (biblioteca padrão) ou 'pyinstrument' (amostragem de stacks, se instalado).
+PROFILER = os.environ.get('PROFILER', 'cprofile').lower()
+
+PROFILE_EXTENSIONS = ('.prof', '.html')
+
+# Só um perfil de cada vez por processo: os profilers da biblioteca padrão não suportam
+# sessões concorrentes, e um pedido que encontre o lock ocupado corre sem perfil.
+_profile_lock = threading.Lock()
+
+
+def _should_profile():
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+def _profile_path(name, extension):
+    now = time.time()
+    timestamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(now))
+    return os.path.join(PROFILE_DIR, f"{timestamp}-{int(now * 1000) % 1000:03d}-{name}-{os.getpid()}{extension}")
+
+def list_profiles():
+    """Perfis guardados, do mais recente para o mais antigo: [{'name', 'size', 'modified'}]."""
+    try:
+        entries = [entry for entry in os.scandir(PROFILE_DIR) if entry.is_file() and entry.name.endswith(PROFILE_EXTENSIONS)]
+    except FileNotFoundError:
+        return []
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    return [{'name': entry.name, 'size': entry.stat().st_size, 'modified': entry.stat().st_mtime} for entry in entries]
+
+def _rotate():
+    for profile in list_profiles()[PROFILE_MAX_FILES:]:
+        with contextlib.suppress(OSError):
+            os.remove(os.path.join(PROFILE_DIR, profile['name']))
+
+def profile_file_path(name):
+    """Caminho de um perfil pelo nome, ou None se não existir ou o nome for inválido."""
+    if os.path.basename(name) != name or not name.endswith(PROFILE_EXTENSIONS):
+        return None
+    path = os.path.join(PROFILE_DIR, name)
+    return path if os.path.isfile(path) else None
+
+def profile_summary(path, limit=60, sort='cumulative'):
+    """Resumo em texto de um perfil cProfile (as 'limit' funções com maior tempo)."""
+    output = io.StringIO()
+    stats = pstats.Stats(path, stream=output)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return output.getvalue()
+
+
+@contextlib.contextmanager
+def profiled(name):
+    """
+    Perfila o bloco (ou a função decorada) com probabilidade PROFILE_SAMPLE_RATE e grava o
+    resultado em PROFILE_DIR: .prof (cProfile, abrir com pstats/snakeviz) ou .html (pyinstrument).
+    """
+    if not _should_profile() or not _profile_lock.acquire(blocking=False):
+        yield
+        return
+    try:
+        if PROFILER == 'pyinstrument':
+            try:
+                from pyinstrument import Profiler
+            except ImportError:
+                logging.warning("PROFILER=pyinstrument mas o pyinstrument não está instalado; a usar cProfile.")
+            else:
+                profiler = Profiler()
+
+                def write_html(path):
+                    with open(path, 'w', encoding='utf-8') as f:
+                        f.write(profiler.output_html())
+
+                profiler.start()
+                try:
+                    yield
+                finally:
+                    profiler.stop()
+                    _save(name, '.html', write_html)
+                return
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            _save(name, '.prof', profiler.dump_stats)
+    finally:
+        _profile_lock.release()
+
+def _save(name, extension, write):
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = _profile_path(name, extension)
+        write(path)
+        logging.info(f"Perfil de '{name}' guardado em {path}.")
+        _rotate()
+    except Exception as e:
+        logging.error(f"Falha ao guardar o perfil de '{name}': {e}")
@@ -0,0 +1,143 @@
+# core/prompts.py
+
+import random
+import datetime
+
+from core.metrics import stage_timer
+from core.ontology import get_component
+from core.text import SENDER_RE, EXTRA_BLANK_LINES_RE, is_critical_rule
+
+DEFAULT_TASK_INSTRUCTION = "A sua tarefa é escrever um rascunho de e-mail completo e natural, seguindo as instruções."
+# Protocolo de segurança para pedidos de agendamento: nunca inventar datas ou horas.
+SCHEDULING_TASK_INSTRUCTION = "A sua tarefa é acusar a receção do pedido de agendamento e indicar que as datas/horas precisam de ser confirmadas internamente. Para isso, construa uma frase natural que utilize os placeholders '[Confirmar data aqui]' e '[Confirmar hora aqui]' para propor as datas. NÃO INVENTE NENHUMA DATA OU HORA."
+DEFAULT_GUIDANCE_SUMMARY = "Nenhuma instrução específica. Gerar uma resposta com base no contexto do email e na persona."
+
+DRAFT_START_MARKER = "--- Rascunho Final (Comece aqui) ---"
+DRAFT_BODY_PLACEHOLDER = "[ESCREVA O CORPO DO E-MAIL AQUI]"
+
+
+def get_current_time_of_day():
+    current_hour = datetime.datetime.now().hour
+    if 5 <= current_hour < 13: return "morning"
+    if 13 <= current_hour < 20: return "afternoon"
+    return "evening"
+
+def resolve_component(component, recipient_name=""):
+    if not component or not component.get('content'): return ""
+    time_of_day = get_current_time_of_day()
+    valid_options = [item for item in component['content'] if not item.get('condition') or ("time_of_day" in item.get('condition') and item.get('condition').endswith(time_of_day))]
+    if not valid_options: return ""
+    chosen_item = random.choice(valid_options)
+    return chosen_item.get('text', "").replace("{{recipient_name}}", recipient_name).strip()
+
+def parse_sender_info(original_email_text):
+    match = SENDER_RE.search(original_email_text)
+    if match:
+        name, email = match.group(1).strip().replace('"', ''), match.group(2).strip()
+
+        # Lista de palavras-chave que indicam um remetente genérico
+        generic_keywords = ['secretaria', 'organização', 'equipa', 'serviços', 'departamento', 'noreply', 'info@', 'gabinete']
+
+        # Se o nome contiver uma keyword genérica ou se o nome for parte do email (ex: "info"), considera-se genérico
+        if any(keyword in name.lower() for keyword in generic_keywords) or '@' in name:
+            return None, email # Retorna None para o nome para que seja omitido
+
+        return name, email
+
+    return None, "" # Fallback principal também retorna None
+
+def is_scheduling_request(text):
+    lowered = text.lower()
+    return 'reunião' in lowered or 'marcar' in lowered
+
+def without_scheduling_rules(corrections):
+    """Remove as regras aprendidas de agendamento (substituídas pelo protocolo de segurança ou pela guidance)."""
+    return [rule for rule in corrections if "agendamento" not in rule.lower()]
+
+
+@stage_timer('prompt.context')
+def build_context_block(persona, interlocutor_profile, relevant_memories, relevant_corrections):
+    """Constrói o bloco de contexto do prompt: estilo, princípios, interlocutor, factos e regras aprendidas."""
+    prompt_context_parts = []
+    style_profile = persona.get("style_profile", {})
+
+    tone_keywords = style_profile.get('tone_keywords', [])
+    verbosity = style_profile.get('verbosity')
+
+    style_instructions = []
+    if tone_keywords:
+        style_instructions.append(f"Tom geral a adotar: {', '.join(tone_keywords)}.")
+    if verbosity:
+        style_instructions.append(f"Nível de detalhe do texto: {verbosity}.")
+
+    if style_instructions:
+        prompt_context_parts.append("--- Estilo e Tom (Seguir estritamente) ---\n" + "\n".join(style_instructions))
+
+    if key_principles := style_profile.get('key_principles', []):
+        prompt_context_parts.append("--- Princípios Chave da Persona (Regras Gerais) ---\n- " + "\n- ".join(key_principles))
+
+    if interlocutor_profile:
+        context_parts = [f"Nome: {interlocutor_profile.get('full_name')}", f"Relação: {interlocutor_profile.get('relationship')}"]
+        prompt_context_parts.append("--- Contexto Sobre o Interlocutor ---\n" + " | ".join(filter(None, context_parts)))
+        if personalization_rules := interlocutor_profile.get("personalization_rules", []):
+            prompt_context_parts.append(f"--- Regras Específicas Para Este Contacto (Prioridade Máxima) ---\n- " + "\n- ".join(personalization_rules))
+
+    if relevant_memories:
+        formatted_memories = [f"{mem.get('label', 'Facto')} = {mem.get('value')}" for mem in relevant_memories if mem.get('value')]
+        if formatted_memories:
+            prompt_context_parts.append(f"--- Factos Relevantes da Memória (Usar apenas se solicitado) ---\n- " + "\n- ".join(formatted_memories))
+
+    if relevant_corrections:
+        critical_rules, standard_rules = [], []
+        for rule in relevant_corrections:
+            if is_critical_rule(rule):
+                critical_rules.append(rule)
+            else:
+                standard_rules.append(rule)
+        if standard_rules:
+            prompt_context_parts.append(f"--- Regras Aprendidas (Sobrepõem-se aos Princípios Chave) ---\n- " + "\n- ".join(standard_rules))
+        if critical_rules:
+            prompt_context_parts.insert(0, f"--- REGRAS CRÍTICAS E INVIOLÁVEIS (OBRIGATÓRIO CUMPRIR) ---\n- " + "\n- ".join(critical_rules))
+
+    return "\n\n".join(prompt_context_parts)
+
+
+@stage_timer('prompt.build')
+def build_draft_prompt(persona, persona_id, task_instruction, context_block, original_email, guidance_summary, sender_name=None):
+    """Monta o prompt final de geração, com saudação, despedida e assinatura da persona."""
+    default_ids = persona.get("default_components", {})
+    recipient_first_name = sender_name.split()[0] if sender_name else ""
+    greeting_text = resolve_component(get_component("greetings", default_ids.get("greeting_id")), recipient_first_name)
+    closing_text = resolve_component(get_component("closings", default_ids.get("closing_id")))
+    signature_text = resolve_component(get_component("signatures", default_ids.get("signature_id")))
+
+    return f"""
+Você é um assistente de escrita que encarna a persona '{persona.get('label', persona_id)}'.
+{task_instruction}
+
+{context_block}
+
+--- E-mail Original a Responder ---
+{original_email}
+
+--- Instruções do Utilizador (Seguir à risca) ---
+{guidance_summary}
+
+{DRAFT_START_MARKER}
+{greeting_text}
+
+{DRAFT_BODY_PLACEHOLDER}
+
+{closing_text}
+{signature_text}
+"""
+
+
+def clean_draft_text(raw_draft):
+    """Extrai o rascunho final da resposta do modelo, removendo marcadores e linhas em branco a mais."""
+    raw_draft = raw_draft.strip()
+    if DRAFT_START_MARKER in raw_draft:
+        raw_draft = raw_draft.split(DRAFT_START_MARKER)[-1]
+
+    final_draft = raw_draft.replace(DRAFT_BODY_PLACEHOLDER, '').strip()
+    return EXTRA_BLANK_LINES_RE.sub('\n\n', final_draft).strip()
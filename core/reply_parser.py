@@ -0,0 +1,66 @@
+# core/reply_parser.py
+
+import re
+
+# Cabeçalhos que introduzem o histórico citado de uma resposta. Os clientes costumam
+# partir o "On ... wrote:" em duas linhas, por isso a linha é testada também junta à seguinte.
+_QUOTE_HEADER_RE = re.compile(
+    r'^\s*(?:On|Em|No dia|Le|Am|El)\s.{0,300}?(?:wrote|escreveu|a écrit|schrieb|escribió)\s*:\s*$',
+    re.IGNORECASE
+)
+_ORIGINAL_MESSAGE_RE = re.compile(
+    r'^\s*-{2,}\s*(?:Original Message|Mensagem original|Mensaje original)\s*-{2,}\s*$',
+    re.IGNORECASE
+)
+# Estilo Outlook: "De: ..." seguido, poucas linhas abaixo, de "Enviado:"/"Sent:"/"Data:".
+_OUTLOOK_FROM_RE = re.compile(r'^\s*\*?(?:From|De)\s*:\*?\s', re.IGNORECASE)
+_OUTLOOK_SENT_RE = re.compile(r'^\s*\*?(?:Sent|Enviado|Enviada|Date|Data)\s*:\*?\s', re.IGNORECASE)
+_OUTLOOK_SEPARATOR_RE = re.compile(r'^\s*_{10,}\s*$')
+_QUOTED_LINE_RE = re.compile(r'^\s*>')
+
+# Assinaturas: o delimitador "-- " e as assinaturas automáticas dos clientes móveis.
+_SIGNATURE_RE = re.compile(
+    r'^\s*(?:--\s*|Enviado do meu .{0,40}|Enviado a partir do .{0,40}|Sent from my .{0,40}'
+    r'|Get Outlook for .{0,40}|Obter o Outlook para .{0,40}|Obtenha o Outlook para .{0,40})$',
+    re.IGNORECASE
+)
+
+OUTLOOK_HEADER_WINDOW = 4
+
+
+def _quote_start(lines):
+    """Índice da primeira linha do histórico citado, ou None se a mensagem não o tiver."""
+    for index, line in enumerate(lines):
+        if _ORIGINAL_MESSAGE_RE.match(line) or _QUOTE_HEADER_RE.match(line):
+            return index
+        if index + 1 < len(lines) and _QUOTE_HEADER_RE.match(f"{line} {lines[index + 1]}"):
+            return index
+        if _OUTLOOK_FROM_RE.match(line) and any(
+            _OUTLOOK_SENT_RE.match(following) for following in lines[index + 1:index + 1 + OUTLOOK_HEADER_WINDOW]
+        ):
+            return index - 1 if index > 0 and _OUTLOOK_SEPARATOR_RE.match(lines[index - 1]) else index
+    return None
+
+
+def strip_quoted_reply(text):
+    """
+    Devolve só o texto novo de uma mensagem: remove o histórico citado ("On ... wrote:",
+    "De: ... Enviado:", "-----Original Message-----" e linhas começadas por '>') e a
+    assinatura. Se não sobrar nada (ex: só uma citação), devolve o texto original.
+    """
+    if not text:
+        return text
+    lines = text.replace('\r\n', '\n').split('\n')
+
+    quote_start = _quote_start(lines)
+    if quote_start is not None:
+        lines = lines[:quote_start]
+    lines = [line for line in lines if not _QUOTED_LINE_RE.match(line)]
+
+    for index, line in enumerate(lines):
+        if _SIGNATURE_RE.match(line):
+            lines = lines[:index]
+            break
+
+    stripped = re.sub(r'\n{3,}', '\n\n', '\n'.join(line.rstrip() for line in lines)).strip()
+    return stripped or text.strip()
@@ -0,0 +1,164 @@
+# core/retrieval.py
+
+import logging
+import functools
+import threading
+
+from core.metrics import stage_timer
+from core.text import normalize_words, normalized_word_set
+
+EMBEDDING_MODEL_NAME = 'paraphrase-multilingual-MiniLM-L12-v2'
+
+# O modelo (e o torch) só é carregado na primeira pesquisa semântica, para que os
+# processos que nunca a fazem (ex: workers de ingestão) arranquem depressa e leves.
+_embedding_model = None
+_embedding_model_lock = threading.Lock()
+
+
+def get_embedding_model():
+    """Devolve o modelo de embedding partilhado pelo processo, carregando-o na primeira utilização."""
+    global _embedding_model
+    if _embedding_model is None:
+        with _embedding_model_lock:
+            if _embedding_model is None:
+                from sentence_transformers import SentenceTransformer
+                _embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    return _embedding_model
+
+
+@functools.lru_cache(maxsize=32)
+def encode_text(text):
+    """
+    Embedding de um texto, em cache: o mesmo email passa pela triagem, pela escolha de
+    persona e pela pesquisa semântica, mas só é codificado uma vez.
+    """
+    model = get_embedding_model()
+    with stage_timer('embedding'):
+        return model.encode(text, convert_to_tensor=True)
+
+
+class KnowledgeIndex:
+    """
+    Índices derivados de uma lista de memórias, construídos uma vez por versão da ontologia:
+    palavra-chave -> posições e a matriz de embeddings (criada só na primeira pesquisa semântica).
+    """
+
+    def __init__(self, memories):
+        self.memories = list(memories)
+        self.keyword_index = {}
+        for position, mem in enumerate(self.memories):
+            if not mem.get("value"):
+                continue
+            for keyword in set(mem.get("keywords", [])):
+                self.keyword_index.setdefault(keyword, []).append(position)
+        self.embedded_memories = [mem for mem in self.memories if 'embedding' in mem]
+        self._embedding_matrix = None
+
+    def keyword_matches(self, words):
+        positions = set()
+        for word in words:
+            positions.update(self.keyword_index.get(word, ()))
+        return [self.memories[position] for position in sorted(positions)]
+
+    @property
+    def embedding_matrix(self):
+        if self._embedding_matrix is None and self.embedded_memories:
+            import torch
+            self._embedding_matrix = torch.tensor([mem['embedding'] for mem in self.embedded_memories])
+        return self._embedding_matrix
+
+
+class CentroidClassifier:
+    """
+    Classificador local pelo centroide mais próximo, sobre os embeddings do modelo partilhado.
+    'examples' são pares (texto, rótulo); cada rótulo fica representado pela média normalizada
+    dos embeddings dos seus exemplos. Não há treino iterativo: construir custa um encode.
+    """
+
+    def __init__(self, examples):
+        import torch
+        texts_by_label = {}
+        for text, label in examples:
+            texts_by_label.setdefault(label, []).append(text)
+        if len(texts_by_label) < 2:
+            raise ValueError("São necessários exemplos de pelo menos dois rótulos.")
+        model = get_embedding_model()
+        self.labels = sorted(texts_by_label)
+        centroids = [model.encode(texts_by_label[label], convert_to_tensor=True, normalize_embeddings=True).mean(dim=0) for label in self.labels]
+        self.centroids = torch.nn.functional.normalize(torch.stack(centroids), dim=1)
+
+    def predict(self, text):
+        """Devolve (rótulo, margem): a margem é a diferença de similaridade para o segundo rótulo."""
+        import torch
+        embedding = torch.nn.functional.normalize(encode_text(text), dim=0)
+        scores = self.centroids @ embedding.to(self.centroids.device)
+        ranked = scores.argsort(descending=True)
+        return self.labels[int(ranked[0])], float(scores[ranked[0]] - scores[ranked[1]])
+
+
+# --- NOVAS FUNÇÕES DE BUSCA POR RELEVÂNCIA ---
+
+def calculate_relevance_for_corrections(new_email_words, learned_corrections, top_n=2):
+    """Função auxiliar para calcular a relevância apenas para as correções aprendidas."""
+    scored_rules = []
+    for item in learned_corrections:
+        context_snapshot = item.get("interaction_context_snapshot", {})
+        original_email_context = context_snapshot.get("original_email_text", "")
+        if original_email_context:
+            context_words = normalized_word_set(original_email_context)
+            intersection = len(new_email_words.intersection(context_words))
+            union = len(new_email_words.union(context_words))
+            score = intersection / union if union > 0 else 0
+            if score > 0.05: # Limiar mínimo de relevância
+                scored_rules.append((score, item.get("inferred_rule_pt")))
+
+    scored_rules.sort(key=lambda x: x[0], reverse=True)
+    return [rule_text for score, rule_text in scored_rules[:top_n] if rule_text]
+
+
+def find_relevant_knowledge(new_email_text, knowledge_indexes, learned_corrections):
+    """
+    Função híbrida que executa busca por palavras-chave e semântica em paralelo,
+    combinando os resultados para máxima precisão e descoberta contextual.
+    'knowledge_indexes' são os KnowledgeIndex do snapshot da ontologia (base + persona).
+    """
+    logging.info("A executar busca HÍBRIDA (Keywords + Semântica).")
+    new_email_words = normalize_words(new_email_text)
+
+    # --- BUSCA 1: PALAVRAS-CHAVE (PARA PRECISÃO MÁXIMA) ---
+    with stage_timer('retrieval.keyword'):
+        keyword_matches = [mem for index in knowledge_indexes for mem in index.keyword_matches(new_email_words)]
+
+    # --- BUSCA 2: SEMÂNTICA (PARA DESCOBERTA DE CONTEXTO) ---
+    semantic_matches = []
+    with stage_timer('retrieval.semantic'):
+        try:
+            embedded_indexes = [index for index in knowledge_indexes if index.embedded_memories]
+            if embedded_indexes:
+                import torch
+                from sentence_transformers import util
+                email_embedding = encode_text(new_email_text)
+                memories_with_embedding = [mem for index in embedded_indexes for mem in index.embedded_memories]
+                cosine_scores = torch.cat([util.cos_sim(email_embedding, index.embedding_matrix)[0] for index in embedded_indexes])
+                top_results = torch.topk(cosine_scores, k=min(3, len(memories_with_embedding))) # Top 3 contextuais
+
+                for score, idx in zip(top_results[0], top_results[1]):
+                    if score > 0.45: # Limiar de relevância ajustado
+                        semantic_matches.append(memories_with_embedding[int(idx)])
+        except Exception as e:
+            logging.error(f"Erro durante a busca semântica: {e}")
+
+    # --- FASE 3: UNIR RESULTADOS E REMOVER DUPLICADOS ---
+    combined_matches = keyword_matches + semantic_matches
+    final_memories = []
+    seen_ids = set()
+    for mem in combined_matches:
+        if (mem_id := mem.get("id")) and mem_id not in seen_ids:
+            final_memories.append(mem)
+            seen_ids.add(mem_id)
+
+    with stage_timer('retrieval.corrections'):
+        relevant_corrections = calculate_relevance_for_corrections(new_email_words, learned_corrections)
+
+    logging.info(f"Busca Híbrida encontrou: {len(final_memories)} memórias ({len(keyword_matches)} por keyword, {len(semantic_matches)} por semântica) e {len(relevant_corrections)} correções.")
+    return final_memories, relevant_corrections
@@ -0,0 +1,39 @@
+# core/text.py
+
+import re
+import functools
+import unidecode
+
+# Padrões pré-compilados usados em cada rascunho (pesquisa de conhecimento e prompts).
+NON_WORD_RE = re.compile(r'[^\w\s]')
+CRITICAL_RULE_RE = re.compile(r'\b(Nunca|Jamais|Regra Crítica)\b', re.IGNORECASE)
+SENDER_RE = re.compile(r"(?:From|De):\s*['\"]?(.*?)['\"]?\s*<(.*?)>", re.IGNORECASE)
+EXTRA_BLANK_LINES_RE = re.compile(r'\n{3,}')
+JSON_OBJECT_RE = re.compile(r'\{.*\}', re.DOTALL)
+
+# Palavras funcionais do português, já sem acentos (comparadas com o texto normalizado).
+PT_STOPWORDS = frozenset('''
+a o as os e de do da dos das em no na nos nas um uma uns umas com por pelo pela pelos pelas
+para pra ao aos que se nao sim mas ou ja ate sem sob sobre entre como mais menos muito muita
+muitos muitas pouco ser ter ha foi era sao esta estao esse essa esses essas este estes estas
+isso isto aquilo aquele aquela eu tu ele ela nos vos eles elas me te lhe lhes meu minha meus
+minhas seu sua seus suas nosso nossa teu tua voce voces qual quais quando onde porque entao
+tambem so bem vai vou tem temos tenho pode podem seria sera fica ficar obrigado obrigada ola
+cumprimentos atenciosamente
+'''.split())
+
+
+def normalize_words(text):
+    """Conjunto de palavras do texto em minúsculas, sem acentos, pontuação nem stopwords."""
+    return set(NON_WORD_RE.sub('', unidecode.unidecode(text.lower())).split()) - PT_STOPWORDS
+
+@functools.lru_cache(maxsize=4096)
+def normalized_word_set(text):
+    """
+    Versão memoizada de normalize_words para texto da ontologia (ex: os emails das correções
+    aprendidas), que se repete em cada rascunho. Devolve um frozenset partilhado.
+    """
+    return frozenset(normalize_words(text))
+
+def is_critical_rule(rule):
+    return CRITICAL_RULE_RE.search(rule) is not None
@@ -0,0 +1,243 @@
+# core/tracing.py
+"""
+Rastreamento de pedidos entre a web, o webhook e as tarefas Celery, compatível com o
+W3C Trace Context (cabeçalho 'traceparent') e com o formato OTLP/HTTP JSON do OpenTelemetry.
+
+Cada etapa medida com core.metrics.stage_timer é também um span. O contexto segue nos
+cabeçalhos das tarefas Celery, por isso um email fica num único trace desde o webhook
+até à notificação. Os spans são escritos em JSONL (TRACE_EXPORT_FILE) e/ou enviados em
+lotes para um coletor OTLP (TRACE_COLLECTOR_URL, ex: http://localhost:4318/v1/traces).
+
+Linha temporal de um trace ou de um rascunho a partir do ficheiro JSONL:
+    python -m core.tracing <trace_id | draft_id> [ficheiro.jsonl]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import queue
+import logging
+import secrets
+import threading
+import contextlib
+import contextvars
+
+TRACE_EXPORT_FILE = os.environ.get('TRACE_EXPORT_FILE', '')
+TRACE_COLLECTOR_URL = os.environ.get('TRACE_COLLECTOR_URL', '')
+TRACE_EXPORT_INTERVAL = float(os.environ.get('TRACE_EXPORT_INTERVAL', 2.0))
+TRACE_EXPORT_BATCH_SIZE = int(os.environ.get('TRACE_EXPORT_BATCH_SIZE', 256))
+# O rastreamento só está ativo se houver para onde exportar.
+TRACING_ENABLED = bool(TRACE_EXPORT_FILE or TRACE_COLLECTOR_URL)
+
+TRACEPARENT_HEADER = 'traceparent'
+_TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+_service_name = os.environ.get('TRACE_SERVICE_NAME', 'email-automation')
+_current_span = contextvars.ContextVar('current_span', default=None)
+_file_lock = threading.Lock()
+_collector_queue = None
+_collector_lock = threading.Lock()
+
+
+class Span:
+    """Um span: uma etapa com início, fim, atributos e, em caso de erro, a mensagem."""
+
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'start_ns', 'end_ns', 'attributes', 'error', '_token')
+
+    def __init__(self, name, trace_id, parent_id=None, attributes=None):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        self.error = None
+        self._token = None
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def activate(self):
+        self._token = _current_span.set(self)
+        return self
+
+    def finish(self, error=None):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f"{error.__class__.__name__}: {error}"
+        if self._token is not None:
+            try:
+                _current_span.reset(self._token)
+            except ValueError:
+                _current_span.set(None)  # Terminado noutro contexto (ex: sinais do Celery).
+            self._token = None
+        _export(self)
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id, 'span_id': self.span_id, 'parent_id': self.parent_id,
+            'name': self.name, 'service': _service_name, 'start_ns': self.start_ns,
+            'duration_ms': round((self.end_ns - self.start_ns) / 1e6, 3),
+            'attributes': self.attributes, 'error': self.error,
+        }
+
+
+def set_service_name(name):
+    """Nome do processo nos spans exportados (ex: 'web' ou 'worker')."""
+    global _service_name
+    _service_name = name
+
+def parse_traceparent(header):
+    """Devolve (trace_id, span_id) de um cabeçalho traceparent válido, ou None."""
+    match = _TRACEPARENT_RE.match((header or '').strip().lower())
+    if not match or match.group(1) == '0' * 32 or match.group(2) == '0' * 16:
+        return None
+    return match.group(1), match.group(2)
+
+def current_span():
+    return _current_span.get()
+
+def current_traceparent():
+    span = _current_span.get()
+    return span.traceparent if span is not None else None
+
+def set_attribute(key, value):
+    """Acrescenta um atributo ao span atual (ex: o id do rascunho criado), se existir."""
+    span = _current_span.get()
+    if span is not None:
+        span.set_attribute(key, value)
+
+
+def begin_span(name, traceparent=None, attributes=None):
+    """
+    Abre e ativa um span, filho do span atual ou do 'traceparent' recebido (ex: de um
+    pedido HTTP ou dos cabeçalhos de uma tarefa). Fechar com span.finish(). Devolve None
+    com o rastreamento desativado.
+    """
+    if not TRACING_ENABLED:
+        return None
+    parent = _current_span.get()
+    if parent is not None and traceparent is None:
+        trace_id, parent_id = parent.trace_id, parent.span_id
+    elif context := parse_traceparent(traceparent):
+        trace_id, parent_id = context
+    else:
+        trace_id, parent_id = secrets.token_hex(16), None
+    return Span(name, trace_id, parent_id, attributes).activate()
+
+@contextlib.contextmanager
+def start_span(name, attributes=None, traceparent=None):
+    span = begin_span(name, traceparent, attributes)
+    if span is None:
+        yield None
+        return
+    try:
+        yield span
+    except BaseException as e:
+        span.finish(e)
+        raise
+    span.finish()
+
+
+# --- EXPORTAÇÃO ---
+
+def _export(span):
+    if TRACE_EXPORT_FILE:
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str) + '\n'
+        try:
+            with _file_lock, open(TRACE_EXPORT_FILE, 'a', encoding='utf-8') as f:
+                f.write(line)
+        except OSError as e:
+            logging.warning(f"Não foi possível escrever o span em {TRACE_EXPORT_FILE}: {e}")
+    if TRACE_COLLECTOR_URL:
+        _get_collector_queue().put(span)
+
+def _get_collector_queue():
+    global _collector_queue
+    if _collector_queue is None or _collector_queue[1] != os.getpid():
+        with _collector_lock:
+            if _collector_queue is None or _collector_queue[1] != os.getpid():
+                # Uma thread de envio por processo (recriada após um fork do worker prefork).
+                spans = queue.Queue(maxsize=10000)
+                threading.Thread(target=_collector_loop, args=(spans,), name='trace-exporter', daemon=True).start()
+                _collector_queue = (spans, os.getpid())
+    return _collector_queue[0]
+
+def _otlp_attribute(key, value):
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+def to_otlp(spans):
+    """Corpo OTLP/HTTP JSON (resourceSpans) para um lote de spans."""
+    otlp_spans = []
+    for span in spans:
+        otlp_span = {
+            'traceId': span.trace_id, 'spanId': span.span_id, 'name': span.name, 'kind': 1,
+            'startTimeUnixNano': str(span.start_ns), 'endTimeUnixNano': str(span.end_ns),
+            'attributes': [_otlp_attribute(key, value) for key, value in span.attributes.items()],
+            'status': {'code': 2, 'message': span.error} if span.error else {'code': 1},
+        }
+        if span.parent_id:
+            otlp_span['parentSpanId'] = span.parent_id
+        otlp_spans.append(otlp_span)
+    return {'resourceSpans': [{
+        'resource': {'attributes': [_otlp_attribute('service.name', _service_name)]},
+        'scopeSpans': [{'scope': {'name': 'core.tracing'}, 'spans': otlp_spans}],
+    }]}
+
+def _collector_loop(spans):
+    import requests
+    session = requests.Session()
+    while True:
+        batch = [spans.get()]
+        deadline = time.monotonic() + TRACE_EXPORT_INTERVAL
+        while len(batch) < TRACE_EXPORT_BATCH_SIZE and (remaining := deadline - time.monotonic()) > 0:
+            try:
+                batch.append(spans.get(timeout=remaining))
+            except queue.Empty:
+                break
+        try:
+            session.post(TRACE_COLLECTOR_URL, json=to_otlp(batch), timeout=10).raise_for_status()
+        except Exception as e:
+            logging.warning(f"Falha ao enviar {len(batch)} spans para {TRACE_COLLECTOR_URL}: {e}")
+
+
+# --- LINHA TEMPORAL A PARTIR DO JSONL ---
+
+def print_timeline(key, path=TRACE_EXPORT_FILE):
+    """Imprime os spans do trace com este id, ou do trace que criou o rascunho com este id."""
+    with open(path, 'r', encoding='utf-8') as f:
+        spans = [json.loads(line) for line in f if line.strip()]
+    trace_ids = {span['trace_id'] for span in spans if key in (span['trace_id'], span['attributes'].get('draft.id'))}
+    for trace_id in sorted(trace_ids):
+        trace = sorted((span for span in spans if span['trace_id'] == trace_id), key=lambda span: span['start_ns'])
+        started = trace[0]['start_ns']
+        depth = {}
+        print(f"trace {trace_id}")
+        for span in trace:
+            depth[span['span_id']] = depth.get(span['parent_id'], -1) + 1
+            offset_ms = (span['start_ns'] - started) / 1e6
+            error = f"  ERRO: {span['error']}" if span['error'] else ''
+            print(f"  {offset_ms:10.1f} ms  {span['duration_ms']:10.1f} ms  {'  ' * depth[span['span_id']]}{span['name']} [{span['service']}]{error}")
+    if not trace_ids:
+        print(f"Nenhum span encontrado para {key}.")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+    print_timeline(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else TRACE_EXPORT_FILE)
@@ -0,0 +1,95 @@
+# core/triage.py
+
+import os
+import re
+import json
+import logging
+import threading
+
+# Triagem local antes de qualquer chamada ao LLM: newsletters, notificações automáticas e
+# recibos não precisam de rascunho. Primeiro as heurísticas de cabeçalhos (custo ~zero);
+# depois, se houver exemplos rotulados, um classificador pelo centroide mais próximo.
+TRIAGE_ENABLED = os.environ.get('TRIAGE_ENABLED', '1') == '1'
+# JSONL com {"text": "...", "needs_reply": true|false} por linha; vazio desativa o classificador.
+TRIAGE_EXAMPLES_FILE = os.environ.get('TRIAGE_EXAMPLES_FILE', '')
+# Margem mínima de similaridade para o classificador descartar um email (na dúvida, responde-se).
+TRIAGE_MIN_MARGIN = float(os.environ.get('TRIAGE_MIN_MARGIN', 0.05))
+
+# Separadores do Gmail cujas mensagens são descartadas (lista separada por vírgulas).
+SKIP_CATEGORY_LABELS = set(filter(None, os.environ.get(
+    'TRIAGE_SKIP_CATEGORIES', 'CATEGORY_PROMOTIONS,CATEGORY_SOCIAL,CATEGORY_UPDATES,CATEGORY_FORUMS'
+).split(',')))
+BULK_PRECEDENCE = {'bulk', 'list', 'junk', 'auto_reply'}
+AUTO_REPLY_HEADERS = {'x-autoreply', 'x-autorespond'}
+LIST_HEADERS = {'list-unsubscribe', 'list-id'}
+
+# Ao contrário dos generic_keywords de parse_sender_info (ex: 'secretaria', que pode pedir
+# uma resposta), estes remetentes nunca leem respostas.
+_NOREPLY_SENDER_RE = re.compile(
+    r'(?:^|[<\s"\'])(?:no[-_.]?reply|do[-_.]?not[-_.]?reply|mailer-daemon|postmaster|bounces?|notifications?)[^@\s]*@',
+    re.IGNORECASE
+)
+
+_classifier = None
+_classifier_loaded = False
+_classifier_lock = threading.Lock()
+
+
+def header_verdict(message):
+    """Motivo pelo qual os cabeçalhos/etiquetas do Gmail indicam um email sem resposta, ou None."""
+    payload = message.get('payload', {})
+    headers = {h['name'].lower(): h['value'] for h in payload.get('headers', [])}
+
+    if category := SKIP_CATEGORY_LABELS.intersection(message.get('labelIds', [])):
+        return f"etiqueta {min(category)}"
+    if headers.get('auto-submitted', 'no').strip().lower() != 'no':
+        return "Auto-Submitted"
+    if headers.get('precedence', '').strip().lower() in BULK_PRECEDENCE:
+        return f"Precedence: {headers['precedence'].strip()}"
+    if header := next((name for name in (*LIST_HEADERS, *AUTO_REPLY_HEADERS) if name in headers), None):
+        return header
+    if payload.get('mimeType', '').lower() == 'multipart/report':
+        return "relatório de entrega"
+    if _NOREPLY_SENDER_RE.search(headers.get('from', '')) or _NOREPLY_SENDER_RE.search(headers.get('reply-to', '')):
+        return "remetente no-reply"
+    return None
+
+
+def load_examples(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [(item['text'], bool(item['needs_reply'])) for item in map(json.loads, filter(str.strip, f))]
+
+def get_classifier():
+    """Classificador construído uma vez por processo a partir de TRIAGE_EXAMPLES_FILE, ou None."""
+    global _classifier, _classifier_loaded
+    if not _classifier_loaded:
+        with _classifier_lock:
+            if not _classifier_loaded:
+                if TRIAGE_EXAMPLES_FILE:
+                    try:
+                        from core.retrieval import CentroidClassifier
+                        _classifier = CentroidClassifier(load_examples(TRIAGE_EXAMPLES_FILE))
+                        logging.info(f"Classificador de triagem carregado de {TRIAGE_EXAMPLES_FILE}.")
+                    except Exception as e:
+                        logging.error(f"Classificador de triagem indisponível: {e}")
+                _classifier_loaded = True
+    return _classifier
+
+
+def triage_message(message, body_text):
+    """
+    Decide se uma mensagem do Gmail precisa de rascunho. Devolve (precisa_resposta, motivo).
+    Só descarta com um sinal forte: cabeçalhos de envio automático/em massa ou uma previsão
+    do classificador com margem acima de TRIAGE_MIN_MARGIN.
+    """
+    if not TRIAGE_ENABLED:
+        return True, "triagem desativada"
+    if reason := header_verdict(message):
+        return False, reason
+
+    classifier = get_classifier()
+    if classifier is not None and body_text:
+        needs_reply, margin = classifier.predict(body_text)
+        if not needs_reply and margin >= TRIAGE_MIN_MARGIN:
+            return False, f"classificador (margem {margin:.2f})"
+    return True, "sem sinais de envio automático"
@@ -26,6 +26,7 @@ const refinementControlsEl = document.getElementById('refinementControls');
 const feedbackBtn = document.getElementById('feedbackBtn');
 const feedbackSuccessMessageEl = document.getElementById('feedbackSuccessMessage');
 const fetchEmailsBtn = document.getElementById('fetchEmailsBtn');
+const loadMoreEmailsBtn = document.getElementById('loadMoreEmailsBtn');
 const emailListEl = document.getElementById('emailList');
 const gmailSpinnerEl = document.getElementById('gmailSpinner');
 const gmailErrorEl = document.getElementById('gmailError');
@@ -93,6 +94,9 @@ const manageBaseMemoryBtn = document.getElementById('manageBaseMemoryBtn');
 const navButtons = document.querySelectorAll('.nav-btn');
 const views = document.querySelectorAll('.view');
 const draftsTableBody = document.getElementById('draftsTableBody');
+const selectAllDraftsCheckbox = document.getElementById('selectAllDrafts');
+const bulkDraftActionsEl = document.getElementById('bulkDraftActions');
+const bulkSelectedCountEl = document.getElementById('bulkSelectedCount');
 const statusChartCanvas = document.getElementById('statusChart');
 const kpiValues = document.querySelectorAll('.kpi-value');
 const chartCenterMetric = document.getElementById('chartCenterMetric');
@@ -114,10 +118,15 @@ let lastGeneratedDraftForFeedback = "";
 let currentOriginalSenderEmail = "";
 let currentOriginalSubject = "";
 let currentThreadId = "";
+let nextEmailsPageToken = null;
 let resolveSendConfirmation;
 let personaToDeleteKey = null;
 let statusChart = null;
 let currentView = 'dashboard';
+let nextDraftsCursor = null;
+let dashboardEventsConnected = false;
+let dashboardPollTimer = null;
+const DASHBOARD_POLL_INTERVAL_MS = 30000;
 
 // --- Funções Auxiliares ---
 function showSpinner(spinner) { if (spinner) spinner.style.display = 'inline-block'; }
@@ -161,6 +170,7 @@ document.addEventListener('DOMContentLoaded', () => {
     if (isLoggedIn) {
         initializeMainApp();
         fetchDashboardData();
+        subscribeToDashboardEvents();
     }
 
     navButtons.forEach(btn => {
@@ -195,7 +205,8 @@ function initializeMainApp() {
     refinementControlsEl.addEventListener('click', handleRefinement);
     feedbackBtn.addEventListener('click', openFeedbackModal);
     document.getElementById('submitFeedbackBtn').addEventListener('click', submitFeedback);
-    fetchEmailsBtn.addEventListener('click', fetchAndRenderEmails);
+    fetchEmailsBtn.addEventListener('click', () => fetchAndRenderEmails());
+    loadMoreEmailsBtn?.addEventListener('click', () => fetchAndRenderEmails(nextEmailsPageToken));
     emailListEl.addEventListener('click', handleEmailClick);
     sendEmailBtn.addEventListener('click', handleSendEmail);
     backToSelectBtn.addEventListener('click', () => showStep(1));
@@ -217,6 +228,11 @@ function initializeMainApp() {
     personasTableBody.addEventListener('click', handlePersonaTableClick);
     confirmDeletePersonaBtn.addEventListener('click', deletePersona);
     draftsTableBody.addEventListener('click', handleDraftAction);
+    document.getElementById('loadMoreDraftsBtn')?.addEventListener('click', loadMoreDrafts);
+    draftsTableBody.addEventListener('change', updateBulkSelection);
+    selectAllDraftsCheckbox?.addEventListener('change', toggleSelectAllDrafts);
+    document.getElementById('bulkSendDraftsBtn')?.addEventListener('click', () => handleBulkDraftAction('send'));
+    document.getElementById('bulkRejectDraftsBtn')?.addEventListener('click', () => handleBulkDraftAction('rejected'));
     memoryForm.addEventListener('submit', handleMemoryFormSubmit);
     cancelEditMemoryBtn.addEventListener('click', clearMemoryForm);
     memoryTableBody.addEventListener('click', handleMemoryTableClick);
@@ -239,17 +255,24 @@ function showStep(stepNumber) {
     });
 }
 
-async function fetchAndRenderEmails() {
+async function fetchAndRenderEmails(pageToken = null) {
     showSpinner(gmailSpinnerEl);
     hideError(gmailErrorEl);
-    emailListEl.innerHTML = '<li class="list-group-item text-secondary">A carregar emails...</li>';
+    if (!pageToken) {
+        emailListEl.innerHTML = '<li class="list-group-item text-secondary">A carregar emails...</li>';
+    }
+    if (loadMoreEmailsBtn) loadMoreEmailsBtn.disabled = true;
     try {
-        const response = await fetch('/api/emails');
+        const url = pageToken ? `/api/emails?page_token=${encodeURIComponent(pageToken)}` : '/api/emails';
+        const response = await fetch(url);
         if (!response.ok) throw new Error(`Erro: ${response.statusText}`);
-        const emails = await response.json();
-        emailListEl.innerHTML = '';
-        if (emails.error) throw new Error(emails.error);
-        if (emails.length === 0) {
+        const data = await response.json();
+        if (data.error) throw new Error(data.error);
+        const emails = data.emails || [];
+        nextEmailsPageToken = data.next_page_token || null;
+        if (loadMoreEmailsBtn) loadMoreEmailsBtn.style.display = nextEmailsPageToken ? 'inline-block' : 'none';
+        if (!pageToken) emailListEl.innerHTML = '';
+        if (emails.length === 0 && !pageToken) {
             emailListEl.innerHTML = '<li class="list-group-item text-secondary">Nenhum email encontrado.</li>';
             return;
         }
@@ -264,10 +287,15 @@ async function fetchAndRenderEmails() {
             `;
             emailListEl.appendChild(li);
         });
+        const failedCount = (data.failed || []).length;
+        if (failedCount > 0) {
+            showError(gmailErrorEl, `${failedCount} ${failedCount === 1 ? 'email não pôde' : 'emails não puderam'} ser carregados (limite da API do Gmail). Tente atualizar a lista.`);
+        }
     } catch (error) {
         showError(gmailErrorEl, error.message);
     } finally {
         hideSpinner(gmailSpinnerEl);
+        if (loadMoreEmailsBtn) loadMoreEmailsBtn.disabled = false;
     }
 }
 
@@ -899,16 +927,83 @@ async function fetchDashboardData() {
         if (!response.ok) throw new Error('Falha ao carregar estatísticas.');
         const data = await response.json();
         if(data.error) throw new Error(data.error);
-        updateKPICards(data);
+        applyDashboardCounts(data);
         updateDraftsTable(data.drafts);
-        updateStatusChart(data);
-        const sentPercentage = data.total > 0 ? Math.round(((data.sent || 0) / data.total) * 100) : 0;
-        chartCenterMetric.textContent = `${sentPercentage}%`;
+        setNextDraftsCursor(data.next_cursor);
     } catch (error) {
         console.error('Erro ao carregar dados do dashboard:', error);
     }
 }
 
+function applyDashboardCounts(counts) {
+    updateKPICards(counts);
+    updateStatusChart(counts);
+    const sentPercentage = counts.total > 0 ? Math.round(((counts.sent || 0) / counts.total) * 100) : 0;
+    chartCenterMetric.textContent = `${sentPercentage}%`;
+}
+
+// Sem eventos (navegador sem EventSource, eventos desativados ou Redis inacessível),
+// o dashboard volta a pedir as estatísticas periodicamente enquanto estiver visível.
+function startDashboardPolling() {
+    if (dashboardPollTimer) return;
+    dashboardPollTimer = setInterval(() => {
+        if (currentView === 'dashboard' && !document.hidden) fetchDashboardData();
+    }, DASHBOARD_POLL_INTERVAL_MS);
+}
+
+// Recebe os eventos de rascunhos por Server-Sent Events e atualiza o dashboard
+// incrementalmente, sem voltar a pedir as estatísticas completas.
+function subscribeToDashboardEvents() {
+    if (!window.EventSource) {
+        startDashboardPolling();
+        return;
+    }
+    const source = new EventSource('/api/events');
+    source.onopen = () => { dashboardEventsConnected = true; };
+    source.onerror = () => {
+        dashboardEventsConnected = false;
+        // Uma resposta 204/503 fecha a ligação de vez; erros de rede voltam a ligar sozinhos.
+        if (source.readyState === EventSource.CLOSED) startDashboardPolling();
+    };
+
+    source.addEventListener('draft_created', event => {
+        const { draft, counts } = JSON.parse(event.data);
+        applyDashboardCounts(counts);
+        if (draftsTableBody.querySelector(`tr[data-draft-id="${draft.id}"]`)) return;
+        if (!draftsTableBody.querySelector('tr[data-draft-id]')) draftsTableBody.innerHTML = '';
+        draftsTableBody.prepend(buildDraftRow(draft));
+    });
+
+    source.addEventListener('status_changed', event => {
+        const { draft, counts } = JSON.parse(event.data);
+        applyDashboardCounts(counts);
+        if (draft.status === 'pending') return;
+        draftsTableBody.querySelector(`tr[data-draft-id="${draft.id}"]`)?.remove();
+        if (!draftsTableBody.querySelector('tr[data-draft-id]')) updateDraftsTable([]);
+        updateBulkSelection();
+    });
+}
+
+async function loadMoreDrafts() {
+    if (!nextDraftsCursor) return;
+    try {
+        const response = await fetch(`/api/dashboard_stats?cursor=${encodeURIComponent(nextDraftsCursor)}`);
+        if (!response.ok) throw new Error('Falha ao carregar mais rascunhos.');
+        const data = await response.json();
+        if (data.error) throw new Error(data.error);
+        updateDraftsTable(data.drafts, true);
+        setNextDraftsCursor(data.next_cursor);
+    } catch (error) {
+        console.error('Erro ao carregar mais rascunhos:', error);
+    }
+}
+
+function setNextDraftsCursor(cursor) {
+    nextDraftsCursor = cursor || null;
+    const loadMoreBtn = document.getElementById('loadMoreDraftsBtn');
+    if (loadMoreBtn) loadMoreBtn.style.display = nextDraftsCursor ? 'inline-block' : 'none';
+}
+
 function updateKPICards(data) {
     const animateCount = (element, endValue) => {
         const startValue = parseInt(element.dataset.count, 10) || 0;
@@ -924,33 +1019,38 @@ function updateKPICards(data) {
     });
 }
 
-function updateDraftsTable(drafts) {
-    draftsTableBody.innerHTML = '';
-    if (!drafts || drafts.length === 0) {
-        draftsTableBody.innerHTML = '<tr><td colspan="4" class="text-center text-secondary p-4">Nenhum rascunho pendente.</td></tr>';
+function updateDraftsTable(drafts, append = false) {
+    if (!append) draftsTableBody.innerHTML = '';
+    if ((!drafts || drafts.length === 0) && !append) {
+        draftsTableBody.innerHTML = '<tr><td colspan="5" class="text-center text-secondary p-4">Nenhum rascunho pendente.</td></tr>';
+        updateBulkSelection();
         return;
     }
-    drafts.forEach(draft => {
-        const tr = document.createElement('tr');
-        tr.dataset.draftId = draft.id;
-        tr.innerHTML = `
-            <td>${escapeHtml(draft.recipient)}</td>
-            <td>${escapeHtml(draft.subject)}</td>
-            <td>${new Date(draft.created_at).toLocaleDateString('pt-PT')}</td>
-            <td class="draft-actions">
-                <button class="action-btn review" data-draft-id="${draft.id}" title="Rever e Editar Antes de Enviar">
-                    <i class="fas fa-edit"></i>
-                </button>
-                <button class="action-btn approve" data-draft-id="${draft.id}" title="Aprovar e Enviar Sem Rever">
-                    <i class="fas fa-check"></i>
-                </button>
-                <button class="action-btn reject" data-draft-id="${draft.id}" title="Rejeitar Rascunho">
-                    <i class="fas fa-times"></i>
-                </button>
-            </td>
-        `;
-        draftsTableBody.appendChild(tr);
-    });
+    drafts.forEach(draft => draftsTableBody.appendChild(buildDraftRow(draft)));
+    updateBulkSelection();
+}
+
+function buildDraftRow(draft) {
+    const tr = document.createElement('tr');
+    tr.dataset.draftId = draft.id;
+    tr.innerHTML = `
+        <td><input type="checkbox" class="form-check-input draft-select" value="${draft.id}"></td>
+        <td>${escapeHtml(draft.recipient)}</td>
+        <td>${escapeHtml(draft.subject)}</td>
+        <td>${new Date(draft.created_at).toLocaleDateString('pt-PT')}</td>
+        <td class="draft-actions">
+            <button class="action-btn review" data-draft-id="${draft.id}" title="Rever e Editar Antes de Enviar">
+                <i class="fas fa-edit"></i>
+            </button>
+            <button class="action-btn approve" data-draft-id="${draft.id}" title="Aprovar e Enviar Sem Rever">
+                <i class="fas fa-check"></i>
+            </button>
+            <button class="action-btn reject" data-draft-id="${draft.id}" title="Rejeitar Rascunho">
+                <i class="fas fa-times"></i>
+            </button>
+        </td>
+    `;
+    return tr;
 }
 
 function updateStatusChart(data) {
@@ -1030,7 +1130,9 @@ async function handleDraftAction(event) {
                 if (draftsTableBody.children.length === 0) {
                     updateDraftsTable([]);
                 }
-                fetchDashboardData();
+                updateBulkSelection();
+                // Com o canal de eventos ligado, os contadores já chegam por SSE.
+                if (!dashboardEventsConnected) fetchDashboardData();
             }, 500);
         }
     } catch (error) {
@@ -1040,6 +1142,66 @@ async function handleDraftAction(event) {
     }
 }
 
+// --- Ações em massa sobre rascunhos ---
+function getSelectedDraftIds() {
+    return Array.from(draftsTableBody.querySelectorAll('.draft-select:checked')).map(checkbox => checkbox.value);
+}
+
+function updateBulkSelection() {
+    const selectedCount = getSelectedDraftIds().length;
+    const totalCount = draftsTableBody.querySelectorAll('.draft-select').length;
+    if (bulkSelectedCountEl) bulkSelectedCountEl.textContent = `${selectedCount} selecionados`;
+    if (bulkDraftActionsEl) bulkDraftActionsEl.style.setProperty('display', selectedCount > 0 ? 'flex' : 'none', 'important');
+    if (selectAllDraftsCheckbox) {
+        selectAllDraftsCheckbox.checked = totalCount > 0 && selectedCount === totalCount;
+        selectAllDraftsCheckbox.indeterminate = selectedCount > 0 && selectedCount < totalCount;
+    }
+}
+
+function toggleSelectAllDrafts() {
+    draftsTableBody.querySelectorAll('.draft-select').forEach(checkbox => { checkbox.checked = selectAllDraftsCheckbox.checked; });
+    updateBulkSelection();
+}
+
+async function handleBulkDraftAction(action) {
+    const draftIds = getSelectedDraftIds();
+    if (draftIds.length === 0) return;
+    const verb = action === 'send' ? 'enviar' : 'rejeitar';
+    if (!confirm(`Tem a certeza que quer ${verb} ${draftIds.length} rascunho(s)?`)) return;
+
+    const buttons = bulkDraftActionsEl.querySelectorAll('button');
+    buttons.forEach(btn => { btn.disabled = true; });
+    const url = action === 'send' ? '/api/drafts/bulk_send' : '/api/drafts/bulk_status';
+    const payload = action === 'send' ? { ids: draftIds } : { ids: draftIds, status: action };
+
+    try {
+        const response = await fetch(url, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(payload)
+        });
+        const data = await response.json();
+        if (!response.ok) throw new Error(data.error || 'Falha ao processar o pedido.');
+
+        data.results.filter(result => result.ok).forEach(result => {
+            draftsTableBody.querySelector(`tr[data-draft-id="${result.id}"]`)?.remove();
+        });
+        if (!draftsTableBody.querySelector('tr[data-draft-id]')) updateDraftsTable([]);
+        updateBulkSelection();
+        if (!dashboardEventsConnected) fetchDashboardData();
+
+        if (data.failed > 0) {
+            const failures = data.results.filter(result => !result.ok).map(result => `${result.id}: ${result.error}`);
+            alert(`${data.succeeded} processados, ${data.failed} falharam:\n${failures.join('\n')}`);
+        }
+    } catch (error) {
+        console.error(`Erro ao ${verb} rascunhos em massa:`, error);
+        alert(`Não foi possível processar os rascunhos: ${error.message}`);
+    } finally {
+        buttons.forEach(btn => { btn.disabled = false; });
+    }
+}
+
 async function openReviewModal(draftId) {
     const reviewErrorEl = document.getElementById('reviewError');
     hideError(reviewErrorEl);
@@ -1085,7 +1247,7 @@ async function handleSaveAndApprove() {
         if (!sendResponse.ok) throw new Error("Alterações guardadas, mas falha ao enviar o email.");
 
         reviewDraftModalInstance.hide();
-        await fetchDashboardData();
+        if (!dashboardEventsConnected) await fetchDashboardData();
 
     } catch (error) {
         showError(reviewErrorEl, error.message);